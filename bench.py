@@ -0,0 +1,473 @@
+"""Офлайн-бенчмарки графика дежурств на сгенерированных таблицах (без доступа к Google Sheets)
+
+Запуск: python bench.py --suite all --output bench_results.json
+Сравнение с прошлым запуском: python bench.py --compare bench_results.json
+Время запуска сборок: python bench.py --suite startup --binary dist/duty_schedule --binary dist/DutySchedule_Debug/DutySchedule_Debug
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from datetime import date, datetime
+
+os.environ.setdefault('GOOGLE_SHEET_URL', 'https://docs.google.com/spreadsheets/d/offline-bench')
+os.environ.setdefault('SNAPSHOT_FILE', '')
+
+import duty_app
+from fake_sheets import FakeWorksheet, generate_grid, install_fake_client
+
+
+# =============================================================================
+# ИСХОДНАЯ РЕАЛИЗАЦИЯ ПАРСЕРА (для сравнения)
+# =============================================================================
+
+def legacy_is_date_cell(cell_value):
+    if not cell_value:
+        return False
+
+    cell_value = str(cell_value).strip()
+    date_pattern_full = r'^\d{1,2}\.\d{1,2}\.\d{4}$'
+    date_pattern_short = r'^\d{1,2}\.\d{1,2}$'
+
+    return bool(re.match(date_pattern_full, cell_value) or re.match(date_pattern_short, cell_value))
+
+
+def legacy_parse_date_cell(date_str):
+    try:
+        date_str = str(date_str).strip()
+
+        if re.match(r'^\d{1,2}\.\d{1,2}\.\d{4}$', date_str):
+            return datetime.strptime(date_str, '%d.%m.%Y').date()
+        elif re.match(r'^\d{1,2}\.\d{1,2}$', date_str):
+            current_year = datetime.now().year
+            date_with_year = f"{date_str}.{current_year}"
+            return datetime.strptime(date_with_year, '%d.%m.%Y').date()
+
+        return None
+    except ValueError:
+        return None
+
+
+def legacy_parse_schedule_grid(all_values):
+    """Парсер в том виде, в каком он был до оптимизации"""
+    logger = duty_app.logger
+    schedule = []
+    found_dates = []
+
+    for row_idx, row in enumerate(all_values):
+        for col_idx, cell_value in enumerate(row):
+            if legacy_is_date_cell(cell_value):
+                date_value = legacy_parse_date_cell(cell_value)
+
+                if date_value:
+                    if row_idx + 1 < len(all_values):
+                        duty_person_cell = all_values[row_idx + 1][col_idx]
+                        duty_person = duty_app.clean_name.__wrapped__(duty_person_cell)
+
+                        if duty_person:
+                            schedule_item = {
+                                'date': date_value,
+                                'name': duty_person,
+                                'date_str': cell_value.strip(),
+                                'raw_name': duty_person_cell,
+                                'cell_location': f"{chr(65 + col_idx)}{row_idx + 1}",
+                                'weekday': duty_app.get_weekday_name(date_value)
+                            }
+                            schedule.append(schedule_item)
+                            found_dates.append({
+                                'date': date_value,
+                                'original': cell_value.strip(),
+                                'location': f"{chr(65 + col_idx)}{row_idx + 1}",
+                                'duty': duty_person
+                            })
+
+    logger.info(f"Найдено записей о дежурствах: {len(schedule)}")
+    for found in found_dates:
+        logger.info(f"   {found['date'].strftime('%d.%m.%Y')} ({found['original']}) -> {found['duty']} [{found['location']}]")
+
+    return schedule
+
+
+# =============================================================================
+# ЗАМЕРЫ
+# =============================================================================
+
+def best_time(func, arg, repeat):
+    """Лучшее время из repeat запусков (секунды) и результат последнего"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(arg)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def screen_address(index):
+    """IP-адрес условного экрана: лимиты запросов считаются по адресу клиента"""
+    return f"10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def micro(name, func, inputs, repeat):
+    """Микробенчмарк: func вызывается для каждого из inputs, берется лучший проход"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for value in inputs:
+            func(value)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    ns_per_op = best / len(inputs) * 1e9
+    print(f"   {name:<28} {ns_per_op:12.0f} нс/вызов")
+    return {'ns_per_op': ns_per_op, 'ops_per_sec': len(inputs) / best, 'calls': len(inputs)}
+
+
+def as_legacy_dict(duty):
+    """Запись в виде словаря исходного парсера"""
+    return {
+        'date': duty.date,
+        'name': duty.name,
+        'date_str': duty.date_str,
+        'raw_name': duty.raw_name,
+        'cell_location': duty.cell_location,
+        'weekday': duty.weekday
+    }
+
+
+def retained_bytes(func, arg):
+    """Сколько памяти удерживает результат func(arg) (байты)"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func(arg)
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return retained
+
+
+def bench_parser(rows, cols, repeat):
+    grid = generate_grid(rows, cols)
+    cells = rows * cols
+
+    legacy_time, legacy_result = best_time(legacy_parse_schedule_grid, grid, repeat)
+    current_time, current_result = best_time(duty_app.parse_schedule_grid, grid, repeat)
+
+    if legacy_result != [as_legacy_dict(duty) for duty in current_result]:
+        raise AssertionError("Результаты нового и исходного парсера различаются")
+
+    legacy_memory = retained_bytes(legacy_parse_schedule_grid, grid)
+    current_memory = retained_bytes(duty_app.parse_schedule_grid, grid)
+
+    print(f"📊 Таблица {rows} × {cols} ({cells} ячеек), записей: {len(current_result)}")
+    print(f"   исходный парсер:  {legacy_time * 1000:9.1f} мс ({cells / legacy_time / 1e6:.2f} млн ячеек/с)")
+    print(f"   текущий парсер:   {current_time * 1000:9.1f} мс ({cells / current_time / 1e6:.2f} млн ячеек/с)")
+    print(f"   ускорение:        {legacy_time / current_time:9.1f}×")
+    print(f"   память записей:   {legacy_memory / len(legacy_result):9.0f} -> {current_memory / len(current_result):.0f} байт/запись")
+
+    return {
+        'rows': rows,
+        'cols': cols,
+        'records': len(current_result),
+        'legacy_ms': legacy_time * 1000,
+        'current_ms': current_time * 1000,
+        'speedup': legacy_time / current_time,
+        'legacy_bytes_per_record': legacy_memory / len(legacy_result),
+        'current_bytes_per_record': current_memory / len(current_result)
+    }
+
+
+def rebuild_display_weeks(schedule):
+    """Построение вида недель без сохранённого результата"""
+    schedule.week_view = None
+    return duty_app.get_display_weeks(schedule)
+
+
+def bench_micro(rows, cols, repeat):
+    """Микробенчмарки функций парсинга и подготовки экрана"""
+    grid = generate_grid(rows, cols)
+    date_cells = [cell for row in grid for cell in row if duty_app.is_date_cell(cell)]
+    # Ячейки с именами - под каждой датой
+    name_cells = [grid[row_idx + 1][col_idx]
+                  for row_idx, row in enumerate(grid[:-1])
+                  for col_idx, cell in enumerate(row)
+                  if duty_app.is_date_cell(cell) and grid[row_idx + 1][col_idx]]
+    worksheet = FakeWorksheet(grid)
+    schedule = duty_app.as_schedule_index(duty_app.parse_schedule_grid(grid))
+
+    print(f"🔬 Микробенчмарки (таблица {rows} × {cols}, записей: {len(schedule)})")
+    results = {
+        'clean_name': micro('clean_name', duty_app.clean_name, name_cells, repeat),
+        'clean_name_uncached': micro('clean_name (без кэша)', duty_app.clean_name.__wrapped__, name_cells, repeat),
+        'parse_date_cell': micro('parse_date_cell', duty_app.parse_date_cell, date_cells, repeat),
+        'parse_schedule_data': micro('parse_schedule_data', duty_app.parse_schedule_data, [worksheet], repeat),
+        'get_display_weeks': micro('get_display_weeks', duty_app.get_display_weeks, [schedule] * 1000, repeat),
+        'get_display_weeks_uncached': micro('get_display_weeks (без кэша)', rebuild_display_weeks, [schedule] * 1000, repeat),
+    }
+    return results
+
+
+def bench_routes(rows, cols, requests_per_route):
+    """Пропускная способность и задержки маршрутов через тестовый клиент Flask"""
+    duty_app.start_background_refresher = lambda: None
+    today = date.today()
+    grid = generate_grid(rows, cols, start=date(today.year - 1, today.month, 1))
+    install_fake_client(duty_app, FakeWorksheet(grid))
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    duty_app.refresh_schedule_cache()
+
+    client = duty_app.app.test_client()
+    etag = client.get('/').headers.get('ETag')
+    scenarios = {
+        '/': {},
+        '/ (If-None-Match)': {'If-None-Match': etag},
+        '/refresh': {},
+        '/debug': {},
+    }
+
+    print(f"🌐 Маршруты (таблица {rows} × {cols}, запросов на маршрут: {requests_per_route})")
+    results = {}
+    for scenario_idx, (name, headers) in enumerate(scenarios.items()):
+        path = name.split(' ')[0]
+        latencies = []
+        statuses = {}
+        started = time.perf_counter()
+        for i in range(requests_per_route):
+            # Каждый запрос - отдельный экран, чтобы не упираться в лимит одного клиента
+            environ = {'REMOTE_ADDR': screen_address(scenario_idx * requests_per_route + i + 1)}
+            request_started = time.perf_counter()
+            response = client.get(path, headers=headers, environ_base=environ)
+            latencies.append(time.perf_counter() - request_started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        results[name] = {
+            'requests': requests_per_route,
+            'throughput_rps': requests_per_route / elapsed,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'status_codes': {str(code): count for code, count in sorted(statuses.items())}
+        }
+        print(f"   {name:<20} {results[name]['throughput_rps']:9.0f} запр/с   "
+              f"p50 {results[name]['p50_ms']:6.2f} мс   p95 {results[name]['p95_ms']:6.2f} мс   "
+              f"p99 {results[name]['p99_ms']:6.2f} мс   коды: {results[name]['status_codes']}")
+    return results
+
+
+def parse_importtime(stderr):
+    """Строки -X importtime: [(модуль, глубина, собственное мкс, накопленное мкс)]"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return modules
+
+
+def startup_env(rows, cols):
+    """Окружение для запуска приложения: фиктивная таблица и готовый снимок расписания"""
+    workdir = tempfile.mkdtemp(prefix='duty-startup-')
+    today = date.today()
+    schedule = duty_app.parse_schedule_grid(generate_grid(rows, cols, start=date(today.year - 1, today.month, 1)))
+    snapshot_file = os.path.join(workdir, 'schedule_snapshot.json')
+    with open(snapshot_file, 'w', encoding='utf-8') as f:
+        json.dump({'format': duty_app.SNAPSHOT_FORMAT, 'saved_at': time.time(),
+                   'records': duty_app.schedule_to_rows(schedule)}, f, ensure_ascii=False)
+
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': os.path.dirname(os.path.abspath(__file__)),
+        'SNAPSHOT_FILE': snapshot_file,
+        'GOOGLE_CREDENTIALS_FILE': os.path.join(workdir, 'missing-credentials.json'),
+    })
+    return workdir, env
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_response(cmd, env, cwd, timeout=60):
+    """Время от запуска процесса до первого HTTP-ответа главной страницы (секунды)"""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(cmd, env=dict(env, PORT=str(port)), cwd=cwd, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=5) as response:
+                    status = response.status
+                    body = response.read()
+            except urllib.error.HTTPError as e:
+                status, body = e.code, b''
+            except (urllib.error.URLError, ConnectionError):
+                if process.poll() is not None:
+                    raise RuntimeError(f"Процесс завершился при запуске: {' '.join(cmd)}")
+                time.sleep(0.01)
+                continue
+            return time.perf_counter() - started, status, len(body)
+        raise RuntimeError(f"Нет ответа за {timeout} с: {' '.join(cmd)}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def bench_startup(rows, cols, repeat, binaries):
+    """Время импорта (разбивка -X importtime) и время до первого ответа страницы"""
+    workdir, env = startup_env(rows, cols)
+
+    import_runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import duty_app'],
+                                env=env, cwd=workdir, capture_output=True, text=True, check=True)
+        import_runs.append(parse_importtime(output.stderr))
+    modules = min(import_runs, key=lambda run: run[-1][3])
+    total_ms = modules[-1][3] / 1000
+    # Прямые зависимости duty_app: строки глубины 1 перед ним (дочерние модули печатаются раньше родителя)
+    children = []
+    for module in reversed(modules[:-1]):
+        if module[1] == 0:
+            break
+        if module[1] == 1:
+            children.append(module)
+    direct = sorted(children, key=lambda module: -module[3])[:8]
+
+    deferred = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import gspread, google.oauth2.service_account'],
+                              env=env, cwd=workdir, capture_output=True, text=True, check=True)
+    deferred_ms = sum(module[3] for module in parse_importtime(deferred.stderr) if module[1] == 0) / 1000
+
+    print(f"🚀 Запуск (снимок: {rows} × {cols})")
+    print(f"   import duty_app:         {total_ms:9.1f} мс")
+    for name, _, _, cumulative_us in direct:
+        print(f"      {name:<28} {cumulative_us / 1000:9.1f} мс")
+    print(f"   отложено до загрузки:    {deferred_ms:9.1f} мс (gspread, google.oauth2)")
+
+    results = {
+        'import_ms': total_ms,
+        'deferred_import_ms': deferred_ms,
+        'imports': {name: cumulative_us / 1000 for name, _, _, cumulative_us in direct},
+        'first_response': {}
+    }
+
+    commands = {'python duty_app.py': [sys.executable, os.path.join(env['PYTHONPATH'], 'duty_app.py')]}
+    for binary in binaries:
+        commands[os.path.basename(os.path.dirname(binary)) + '/' + os.path.basename(binary)] = [os.path.abspath(binary)]
+
+    for name, cmd in commands.items():
+        best = None
+        for _ in range(repeat):
+            elapsed, status, size = time_to_first_response(cmd, env, workdir)
+            best = elapsed if best is None else min(best, elapsed)
+        results['first_response'][name] = {'ms': best * 1000, 'status': status, 'bytes': size}
+        print(f"   первый ответ {name:<28} {best * 1000:9.1f} мс (код {status}, {size} байт)")
+
+    return results
+
+
+# =============================================================================
+# РЕЗУЛЬТАТЫ
+# =============================================================================
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    """Плоский словарь числовых показателей: 'routes./.p50_ms' -> значение"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(previous, current):
+    """Сравнение показателей времени с прошлым запуском"""
+    old = flatten(previous.get('results', {}))
+    new = flatten(current['results'])
+    print(f"📈 Сравнение с {previous.get('commit') or 'прошлым запуском'}:")
+    for name in sorted(new):
+        if name in old and old[name] and name.endswith(('_ms', 'ns_per_op')):
+            ratio = new[name] / old[name]
+            marker = '⚠️ ' if ratio > 1.1 else '   '
+            print(f"{marker}{name:<48} {old[name]:12.3f} -> {new[name]:12.3f} ({ratio:.2f}×)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарки графика дежурств")
+    parser.add_argument('--suite', choices=('parser', 'micro', 'routes', 'startup', 'all'), default='all')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--cols', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=500, help='запросов на маршрут')
+    parser.add_argument('--binary', action='append', default=[],
+                        help='собранное приложение для замера запуска (можно несколько: onefile и onedir)')
+    parser.add_argument('--output', help='файл для результатов в JSON')
+    parser.add_argument('--compare', help='JSON прошлого запуска для сравнения')
+    args = parser.parse_args()
+
+    results = {}
+    if args.suite in ('parser', 'all'):
+        results['parser'] = bench_parser(args.rows, args.cols, args.repeat)
+    if args.suite in ('micro', 'all'):
+        results['micro'] = bench_micro(min(args.rows, 2000), args.cols, args.repeat)
+    if args.suite in ('routes', 'all'):
+        results['routes'] = bench_routes(min(args.rows, 2000), args.cols, args.requests)
+    if args.suite in ('startup', 'all'):
+        results['startup'] = bench_startup(min(args.rows, 2000), args.cols, args.repeat, args.binary)
+
+    report = {
+        'commit': current_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'params': vars(args),
+        'results': results
+    }
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты сохранены: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
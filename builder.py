@@ -1,30 +1,49 @@
+import argparse
 import os
 import subprocess
 import sys
 
-def build_with_debug():
-    print("🔨 Сборка приложения с отладочной консолью...")
+# Модули, которые duty_app импортирует лениво: PyInstaller не видит их сам
+HIDDEN_IMPORTS = ['gspread', 'google.oauth2.service_account']
+
+def build_with_debug(onedir=False):
+    mode = 'onedir' if onedir else 'onefile'
+    print(f"🔨 Сборка приложения с отладочной консолью ({mode})...")
+    
+    hidden_imports = [arg for module in HIDDEN_IMPORTS for arg in ('--hidden-import', module)]
     
     # Команда сборки С консолью
     cmd = [
         'pyinstaller',
-        '--onefile',
+        # onedir запускается быстрее: при старте ничего не распаковывается во временную папку
+        '--onedir' if onedir else '--onefile',
+        *hidden_imports,
         '--add-data', 'templates;templates' if os.name == 'nt' else 'templates:templates',
         '--add-data', 'static;static' if os.name == 'nt' else 'static:static', 
         '--add-data', '.env;.' if os.name == 'nt' else '.env:.',
         '--add-data', 'credentials.json;.' if os.name == 'nt' else 'credentials.json:.',
         '--console',  # ВАЖНО: включаем консоль!
         '--name', 'DutySchedule_Debug',
-        'main.py'
+        'duty_app.py'
     ]
     
+    exe_name = 'DutySchedule_Debug.exe' if os.name == 'nt' else 'DutySchedule_Debug'
+    exe_path = os.path.join('dist', 'DutySchedule_Debug', exe_name) if onedir else os.path.join('dist', exe_name)
+    
     try:
         subprocess.check_call(cmd)
         print("✅ Сборка завершена!")
-        print("📁 Исполняемый файл: dist/DutySchedule_Debug.exe")
+        print(f"📁 Исполняемый файл: {exe_path}")
+        if onedir:
+            print("📦 Копируйте папку dist/DutySchedule_Debug целиком")
         print("💡 При запуске откроется консоль с логами")
+        print(f"⏱️  Время запуска: {sys.executable} bench.py --suite startup --binary {exe_path}")
     except subprocess.CalledProcessError as e:
         print(f"❌ Ошибка сборки: {e}")
 
 if __name__ == "__main__":
-    build_with_debug()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Сборка приложения PyInstaller")
+    parser.add_argument('--onedir', action='store_true',
+                        help='папка вместо одного файла: быстрее запуск, без распаковки при каждом старте')
+    args = parser.parse_args()
+    build_with_debug(onedir=args.onedir)
@@ -1,47 +1,90 @@
-from flask import Flask, render_template
-import gspread
-from google.oauth2.service_account import Credentials
-from datetime import datetime, date, timedelta
+from flask import Flask, Response, abort, g, make_response, render_template, request, send_file, stream_with_context, url_for
+from datetime import datetime, date, timedelta, timezone
 import os
 import re
 import sys
+import io
+import csv
+import json
+import tempfile
+import hashlib
+import gzip
+import mimetypes
+import importlib.util
 import logging
+import logging.handlers
+import queue
+import atexit
+import threading
+import math
+import random
 import time
+import socket
+import sqlite3
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache, partial, wraps
+from werkzeug.middleware.proxy_fix import ProxyFix
+from operator import attrgetter
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения
 load_dotenv()
 
+def lazy_import(name):
+    """Модуль, который загружается при первом обращении к его атрибутам"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# Клиент Google загружается только при первом обращении к таблице: так быстрее запуск
+gspread = lazy_import('gspread')
+service_account = lazy_import('google.oauth2.service_account')
+
 app = Flask(__name__)
 
 # =============================================================================
 # ГЛОБАЛЬНЫЕ ПЕРЕМЕННЫЕ ДЛЯ ЗАЩИТЫ ОТ ЧАСТЫХ ЗАПРОСОВ
 # =============================================================================
 
-# Время последнего успешного запроса
-last_successful_request = None
-# Время последней ошибки
-last_error_time = None
-# Кэш расписания
-schedule_cache = None
-# Время кэширования
-cache_time = None
-# Текст последней ошибки
-last_error = None
-# Время последнего запроса
-last_request_time = 0
-# Минимальный интервал между запросами (секунды)
+# Минимальный интервал между обращениями к Google Sheets по запросу клиентов (секунды)
 MIN_REQUEST_INTERVAL = 15
 
+# Событие для досрочного запуска фонового обновления
+refresh_event = threading.Event()
+# Фоновый поток обновления кэша
+refresher_thread = None
+refresher_lock = threading.Lock()
+
 # =============================================================================
 # НАСТРОЙКА ЛОГИРОВАНИЯ
 # =============================================================================
 
+# Уровень логирования (по умолчанию - только WARNING и выше)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'WARNING').upper()
+# Сводный режим: одна строка-итог вместо строки на каждую найденную запись
+LOG_SUMMARY = os.getenv('LOG_SUMMARY', '1').lower() not in ('0', 'false', 'no')
+
+class LogRecordQueueHandler(logging.handlers.QueueHandler):
+    """Передача записи в очередь без форматирования: сообщение соберет фоновый поток"""
+    
+    def prepare(self, record):
+        # Очередь внутри процесса - запись не нужно сериализовать
+        return record
+
 def setup_logging():
-    """Настройка логирования для скомпилированного приложения"""
+    """Настройка логирования: потоки запросов только кладут записи в очередь"""
     # Создаем логгер
     logger = logging.getLogger()
-    logger.setLevel(logging.WARNING)  # Только WARNING и выше
+    logger.setLevel(LOG_LEVEL)
     
     # Формат логов
     formatter = logging.Formatter(
@@ -53,17 +96,25 @@ def setup_logging():
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    handlers = [console_handler]
     
     # Хендлер для файла (только серьезные ошибки)
     try:
         file_handler = logging.FileHandler('duty_app.log', encoding='utf-8')
         file_handler.setLevel(logging.WARNING)  # Только WARNING и ERROR
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
     except Exception as e:
         print(f"Не удалось создать файл лога: {e}")
     
+    # Запись в консоль и файл - в отдельном потоке, запрос не ждет ввода-вывода
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # При выходе дописываем оставшиеся в очереди записи
+    atexit.register(listener.stop)
+    logger.addHandler(LogRecordQueueHandler(log_queue))
+    
     return logger
 
 # Инициализируем логирование
@@ -74,14 +125,361 @@ logger = setup_logging()
 # =============================================================================
 
 GOOGLE_SHEET_URL = os.getenv('GOOGLE_SHEET_URL')
+# Локальная копия графика (CSV или XLSX) вместо Google Sheets, если GOOGLE_SHEET_URL не нужен
+SCHEDULE_FILE = os.getenv('SCHEDULE_FILE')
 CREDENTIALS_FILE = os.getenv('GOOGLE_CREDENTIALS_FILE', 'credentials.json')
+# Интервал фонового обновления кэша (секунды)
+REFRESH_INTERVAL = int(os.getenv('REFRESH_INTERVAL', '300'))
+# Файл снимка расписания для быстрого старта (пустая строка - отключить)
+SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE', 'schedule_snapshot.json')
+
+# Лимит HTTP-запросов одного клиента: запросов в секунду и размер всплеска
+HTTP_RATE_LIMIT = float(os.getenv('HTTP_RATE_LIMIT', '2'))
+HTTP_RATE_BURST = int(os.getenv('HTTP_RATE_BURST', '30'))
+# Лимит /refresh одного клиента: один запрос в MIN_REQUEST_INTERVAL, всплеск до REFRESH_RATE_BURST
+REFRESH_RATE_BURST = int(os.getenv('REFRESH_RATE_BURST', '3'))
+# Одновременных SSE-потоков и long-poll запросов одного клиента (каждый держит поток сервера)
+LIVE_CONNECTIONS_PER_CLIENT = int(os.getenv('LIVE_CONNECTIONS_PER_CLIENT', '4'))
+# Названия дней недели на русском (индекс - date.weekday())
+WEEKDAY_NAMES = ('ПН', 'ВТ', 'СР', 'ЧТ', 'ПТ', 'СБ', 'ВС')
+
+def load_work_days():
+    """Дни недели на экране из WORK_DAYS: названия через запятую (ПН,ВТ,...)"""
+    raw_days = os.getenv('WORK_DAYS', 'ПН,ВТ,СР,ЧТ,ПТ,СБ')
+    days = set()
+    for name in raw_days.split(','):
+        name = name.strip().upper()
+        if name not in WEEKDAY_NAMES:
+            raise ValueError(f"WORK_DAYS: неизвестный день недели '{name}', допустимы {', '.join(WEEKDAY_NAMES)}")
+        days.add(WEEKDAY_NAMES.index(name))
+    return tuple(sorted(days))
+
+# Сколько недель показывать на экране и какие дни недели
+DISPLAY_WEEKS = int(os.getenv('DISPLAY_WEEKS', '2'))
+WORK_DAYS = load_work_days()
+if DISPLAY_WEEKS < 1:
+    raise ValueError("DISPLAY_WEEKS должен быть не меньше 1")
+
+# Папка для готовых выгрузок /export.ics и /export.csv (пустая строка - без кэша на диске)
+EXPORT_CACHE_DIR = os.getenv('EXPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'duty_schedule_export'))
+# Повторы при временных сбоях Google API (5xx, сеть): количество и задержки (секунды)
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', '2'))
+UPSTREAM_BACKOFF_BASE = float(os.getenv('UPSTREAM_BACKOFF_BASE', '1'))
+UPSTREAM_BACKOFF_MAX = float(os.getenv('UPSTREAM_BACKOFF_MAX', '10'))
+# Пока кэш пуст, запросы экранов ждут загрузку: повторы не дольше этого времени (секунды),
+# остальные попытки - в фоновом обновлении
+UPSTREAM_COLD_DEADLINE = float(os.getenv('UPSTREAM_COLD_DEADLINE', '3'))
+# Автомат защиты: сбоев подряд до паузы обращений, начальная и максимальная пауза (секунды)
+BREAKER_THRESHOLD = int(os.getenv('BREAKER_THRESHOLD', '3'))
+BREAKER_BASE_COOLDOWN = float(os.getenv('BREAKER_BASE_COOLDOWN', '30'))
+BREAKER_MAX_COOLDOWN = float(os.getenv('BREAKER_MAX_COOLDOWN', '900'))
+# Квота чтения Sheets API в минуту (у Google по умолчанию 60 на пользователя, 300 на проект)
+SHEETS_READ_QUOTA = int(os.getenv('SHEETS_READ_QUOTA', '60'))
+# Сколько разных ячеек с именами помнит кэш очистки имен
+NAME_CACHE_SIZE = int(os.getenv('NAME_CACHE_SIZE', '4096'))
+# Записей на странице /debug по умолчанию и максимум
+DEBUG_PER_PAGE = 50
+DEBUG_MAX_PER_PAGE = 500
+# Профилирование запросов по ?profile=1 (выключено: профилировщик замедляет запрос)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0').lower() in ('1', 'true', 'yes')
+# Сколько функций показывать в итоге профилирования (?profile_top=N, не больше PROFILE_MAX_TOP)
+PROFILE_TOP = 25
+PROFILE_MAX_TOP = 200
+# Токены экранов со своим лимитом запросов; остальные клиенты - по IP. Экран получает
+# токен один раз через /?screen=<токен>, дальше браузер передает его в cookie
+CLIENT_TOKEN_PARAM = 'screen'
+CLIENT_TOKEN_COOKIE = 'screen_token'
+CLIENT_TOKENS = frozenset(token.strip() for token in os.getenv('CLIENT_TOKENS', '').split(',') if token.strip())
+# Сколько обратных прокси перед приложением (0 - адрес клиента = адрес соединения)
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '0'))
+# Порт встроенного сервера (python duty_app.py и собранное приложение)
+PORT = int(os.getenv('PORT', '5000'))
+# Количество потоков для параллельной загрузки графиков
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', '4'))
+# Общий для нескольких процессов кэш расписания (SQLite); пусто - кэш только в памяти процесса
+SHARED_CACHE_DB = os.getenv('SHARED_CACHE_DB', '')
+# Как часто процессы сверяются с общим кэшем (секунды)
+SHARED_SYNC_INTERVAL = float(os.getenv('SHARED_SYNC_INTERVAL', '5'))
+# Срок аренды права на обновление: процесс-владелец продлевает её при каждой сверке
+SHARED_LEASE_TTL = max(3 * SHARED_SYNC_INTERVAL, 30)
+
+def load_schedule_sources():
+    """Список графиков из SCHEDULE_SOURCES (JSON) или один график из GOOGLE_SHEET_URL / SCHEDULE_FILE"""
+    raw_sources = os.getenv('SCHEDULE_SOURCES')
+    
+    if not raw_sources:
+        if SCHEDULE_FILE:
+            return [{
+                'id': 'evening',
+                'title': 'Вечернее дежурство',
+                'type': 'file',
+                'path': SCHEDULE_FILE,
+                'worksheet': None
+            }]
+        # Проверяем обязательные переменные
+        if not GOOGLE_SHEET_URL:
+            logger.error("GOOGLE_SHEET_URL (или SCHEDULE_FILE) не установлен в переменных окружения")
+            raise ValueError("GOOGLE_SHEET_URL (или SCHEDULE_FILE) не установлен в переменных окружения")
+        return [{
+            'id': 'evening',
+            'title': 'Вечернее дежурство',
+            'type': 'sheets',
+            'url': GOOGLE_SHEET_URL,
+            'worksheet': 'Вечернее дежурство'
+        }]
+    
+    try:
+        sources = json.loads(raw_sources)
+    except ValueError as e:
+        raise ValueError(f"SCHEDULE_SOURCES содержит некорректный JSON: {e}")
+    
+    if not isinstance(sources, list) or not sources:
+        raise ValueError("SCHEDULE_SOURCES должен быть непустым списком графиков")
+    
+    result = []
+    for source in sources:
+        if source.get('id') and source.get('path'):
+            # Файл на диске: лист нужен только для XLSX (по умолчанию - активный)
+            result.append({
+                'id': str(source['id']),
+                'title': source.get('title') or source['id'],
+                'type': 'file',
+                'path': source['path'],
+                'worksheet': source.get('worksheet')
+            })
+            continue
+        if not source.get('id') or not source.get('worksheet'):
+            raise ValueError(f"У графика в SCHEDULE_SOURCES должны быть поля 'id' и 'worksheet': {source}")
+        url = source.get('url') or GOOGLE_SHEET_URL
+        if not url:
+            raise ValueError(f"Для графика '{source['id']}' не указан url, и GOOGLE_SHEET_URL не установлен")
+        result.append({
+            'id': str(source['id']),
+            'title': source.get('title') or source['worksheet'],
+            'type': 'sheets',
+            'url': url,
+            'worksheet': source['worksheet']
+        })
+    
+    ids = [source['id'] for source in result]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Идентификаторы графиков в SCHEDULE_SOURCES повторяются: {ids}")
+    
+    return result
+
+SCHEDULE_SOURCES = load_schedule_sources()
+# График, который показывается на главной странице
+DEFAULT_ROSTER = SCHEDULE_SOURCES[0]['id']
+
+logger.info("Конфигурация загружена: графиков - %s, основной - %s", len(SCHEDULE_SOURCES), DEFAULT_ROSTER)
+
+# =============================================================================
+# МЕТРИКИ (ФОРМАТ PROMETHEUS)
+# =============================================================================
+
+class Counter:
+    """Счетчик с метками"""
+    
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.lock = threading.Lock()
+        self.values = {}
+    
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {value}")
+        return lines
 
-# Проверяем обязательные переменные
-if not GOOGLE_SHEET_URL:
-    logger.error("GOOGLE_SHEET_URL не установлен в переменных окружения")
-    raise ValueError("GOOGLE_SHEET_URL не установлен в переменных окружения")
+class Histogram:
+    """Гистограмма длительностей с фиксированными границами корзин"""
+    
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.lock = threading.Lock()
+        # Метки -> [счетчики по корзинам, сумма, количество]
+        self.values = {}
+    
+    def observe(self, value, *labels):
+        position = bisect_left(self.BUCKETS, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * len(self.BUCKETS), 0.0, 0]
+            if position < len(self.BUCKETS):
+                series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+    
+    def time(self, *labels):
+        """Контекстный менеджер для замера длительности блока"""
+        return HistogramTimer(self, labels)
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((labels, (list(buckets), total, count)) for labels, (buckets, total, count) in self.values.items())
+        for labels, (buckets, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.BUCKETS, buckets):
+                cumulative += bucket_count
+                bucket_labels = format_labels(self.label_names + ('le',), labels + (repr(bound),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.label_names + ('le',), labels + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {count}")
+        return lines
+
+class HistogramTimer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+def format_labels(names, values):
+    """Метки в формате {name="value",...}"""
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+SHEETS_FETCH_SECONDS = Histogram('duty_sheets_fetch_seconds', 'Длительность обновления графика из Google Sheets', ('roster',))
+PARSE_SECONDS = Histogram('duty_parse_schedule_seconds', 'Длительность parse_schedule_data')
+RENDER_SECONDS = Histogram('duty_render_template_seconds', 'Длительность render_template главной страницы')
+CACHE_REQUESTS = Counter('duty_cache_requests_total', 'Обращения к кэшу: hit, miss, stale', ('roster', 'result'))
+REQUEST_STATUS = Counter('duty_requests_total', 'Ответы маршрутов по статусу получения данных', ('status',))
+UPSTREAM_FETCHES = Counter('duty_upstream_fetches_total', 'Обновления из Google Sheets по результату (ошибки API - api_error, not_found, error)', ('roster', 'status'))
+EXPORT_REQUESTS = Counter('duty_export_requests_total', 'Запросы выгрузки: not_modified, cached, rendered', ('format', 'result'))
+UPSTREAM_RETRIES_TOTAL = Counter('duty_upstream_retries_total', 'Повторы обращений к Google Sheets после временных сбоев')
+RATE_LIMIT_REJECTIONS = Counter('duty_rate_limit_rejections_total', 'Отклоненные запросы по типу лимита', ('limiter',))
+
+# =============================================================================
+# ОГРАНИЧЕНИЕ ЧАСТОТЫ ЗАПРОСОВ
+# =============================================================================
+
+class TokenBucketLimiter:
+    """Ограничение частоты HTTP-запросов отдельно для каждого клиента (token bucket)"""
+    
+    def __init__(self, name, rate, burst, max_clients=10000):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        # Клиент -> (оставшиеся токены, время последнего пересчета)
+        self.buckets = {}
+        self.rejected = 0
+    
+    def allow(self, client_key):
+        """Возвращает (разрешено, через сколько секунд повторить)"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(client_key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            
+            if tokens < 1:
+                self.buckets[client_key] = (tokens, now)
+                self.rejected += 1
+                RATE_LIMIT_REJECTIONS.inc(self.name)
+                return False, (1 - tokens) / self.rate
+            
+            self.buckets[client_key] = (tokens - 1, now)
+            if len(self.buckets) > self.max_clients:
+                self._prune(now)
+            return True, 0
+    
+    def _prune(self, now):
+        """Удаление клиентов, чьи корзины уже полностью восстановились"""
+        full = [
+            key for key, (tokens, updated) in self.buckets.items()
+            if tokens + (now - updated) * self.rate >= self.burst
+        ]
+        for key in full:
+            del self.buckets[key]
+
+class ConnectionLimiter:
+    """Ограничение числа одновременных долгих соединений (SSE, long-poll) каждого клиента"""
+    
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.lock = threading.Lock()
+        # Клиент -> число открытых соединений
+        self.active = {}
+        self.rejected = 0
+    
+    def acquire(self, client_key):
+        with self.lock:
+            count = self.active.get(client_key, 0)
+            if count >= self.limit:
+                self.rejected += 1
+                RATE_LIMIT_REJECTIONS.inc(self.name)
+                return False
+            self.active[client_key] = count + 1
+            return True
+    
+    def release(self, client_key):
+        with self.lock:
+            count = self.active.get(client_key, 0) - 1
+            if count > 0:
+                self.active[client_key] = count
+            else:
+                self.active.pop(client_key, None)
+
+class FetchBudget:
+    """Бюджет обращений к Google Sheets, не зависящий от числа HTTP-клиентов"""
+    
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.last_fetch_time = 0
+        self.denied = 0
+    
+    def try_acquire(self):
+        """Разрешает обращение не чаще одного раза в min_interval секунд"""
+        with self.lock:
+            current_time = time.time()
+            elapsed = current_time - self.last_fetch_time
+            if elapsed < self.min_interval:
+                self.denied += 1
+                RATE_LIMIT_REJECTIONS.inc('upstream')
+                logger.warning("Слишком частый запрос к Google Sheets. Интервал: %.1fс, минимальный: %sс", elapsed, self.min_interval)
+                return False
+            self.last_fetch_time = current_time
+            return True
+    
+    def retry_after(self):
+        with self.lock:
+            return max(0, math.ceil(self.min_interval - (time.time() - self.last_fetch_time)))
 
-logger.info(f"Конфигурация загружена: Google Sheet URL = {GOOGLE_SHEET_URL}")
+# Лимиты HTTP-стороны: страницы и API, отдельно - принудительное обновление
+http_limiter = TokenBucketLimiter('http', HTTP_RATE_LIMIT, HTTP_RATE_BURST)
+refresh_limiter = TokenBucketLimiter('refresh', 1 / MIN_REQUEST_INTERVAL, REFRESH_RATE_BURST)
+live_limiter = ConnectionLimiter('live', LIVE_CONNECTIONS_PER_CLIENT)
+# Бюджет принудительных обновлений из Google Sheets (общий для всех клиентов)
+upstream_budget = FetchBudget(MIN_REQUEST_INTERVAL)
 
 # =============================================================================
 # ФУНКЦИИ ДЛЯ РАБОТЫ С GOOGLE SHEETS
@@ -95,85 +493,484 @@ def get_google_sheets_client():
             "https://www.googleapis.com/auth/drive"
         ]
         
-        logger.info(f"Загрузка учетных данных из: {CREDENTIALS_FILE}")
+        logger.info("Загрузка учетных данных из: %s", CREDENTIALS_FILE)
         
         if not os.path.exists(CREDENTIALS_FILE):
-            logger.error(f"Файл учетных данных не найден: {CREDENTIALS_FILE}")
+            logger.error("Файл учетных данных не найден: %s", CREDENTIALS_FILE)
             return None
             
-        creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=scope)
+        creds = service_account.Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=scope)
         client = gspread.authorize(creds)
         logger.info("Клиент Google Sheets авторизован успешно")
         return client
         
     except Exception as e:
-        logger.error(f"Ошибка при инициализации клиента Google Sheets: {e}")
+        logger.error("Ошибка при инициализации клиента Google Sheets: %s", e)
         return None
 
+def is_auth_error(error):
+    """Проверяет, вызвана ли ошибка API истекшей или отозванной авторизацией"""
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) == 401
+
+class SheetsSession:
+    """Долгоживущая сессия Google Sheets: авторизованный клиент, таблицы и листы"""
+    
+    def __init__(self):
+        # Общий замок защищает только словари и клиент; сетевые вызовы открытия
+        # выполняются под замком своей таблицы и не блокируют остальные графики
+        self.lock = threading.Lock()
+        self.url_locks = {}
+        self.client = None
+        self.spreadsheets = {}
+        self.worksheets = {}
+        # Ревизии (время изменения) таблиц, данные которых уже загружены в кэш
+        self.revisions = {}
+        self.revision_check_disabled = False
+        # Сколько API-вызовов сэкономило повторное использование объектов
+        self.calls_saved = {}
+        self.last_calls_saved = 0
+        self.total_calls_saved = 0
+        self.authorizations = 0
+    
+    def _token_expired(self):
+        credentials = getattr(self.client, 'auth', None)
+        return bool(getattr(credentials, 'expired', False))
+    
+    def reset(self):
+        """Сброс сессии: следующий вызов выполнит полную авторизацию"""
+        with self.lock:
+            self.client = None
+            self.spreadsheets.clear()
+            self.worksheets.clear()
+            self.revisions.clear()
+    
+    def invalidate_handles(self, sheet_url, worksheet_name):
+        """Сброс открытых объектов одного графика с сохранением авторизации.
+        
+        Листы других графиков остаются открытыми: сбой одной таблицы не заставляет
+        переоткрывать остальные.
+        """
+        with self.lock:
+            self.spreadsheets.pop(sheet_url, None)
+            self.worksheets.pop((sheet_url, worksheet_name), None)
+    
+    def get_worksheet(self, sheet_url, worksheet_name):
+        """Возвращает лист, переиспользуя клиент и открытые объекты"""
+        key = (sheet_url, worksheet_name)
+        with self.lock:
+            calls_saved = 0
+            
+            # Авторизация (обмен токена) - только при первом вызове или истечении токена
+            if self.client is None or self._token_expired():
+                self.client = get_google_sheets_client()
+                self.spreadsheets.clear()
+                self.worksheets.clear()
+                if not self.client:
+                    return None
+                self.authorizations += 1
+            else:
+                calls_saved += 1
+            client = self.client
+            url_lock = self.url_locks.setdefault(sheet_url, threading.Lock())
+        
+        # Графики одной таблицы открывают ее один раз, разные таблицы - параллельно
+        with url_lock:
+            with self.lock:
+                spreadsheet = self.spreadsheets.get(sheet_url)
+                worksheet = self.worksheets.get(key)
+            
+            # Открытие таблицы - запрос метаданных
+            if spreadsheet is None:
+                logger.info("Открытие таблицы: %s", sheet_url)
+                sheets_quota.record()
+                spreadsheet = client.open_by_url(sheet_url)
+            else:
+                calls_saved += 1
+            
+            # Получение листа - ещё один запрос метаданных
+            if worksheet is None:
+                logger.info("Получение листа '%s'", worksheet_name)
+                sheets_quota.record()
+                worksheet = spreadsheet.worksheet(worksheet_name)
+            else:
+                calls_saved += 1
+            
+            with self.lock:
+                # Пока шло открытие, сессию могли сбросить - объекты старого клиента не сохраняем
+                if self.client is client:
+                    self.spreadsheets[sheet_url] = spreadsheet
+                    self.worksheets[key] = worksheet
+                self.calls_saved[key] = calls_saved
+                self.last_calls_saved = calls_saved
+                self.total_calls_saved += calls_saved
+        return worksheet
+    
+    def get_revision(self, worksheet):
+        """Время последнего изменения таблицы из Drive API (без загрузки ячеек)"""
+        if self.revision_check_disabled:
+            return None
+        
+        spreadsheet = worksheet.spreadsheet
+        try:
+            metadata = spreadsheet.client._get_file_drive_metadata(spreadsheet.id)
+        except gspread.exceptions.APIError as e:
+            if is_auth_error(e):
+                raise
+            if get_api_status(e) in (403, 404):
+                # Например, Drive API не включен для проекта - всегда загружаем лист целиком
+                logger.warning("Проверка изменений таблицы недоступна, загружается весь лист: %s", e)
+                self.revision_check_disabled = True
+            else:
+                # Временный сбой Drive (429, 5xx) - проверка пропускается только в этот раз
+                logger.warning("Не удалось проверить изменения таблицы, загружается весь лист: %s", e)
+            return None
+        except OSError as e:
+            logger.warning("Не удалось проверить изменения таблицы, загружается весь лист: %s", e)
+            return None
+        return metadata.get('modifiedTime')
+
+# Общая сессия Google Sheets для всех обновлений
+sheets_session = SheetsSession()
+
+# =============================================================================
+# ЗАЩИТА ОТ СБОЕВ И КВОТЫ GOOGLE API
+# =============================================================================
+
+# Чтений Sheets API за одно обновление в худшем случае: таблица, лист, значения
+READS_PER_FETCH = 3
+# Обновление пропущено без обращения к Google: цепь разомкнута или нет квоты
+UPSTREAM_SKIPPED_STATUSES = ("circuit_open", "quota_wait")
+
+def get_api_status(error):
+    """HTTP-статус ошибки API (None - ответа не было)"""
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+def is_transient_error(error):
+    """Временный сбой: ответ 5xx или сетевая ошибка - есть смысл повторить"""
+    if isinstance(error, gspread.exceptions.APIError):
+        status = get_api_status(error)
+        return status is not None and status >= 500
+    # Ошибки соединения и таймауты requests - наследники OSError
+    return isinstance(error, OSError)
+
+def get_retry_after(error):
+    """Пауза из заголовка Retry-After ответа (секунды) или None"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return max(0.0, float(headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base, cap):
+    """Экспоненциальная задержка с полным джиттером: случайная от 0 до base * 2^attempt"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class ReadQuota:
+    """Учет чтений Google Sheets API за скользящее окно (квота на минуту)"""
+    
+    def __init__(self, limit, window=60):
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.calls = deque()
+        # После ответа 429 квота считается исчерпанной до этого времени
+        self.blocked_until = 0
+    
+    def _prune(self, now):
+        while self.calls and self.calls[0] <= now - self.window:
+            self.calls.popleft()
+    
+    def record(self, count=1):
+        now = time.time()
+        with self.lock:
+            self._prune(now)
+            self.calls.extend([now] * count)
+    
+    def exhaust(self, seconds):
+        """Google ответил 429: до конца паузы чтений не делаем"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.time() + seconds)
+    
+    def used(self):
+        with self.lock:
+            self._prune(time.time())
+            return len(self.calls)
+    
+    def remaining(self):
+        now = time.time()
+        with self.lock:
+            if now < self.blocked_until:
+                return 0
+            self._prune(now)
+            return max(0, self.limit - len(self.calls))
+    
+    def wait_time(self, count=1):
+        """Через сколько секунд в окне освободится count чтений (0 - можно сейчас)"""
+        now = time.time()
+        with self.lock:
+            self._prune(now)
+            wait = max(0.0, self.blocked_until - now)
+            excess = len(self.calls) + count - self.limit
+            if excess > 0:
+                wait = max(wait, self.calls[min(excess, len(self.calls)) - 1] + self.window - now)
+            return wait
+
+class CircuitBreaker:
+    """Автомат защиты: после серии сбоев подряд временно прекращает обращения к источнику.
+    
+    Пока цепь разомкнута, экраны получают устаревшую копию из кэша. По истечении паузы
+    пропускается одна пробная загрузка: успех замыкает цепь, сбой удваивает паузу.
+    """
+    
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+    
+    def __init__(self, threshold, base_cooldown, max_cooldown):
+        self.threshold = threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_count = 0
+        self.open_until = 0
+        self.trial_in_flight = False
+    
+    def allow(self):
+        """Можно ли обращаться к источнику: (да/нет, через сколько секунд повторить)"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True, 0
+            now = time.time()
+            if self.state == self.OPEN and now >= self.open_until:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True, 0
+            return False, max(1, math.ceil(self.open_until - now))
+    
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.warning("Google Sheets снова доступен, обращения возобновлены")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_count = 0
+            self.trial_in_flight = False
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                # Пауза растет вдвое с каждым размыканием; джиттер разводит процессы по времени
+                cooldown = min(self.max_cooldown, self.base_cooldown * 2 ** self.opened_count)
+                cooldown *= random.uniform(0.5, 1.0)
+                self.state = self.OPEN
+                self.open_until = time.time() + cooldown
+                self.opened_count += 1
+                logger.warning("Google Sheets недоступен (сбоев подряд: %s), пауза обращений %.0f с",
+                               self.failures, cooldown)
+    
+    def release(self):
+        """Попытка не дошла до источника (например, нет квоты) - результат не учитывается"""
+        with self.lock:
+            self.trial_in_flight = False
+    
+    def describe(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'retry_after': max(0, math.ceil(self.open_until - time.time())) if self.state != self.CLOSED else 0
+            }
+
+sheets_quota = ReadQuota(SHEETS_READ_QUOTA)
+upstream_breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_BASE_COOLDOWN, BREAKER_MAX_COOLDOWN)
+
+# =============================================================================
+# ПАРСИНГ ТАБЛИЦЫ ГРАФИКА
+# =============================================================================
+
+# Комментарии в ячейке с именем: текст в скобках и время вида "с 10:00"
+NAME_COMMENT_PATTERN = re.compile(r'\([^)]*\)')
+NAME_TIME_PATTERN = re.compile(r'с \d+:\d+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
 def clean_name(name):
-    """Очистка имени от комментариев и лишних символов"""
+    """Очистка имени от комментариев и лишних символов.
+    
+    Одни и те же ячейки повторяются в каждой неделе, поэтому результат кэшируется
+    по исходному тексту, а очищенное имя хранится в одном экземпляре (sys.intern).
+    """
     if not name:
         return ""
     
-    original_name = name
-    # Удаляем текст в скобках и комментарии
-    name = re.sub(r'\([^)]*\)', '', name)
-    name = re.sub(r'с \d+:\d+', '', name)
-    name = re.sub(r'\([^)]*\)', '', name)
+    # Удаляем текст в скобках и комментарии. Повторный проход по скобкам не нужен:
+    # после первого не остается "(" с закрывающей скобкой после нее
+    name = NAME_COMMENT_PATTERN.sub('', name)
+    name = NAME_TIME_PATTERN.sub('', name)
     
     # Убираем лишние пробелы и переносы строк
     name = name.replace('<br>', ', ').strip()
-    name = re.sub(r'\s+', ' ', name)
+    name = WHITESPACE_PATTERN.sub(' ', name)
     
-    cleaned = name.strip(' ,')
-    return cleaned
+    return sys.intern(name.strip(' ,'))
+
+def get_name_cache_stats():
+    """Статистика кэша очищенных имен: попадания, промахи, размер"""
+    info = clean_name.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'max_size': info.maxsize,
+        'hit_rate': round(info.hits / lookups, 3) if lookups else None
+    }
+
+# Дата в формате ДД.ММ.ГГГГ или ДД.ММ (пробелы по краям допускаются)
+DATE_CELL_PATTERN = re.compile(r'\s*(\d{1,2})\.(\d{1,2})(?:\.(\d{4}))?\s*')
+# Цифры, с которых обычно начинается ячейка с датой
+DATE_CELL_FIRST_CHARS = frozenset('0123456789')
 
 def is_date_cell(cell_value):
     """Проверяет, является ли ячейка датой в формате ДД.ММ.ГГГГ или ДД.ММ"""
     if not cell_value:
         return False
     
-    cell_value = str(cell_value).strip()
-    
-    # Проверяем формат ДД.ММ.ГГГГ
-    date_pattern_full = r'^\d{1,2}\.\d{1,2}\.\d{4}$'
-    # Проверяем формат ДД.ММ (предполагаем текущий год)
-    date_pattern_short = r'^\d{1,2}\.\d{1,2}$'
-    
-    return bool(re.match(date_pattern_full, cell_value) or re.match(date_pattern_short, cell_value))
+    return DATE_CELL_PATTERN.fullmatch(str(cell_value)) is not None
 
 def parse_date_cell(date_str):
     """Парсит дату из формата ДД.ММ.ГГГГ или ДД.ММ"""
-    try:
-        date_str = str(date_str).strip()
-        
-        # Если формат ДД.ММ.ГГГГ
-        if re.match(r'^\d{1,2}\.\d{1,2}\.\d{4}$', date_str):
-            return datetime.strptime(date_str, '%d.%m.%Y').date()
-        
-        # Если формат ДД.ММ - добавляем текущий год
-        elif re.match(r'^\d{1,2}\.\d{1,2}$', date_str):
-            current_year = datetime.now().year
-            date_with_year = f"{date_str}.{current_year}"
-            return datetime.strptime(date_with_year, '%d.%m.%Y').date()
-        
+    match = DATE_CELL_PATTERN.fullmatch(str(date_str))
+    if not match:
         return None
+    
+    day, month, year = match.groups()
+    try:
+        # Для формата ДД.ММ подставляем текущий год
+        return date(int(year) if year else datetime.now().year, int(month), int(day))
     except ValueError as e:
-        logger.warning(f"Не удалось распарсить дату '{date_str}': {e}")
+        logger.warning("Не удалось распарсить дату '%s': %s", str(date_str).strip(), e)
         return None
 
 def get_weekday_name(date_obj):
     """Возвращает название дня недели на русском"""
-    weekdays = {
-        0: 'ПН',
-        1: 'ВТ', 
-        2: 'СР',
-        3: 'ЧТ',
-        4: 'ПТ',
-        5: 'СБ',  # Суббота
-        6: 'ВС'   # Воскресенье
-    }
-    return weekdays[date_obj.weekday()]
+    return WEEKDAY_NAMES[date_obj.weekday()]
+
+class DutyRecord(namedtuple('DutyRecord', 'date name raw_name row col source_date')):
+    """Запись о дежурстве: неизменяемый кортеж без словаря атрибутов.
+    
+    День недели, дата строкой и адрес ячейки вычисляются при обращении. source_date
+    хранится, только если дата в таблице записана не как ДД.ММ.ГГГГ (например, ДД.ММ).
+    """
+    __slots__ = ()
+    
+    @property
+    def weekday(self):
+        return WEEKDAY_NAMES[self.date.weekday()]
+    
+    @property
+    def date_str(self):
+        return self.source_date or self.date.strftime('%d.%m.%Y')
+    
+    @property
+    def cell_location(self):
+        if self.row is None:
+            return None
+        return f"{chr(65 + self.col)}{self.row}"
+
+def empty_duty(day):
+    """Пустая ячейка дня без дежурного"""
+    return DutyRecord(day, '', '', None, None, None)
+
+def parse_schedule_grid(all_values):
+    """Поиск дат и дежурных в таблице за один проход по ячейкам"""
+    schedule = []
+    current_year = datetime.now().year
+    fullmatch = DATE_CELL_PATTERN.fullmatch
+    intern = sys.intern
+    
+    # Окно из двух строк (даты и имена под ними): строки можно читать потоком из файла.
+    # Последняя строка таблицы в качестве строки дат не проверяется - под ней нет имен
+    rows = iter(all_values)
+    next_row = next(rows, None)
+    for row_idx, following_row in enumerate(rows):
+        row, next_row = next_row, following_row
+        # Пустые строки пропускаем целиком
+        if not any(row):
+            continue
+        
+        next_row_len = len(next_row)
+        
+        for col_idx, cell_value in enumerate(row):
+            # Дата начинается с цифры (или пробела) - остальные ячейки отсекаем без regex
+            if not cell_value:
+                continue
+            first_char = cell_value[0]
+            if first_char not in DATE_CELL_FIRST_CHARS and not first_char.isspace():
+                continue
+            
+            match = fullmatch(cell_value)
+            if match is None or col_idx >= next_row_len:
+                continue
+            
+            # Ищем дежурного в ячейке под датой (следующая строка, та же колонка)
+            duty_person_cell = next_row[col_idx]
+            if not duty_person_cell:
+                continue
+            
+            day, month, year = match.groups()
+            try:
+                date_value = date(int(year) if year else current_year, int(month), int(day))
+            except ValueError as e:
+                logger.warning("Не удалось распарсить дату '%s': %s", cell_value.strip(), e)
+                continue
+            
+            # Имена повторяются в каждой неделе - clean_name отдает одну копию строки из кэша
+            duty_person = clean_name(duty_person_cell)
+            if not duty_person:
+                continue
+            
+            raw_name = duty_person if duty_person_cell == duty_person else intern(duty_person_cell)
+            # Дата вида ДД.ММ.ГГГГ восстанавливается из date - исходный текст не храним
+            date_text = cell_value.strip()
+            source_date = None if len(date_text) == 10 else date_text
+            schedule.append(DutyRecord(date_value, duty_person, raw_name, row_idx + 1, col_idx, source_date))
+    
+    return schedule
+
+def log_schedule_summary(schedule):
+    """Одна строка-итог вместо строки на каждую запись"""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    if not schedule:
+        logger.info("Найдено записей о дежурствах: 0")
+        return
+    dates = [duty.date for duty in schedule]
+    logger.info(
+        "Найдено записей о дежурствах: %s, даты с %s по %s, дежурных: %s",
+        len(schedule), min(dates).strftime('%d.%m.%Y'), max(dates).strftime('%d.%m.%Y'),
+        len({duty.name for duty in schedule})
+    )
+
+def parse_schedule_rows(rows):
+    """Парсинг строк таблицы дежурств из любого источника (список или поток строк)"""
+    with PARSE_SECONDS.time():
+        schedule = parse_schedule_grid(rows)
+    
+    # Выводим информацию о найденных датах
+    if LOG_SUMMARY:
+        log_schedule_summary(schedule)
+    elif logger.isEnabledFor(logging.INFO):
+        logger.info("Найдено записей о дежурствах: %s", len(schedule))
+        for duty in schedule:
+            logger.info("   %s (%s) -> %s [%s]", duty.date.strftime('%d.%m.%Y'), duty.date_str, duty.name, duty.cell_location)
+    
+    return schedule
 
 def parse_schedule_data(worksheet):
     """Парсинг данных таблицы дежурств - ищем даты в разных форматах"""
@@ -181,118 +978,858 @@ def parse_schedule_data(worksheet):
         # Получаем все значения
         logger.info("Получение данных из Google Sheets...")
         all_values = worksheet.get_all_values()
-        logger.info(f"Получено строк: {len(all_values)}")
+        logger.info("Получено строк: %s", len(all_values))
         
-        schedule = []
-        found_dates = []
+        return parse_schedule_rows(all_values)
         
-        logger.info("Поиск дат в таблице...")
+    except gspread.exceptions.APIError:
+        # Ошибки API обрабатываются на уровне загрузки (повторная авторизация)
+        raise
+    except Exception as e:
+        logger.error("Ошибка при парсинге данных: %s", e)
+        return None
+
+# Признак того, что таблица не изменилась с последней загрузки
+NOT_MODIFIED = object()
+
+def read_worksheet_if_changed(source, has_cached_data):
+    """Загрузка и парсинг листа, только если таблица изменилась"""
+    worksheet = sheets_session.get_worksheet(source['url'], source['worksheet'])
+    if not worksheet:
+        return None
+    
+    key = (source['url'], source['worksheet'])
+    revision = sheets_session.get_revision(worksheet)
+    if has_cached_data and revision and sheets_session.revisions.get(key) == revision:
+        logger.info("Таблица графика '%s' не изменилась (ревизия %s), загрузка листа пропущена", source['id'], revision)
+        return NOT_MODIFIED
+    
+    sheets_quota.record()
+    schedule_data = parse_schedule_data(worksheet)
+    if schedule_data is not None and revision:
+        sheets_session.revisions[key] = revision
+    return schedule_data
+
+def load_worksheet_data(source, has_cached_data=False):
+    """Загрузка листа через общую сессию с повторной авторизацией при ошибке"""
+    try:
+        return read_worksheet_if_changed(source, has_cached_data)
+    except gspread.exceptions.APIError as e:
+        if not is_auth_error(e):
+            # Открытые объекты могли устареть - переоткроем их при следующем обновлении
+            sheets_session.invalidate_handles(source['url'], source['worksheet'])
+            raise
         
-        # Проходим по всем строкам и колонкам
-        for row_idx, row in enumerate(all_values):
-            for col_idx, cell_value in enumerate(row):
-                # Проверяем, является ли ячейка датой
-                if is_date_cell(cell_value):
-                    date_value = parse_date_cell(cell_value)
-                    
-                    if date_value:
-                        # Ищем дежурного в ячейке под датой (следующая строка, та же колонка)
-                        if row_idx + 1 < len(all_values):
-                            duty_person_cell = all_values[row_idx + 1][col_idx]
-                            duty_person = clean_name(duty_person_cell)
-                            
-                            if duty_person:
-                                schedule_item = {
-                                    'date': date_value,
-                                    'name': duty_person,
-                                    'date_str': cell_value.strip(),
-                                    'raw_name': duty_person_cell,
-                                    'cell_location': f"{chr(65 + col_idx)}{row_idx + 1}",
-                                    'weekday': get_weekday_name(date_value)
-                                }
-                                schedule.append(schedule_item)
-                                found_dates.append({
-                                    'date': date_value,
-                                    'original': cell_value.strip(),
-                                    'location': f"{chr(65 + col_idx)}{row_idx + 1}",
-                                    'duty': duty_person
-                                })
+        logger.warning("Ошибка авторизации Google Sheets, выполняется повторная авторизация")
+        sheets_session.reset()
+        return read_worksheet_if_changed(source, has_cached_data)
+
+def fetch_schedule_attempt(source, has_cached_data=False):
+    """Одна попытка загрузки графика. Временные сбои (5xx, сеть) пробрасываются для повтора"""
+    try:
+        schedule_data = load_worksheet_data(source, has_cached_data)
         
-        # Выводим информацию о найденных датах
-        logger.info(f"Найдено записей о дежурствах: {len(schedule)}")
-        for found in found_dates:
-            logger.info(f"   {found['date'].strftime('%d.%m.%Y')} ({found['original']}) -> {found['duty']} [{found['location']}]")
+        if schedule_data is NOT_MODIFIED:
+            return None, None, "not_modified"
+        if schedule_data is not None:
+            calls_saved = sheets_session.calls_saved.get((source['url'], source['worksheet']), 0)
+            logger.info(
+                "График '%s': повторное использование сессии сэкономило API-вызовов: %s (всего: %s)",
+                source['id'], calls_saved, sheets_session.total_calls_saved
+            )
+            return schedule_data, None, "success"
+        if not sheets_session.client:
+            return None, "Не удалось инициализировать клиент Google Sheets", "error"
+        return None, "Не удалось распарсить данные таблицы", "error"
+            
+    except gspread.exceptions.APIError as e:
+        if is_transient_error(e):
+            raise
+        if get_api_status(e) == 429:
+            # Квота исчерпана: ждем указанное Google время или до конца минутного окна
+            sheets_quota.exhaust(get_retry_after(e) or sheets_quota.window)
+            return None, f"Превышена квота Google Sheets API: {e}", "quota_exceeded"
+        return None, f"Ошибка API Google Sheets: {e}", "api_error"
+    except gspread.exceptions.SpreadsheetNotFound:
+        sheets_session.invalidate_handles(source['url'], source['worksheet'])
+        return None, "Таблица не найдена. Проверьте URL и доступы.", "not_found"
+    except Exception as e:
+        sheets_session.invalidate_handles(source['url'], source['worksheet'])
+        if is_transient_error(e):
+            raise
+        return None, f"Неизвестная ошибка при получении данных: {e}", "error"
+
+def fetch_schedule_from_sheets(source, has_cached_data=False):
+    """Загрузка и парсинг расписания одного графика с повторами, квотой и автоматом защиты"""
+    allowed, retry_after = upstream_breaker.allow()
+    if not allowed:
+        return None, f"Google Sheets временно недоступен, следующая попытка через {retry_after} с", "circuit_open"
+    
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        wait = sheets_quota.wait_time(READS_PER_FETCH)
+        if wait > 0:
+            upstream_breaker.release()
+            return None, f"Исчерпана квота чтения Google Sheets, следующая попытка через {math.ceil(wait)} с", "quota_wait"
         
-        return schedule
+        try:
+            schedule_data, error_msg, status = fetch_schedule_attempt(source, has_cached_data)
+        except Exception as e:
+            delay = None
+            if attempt < UPSTREAM_RETRIES:
+                delay = get_retry_after(e)
+                if delay is None or delay > UPSTREAM_BACKOFF_MAX:
+                    delay = backoff_delay(attempt, UPSTREAM_BACKOFF_BASE, UPSTREAM_BACKOFF_MAX)
+                # Без копии в кэше эту загрузку ждут все запросы экранов - долгие паузы
+                # не ждем, повторит фоновое обновление
+                if not has_cached_data and time.monotonic() - started + delay > UPSTREAM_COLD_DEADLINE:
+                    logger.warning("Временный сбой Google Sheets (%s), повтор через %.1f с превысил бы %s с ожидания пустого кэша",
+                                   e, delay, UPSTREAM_COLD_DEADLINE)
+                    delay = None
+            if delay is not None:
+                attempt += 1
+                UPSTREAM_RETRIES_TOTAL.inc()
+                logger.warning("Временный сбой Google Sheets (%s), повтор %s через %.1f с", e, attempt, delay)
+                time.sleep(delay)
+                continue
+            upstream_breaker.record_failure()
+            if isinstance(e, gspread.exceptions.APIError):
+                return None, f"Ошибка API Google Sheets: {e}", "api_error"
+            return None, f"Ошибка соединения с Google Sheets: {e}", "error"
         
-    except Exception as e:
-        logger.error(f"Ошибка при парсинге данных: {e}")
+        if status == "error" and not sheets_session.client:
+            # Клиент не создан (нет учетных данных) - до Google запрос не дошел
+            upstream_breaker.release()
+        else:
+            # Google ответил (в том числе ошибкой доступа или 429) - сервис доступен
+            upstream_breaker.record_success()
+        return schedule_data, error_msg, status
+
+# =============================================================================
+# ИСТОЧНИКИ ДАННЫХ ГРАФИКА
+# =============================================================================
+
+# Сколько байт CSV читать для определения разделителя (запятая, точка с запятой, табуляция)
+CSV_SNIFF_BYTES = 64 * 1024
+
+class SheetsSource:
+    """Источник графика: лист Google Sheets"""
+    
+    kind = 'sheets'
+    
+    def __init__(self, source):
+        self.source = source
+        self.id = source['id']
+    
+    def fetch(self, has_cached_data=False):
+        return fetch_schedule_from_sheets(self.source, has_cached_data)
+
+class LocalFileSource:
+    """Источник графика: выгрузка CSV/XLSX или синхронизируемая копия таблицы на диске.
+    
+    Файл перечитывается, только если изменились время изменения или размер; строки
+    читаются потоком, без загрузки всего файла в память.
+    """
+    
+    kind = 'file'
+    
+    def __init__(self, source):
+        self.source = source
+        self.id = source['id']
+        self.path = source['path']
+        self.worksheet = source.get('worksheet')
+        # (mtime, размер) последней успешно прочитанной версии файла
+        self.signature = None
+    
+    def get_signature(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+    
+    def fetch(self, has_cached_data=False):
+        try:
+            signature = self.get_signature()
+        except OSError as e:
+            return None, f"Файл графика недоступен: {e}", "not_found"
+        
+        if has_cached_data and signature == self.signature:
+            return None, None, "not_modified"
+        
+        try:
+            with self.open_rows() as rows:
+                schedule_data = parse_schedule_rows(rows)
+        except ImportError:
+            return None, "Для чтения XLSX установите пакет openpyxl", "error"
+        except KeyError:
+            return None, f"Лист '{self.worksheet}' не найден в файле {self.path}", "not_found"
+        except (OSError, ValueError, csv.Error) as e:
+            return None, f"Не удалось прочитать файл графика: {e}", "error"
+        
+        # Файл мог перезаписываться во время чтения - тогда перечитаем его при следующем обновлении
+        if self.get_signature() == signature:
+            self.signature = signature
+        logger.info("График '%s' загружен из файла %s", self.id, self.path)
+        return schedule_data, None, "success"
+    
+    @contextmanager
+    def open_rows(self):
+        """Строки файла как списки строк-ячеек, в том же виде, что и get_all_values листа"""
+        if self.path.lower().endswith(('.xlsx', '.xlsm')):
+            with self.open_xlsx_rows() as rows:
+                yield rows
+            return
+        
+        # utf-8-sig - выгрузки из Excel начинаются с BOM
+        with open(self.path, newline='', encoding='utf-8-sig') as f:
+            sample = f.read(CSV_SNIFF_BYTES)
+            f.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            yield csv.reader(f, dialect)
+    
+    @contextmanager
+    def open_xlsx_rows(self):
+        import openpyxl
+        # read_only читает лист потоком; data_only - значения формул, а не сами формулы
+        workbook = openpyxl.load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            sheet = workbook[self.worksheet] if self.worksheet else workbook.active
+            yield ([format_xlsx_cell(value) for value in row] for row in sheet.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+
+def format_xlsx_cell(value):
+    """Значение ячейки XLSX в виде текста, как его показывает Google Sheets"""
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%d.%m.%Y')
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+# Типы источников в SCHEDULE_SOURCES ('type')
+SOURCE_BACKENDS = {
+    'sheets': SheetsSource,
+    'file': LocalFileSource,
+}
+
+def create_schedule_source(source):
+    """Объект источника для графика из SCHEDULE_SOURCES"""
+    return SOURCE_BACKENDS[source.get('type', 'sheets')](source)
+
+# =============================================================================
+# ИНДЕКС РАСПИСАНИЯ
+# =============================================================================
+
+class ScheduleIndex:
+    """Расписание, отсортированное по дате, с поиском за O(log n)"""
+    
+    def __init__(self, records, version=0, created_at=None):
+        # Сортировка устойчивая: при повторе даты первой остаётся запись выше в таблице
+        self.records = sorted(records, key=attrgetter('date'))
+        self.dates = [duty.date for duty in self.records]
+        # Версия данных в кэше и время её появления
+        self.version = version
+        self.created_at = created_at or time.time()
+        # Последний вид недель для экрана: (ключ, недели)
+        self.week_view = None
+        self._digest = None
+    
+    @property
+    def digest(self):
+        """Хэш содержимого: одинаковые данные не считаются новой версией"""
+        if self._digest is None:
+            self._digest = schedule_digest(self.records)
+        return self._digest
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def __iter__(self):
+        return iter(self.records)
+    
+    def __getitem__(self, position):
+        return self.records[position]
+    
+    def get(self, day):
+        """Дежурство на указанную дату или None"""
+        position = bisect_left(self.dates, day)
+        if position < len(self.dates) and self.dates[position] == day:
+            return self.records[position]
         return None
+    
+    def between(self, start, end):
+        """Дежурства с start по end включительно"""
+        return self.records[bisect_left(self.dates, start):bisect_right(self.dates, end)]
 
-def get_schedule_data_with_protection():
-    """Получение данных о дежурствах с защитой от частых запросов"""
-    global last_request_time, last_error, schedule_cache, cache_time
+def schedule_digest(records):
+    """Хэш записей расписания (в порядке дат)"""
+    hasher = hashlib.sha1()
+    for duty in records:
+        hasher.update(repr(tuple(duty)).encode('utf-8'))
+    return hasher.hexdigest()
+
+def as_schedule_index(schedule_data):
+    """Индекс для данных расписания (готовый индекс возвращается как есть)"""
+    if isinstance(schedule_data, ScheduleIndex):
+        return schedule_data
+    return ScheduleIndex(schedule_data)
+
+# =============================================================================
+# КЭШ РАСПИСАНИЯ
+# =============================================================================
+
+class FetchInFlight:
+    """Загрузка, выполняющаяся в данный момент; остальные потоки ждут её результат"""
     
-    current_time = time.time()
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+class ScheduleCache:
+    """Потокобезопасный кэш расписания с объединением одновременных загрузок"""
     
-    # Проверяем минимальный интервал между запросами
-    if current_time - last_request_time < MIN_REQUEST_INTERVAL:
-        logger.warning(f"Слишком частый запрос. Интервал: {current_time - last_request_time:.1f}с, минимальный: {MIN_REQUEST_INTERVAL}с")
-        return schedule_cache, last_error, "rate_limit"
+    def __init__(self, fetch_func, roster_id=None):
+        self.fetch_func = fetch_func
+        self.roster_id = roster_id
+        self.lock = threading.Lock()
+        # Кэшированное расписание (ScheduleIndex), его версия и время получения
+        self.data = None
+        self.version = 0
+        self.cache_time = None
+        # Последняя ошибка и статус последнего обновления
+        self.last_error = None
+        self.last_error_time = None
+        self.last_status = None
+        self.last_attempt_time = 0
+        # Количество обращений к источнику данных
+        self.fetch_count = 0
+        self._in_flight = None
+        # Оповещение ожидающих клиентов о новой версии данных
+        self.changed = threading.Condition(self.lock)
     
-    last_request_time = current_time
+    def state(self):
+        """Согласованный снимок состояния кэша"""
+        with self.lock:
+            return self.data, self.cache_time, self.last_error, self.last_status
     
-    # Проверяем кэш (актуален 5 минут)
-    if schedule_cache and cache_time and (current_time - cache_time < 300):
-        logger.info("Используются кэшированные данные")
-        return schedule_cache, None, "cached"
+    def refresh(self):
+        """Загрузка данных. Одновременные вызовы получают результат одной загрузки"""
+        with self.lock:
+            flight = self._in_flight
+            is_leader = flight is None
+            if is_leader:
+                flight = self._in_flight = FetchInFlight()
+                self.last_attempt_time = time.time()
+            has_cached_data = self.data is not None
+        
+        if not is_leader:
+            flight.done.wait()
+            return flight.result
+        
+        try:
+            started = time.perf_counter()
+            try:
+                schedule_data, error_msg, status = self.fetch_func(has_cached_data)
+            except Exception as e:
+                schedule_data, error_msg, status = None, f"Неизвестная ошибка при получении данных: {e}", "error"
+            if status not in SHARED_STATUSES and status not in UPSTREAM_SKIPPED_STATUSES:
+                # Чтение общего кэша и пропуск из-за сбоев - не обращение к Google Sheets
+                SHEETS_FETCH_SECONDS.observe(time.perf_counter() - started, self.roster_id)
+                UPSTREAM_FETCHES.inc(self.roster_id, status)
+            flight.result = self._store(schedule_data, error_msg, status)
+            if flight.result[2] == "success":
+                save_schedule_snapshot(schedule_data, self.roster_id)
+        finally:
+            with self.lock:
+                self._in_flight = None
+            flight.done.set()
+        
+        return flight.result
     
-    try:
-        client = get_google_sheets_client()
-        if not client:
-            error_msg = "Не удалось инициализировать клиент Google Sheets"
-            last_error = error_msg
-            logger.error(error_msg)
-            return None, error_msg, "error"
+    def _store(self, schedule_data, error_msg, status):
+        """Сохранение результата загрузки. При ошибке остаётся устаревшая копия"""
+        current_time = time.time()
+        
+        with self.lock:
+            self.fetch_count += 1
+            self.last_status = status
+            
+            if status in ("not_modified", "shared_unchanged") and self.data is not None:
+                # Таблица не менялась - только продлеваем срок жизни кэша.
+                # В общем кэше error_msg - ошибка процесса, который обновляет данные
+                self.cache_time = current_time
+                self.last_error = error_msg
+                return self.data, error_msg, status
             
-        # Открываем таблицу по URL
-        logger.info(f"Открытие таблицы: {GOOGLE_SHEET_URL}")
-        sheet = client.open_by_url(GOOGLE_SHEET_URL)
+            if isinstance(schedule_data, ScheduleIndex):
+                # Версия из общего кэша одинакова во всех процессах
+                self.version = schedule_data.version
+                self.data = schedule_data
+                self.changed.notify_all()
+                self.cache_time = current_time
+                self.last_error = None
+                return self.data, None, status
+            
+            if schedule_data is not None:
+                # Индекс строится один раз на каждую версию данных
+                index = ScheduleIndex(schedule_data, self.version + 1)
+                if self.data is not None and index.digest == self.data.digest:
+                    # Лист загружен заново, но записи те же: версия, страницы и ETag не меняются
+                    self.last_status = "not_modified"
+                    self.cache_time = current_time
+                    self.last_error = None
+                    return self.data, None, "not_modified"
+                self.version += 1
+                self.data = index
+                self.changed.notify_all()
+                self.cache_time = current_time
+                self.last_error = None
+                logger.info("Данные графика '%s' успешно получены и закэшированы", self.roster_id)
+                return self.data, None, status
+            
+            if status in SHARED_STATUSES and error_msg == self.last_error:
+                # Ошибку из общего кэша уже записал в лог процесс, который обновляет данные
+                return self.data, error_msg, status
+            if status in UPSTREAM_SKIPPED_STATUSES:
+                # Пауза обращений уже записана в лог автоматом защиты - отдаем устаревшую копию
+                self.last_error = error_msg
+                self.last_error_time = current_time
+                logger.info(error_msg)
+                return self.data, error_msg, status
+            self.last_error = error_msg
+            self.last_error_time = current_time
+            logger.error(error_msg)
+            if self.data is not None:
+                logger.warning("Обновление не удалось, используется устаревшая копия расписания")
+            return self.data, error_msg, status
+    
+    def load(self, schedule_data, cache_time):
+        """Заполнение пустого кэша сохранённой копией"""
+        with self.lock:
+            if self.data is not None:
+                return False
+            self.version += 1
+            self.data = ScheduleIndex(schedule_data, self.version)
+            self.changed.notify_all()
+            self.cache_time = cache_time
+            self.last_status = "snapshot"
+            return True
+    
+    def wait_for_change(self, known_version, timeout):
+        """Ожидание версии данных, отличной от known_version; возвращает текущую версию"""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != known_version, timeout)
+            return self.version
+    
+    def get(self):
+        """Данные из памяти. При пустом кэше - ожидание общей загрузки"""
+        with self.lock:
+            if self.data is not None:
+                CACHE_REQUESTS.inc(self.roster_id, 'stale' if self.last_error else 'hit')
+                return self.data, self.last_error, "cached"
+            CACHE_REQUESTS.inc(self.roster_id, 'miss')
+            in_flight = self._in_flight is not None
+            recently_failed = time.time() - self.last_attempt_time < MIN_REQUEST_INTERVAL
+            if not in_flight and recently_failed:
+                # Не повторяем неудачную загрузку чаще MIN_REQUEST_INTERVAL
+                return None, self.last_error or "Данные загружаются, повторите попытку позже", self.last_status or "loading"
+        
+        return self.refresh()
+
+def fetch_schedule(source, has_cached_data=False):
+    """Загрузка графика: напрямую из источника или через общий кэш процессов"""
+    if shared_store is None:
+        return source.fetch(has_cached_data)
+    return fetch_through_shared_store(source, has_cached_data)
+
+def create_schedule_caches():
+    """Отдельный кэш для каждого графика из SCHEDULE_SOURCES"""
+    return {
+        source['id']: ScheduleCache(partial(fetch_schedule, create_schedule_source(source)), source['id'])
+        for source in SCHEDULE_SOURCES
+    }
+
+schedule_caches = create_schedule_caches()
+
+def get_schedule_cache(roster_id=None):
+    """Кэш графика по идентификатору (по умолчанию - основной график)"""
+    return schedule_caches[roster_id or DEFAULT_ROSTER]
+
+# =============================================================================
+# СНИМОК РАСПИСАНИЯ НА ДИСКЕ
+# =============================================================================
+
+# Версия формата файла снимка
+SNAPSHOT_FORMAT = 2
+
+def get_snapshot_path(roster_id=None):
+    """Файл снимка графика: основной - SNAPSHOT_FILE, остальные - с суффиксом id"""
+    if not SNAPSHOT_FILE:
+        return None
+    if not roster_id or roster_id == DEFAULT_ROSTER:
+        return SNAPSHOT_FILE
+    base, ext = os.path.splitext(SNAPSHOT_FILE)
+    return f"{base}.{roster_id}{ext or '.json'}"
+
+def schedule_to_rows(schedule_data):
+    """Компактные строки: [порядковый номер даты, имя, исходное имя или null, строка, колонка, исходная дата или null]"""
+    return [
+        [duty.date.toordinal(), duty.name, None if duty.raw_name is duty.name else duty.raw_name,
+         duty.row, duty.col, duty.source_date]
+        for duty in schedule_data
+    ]
+
+def schedule_from_rows(rows):
+    """Записи расписания из компактных строк"""
+    intern = sys.intern
+    schedule_data = []
+    for ordinal, name, raw_name, row, col, source_date in rows:
+        name = intern(name)
+        schedule_data.append(DutyRecord(
+            date.fromordinal(ordinal), name, name if raw_name is None else intern(raw_name), row, col, source_date
+        ))
+    return schedule_data
+
+def save_schedule_snapshot(schedule_data, roster_id=None):
+    """Атомарная запись расписания в файл снимка"""
+    snapshot_file = get_snapshot_path(roster_id)
+    if not snapshot_file:
+        return False
+    
+    snapshot = {
+        'format': SNAPSHOT_FORMAT,
+        'saved_at': time.time(),
+        'records': schedule_to_rows(schedule_data)
+    }
+    
+    tmp_file = f"{snapshot_file}.tmp"
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        # Замена файла атомарна: читатели видят либо старый, либо новый снимок
+        os.replace(tmp_file, snapshot_file)
+        logger.info("Снимок расписания сохранён: %s (%s записей)", snapshot_file, len(schedule_data))
+        return True
+    except OSError as e:
+        logger.warning("Не удалось сохранить снимок расписания: %s", e)
+        return False
+
+def load_schedule_snapshot(roster_id=None):
+    """Загрузка снимка расписания в пустой кэш (одно чтение файла)"""
+    snapshot_file = get_snapshot_path(roster_id)
+    if not snapshot_file or not os.path.exists(snapshot_file):
+        return False
+    
+    started = time.perf_counter()
+    try:
+        with open(snapshot_file, 'rb') as f:
+            snapshot = json.loads(f.read())
         
-        # Получаем лист "Вечернее дежурство"
-        logger.info("Получение листа 'Вечернее дежурство'")
-        worksheet = sheet.worksheet("Вечернее дежурство")
+        if not isinstance(snapshot, dict) or snapshot.get('format') != SNAPSHOT_FORMAT:
+            logger.warning("Неизвестный формат снимка расписания: %s", snapshot_file)
+            return False
+        
+        schedule_data = schedule_from_rows(snapshot['records'])
+        saved_at = float(snapshot['saved_at'])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("Не удалось загрузить снимок расписания: %s", e)
+        return False
+    
+    if not get_schedule_cache(roster_id).load(schedule_data, saved_at):
+        return False
+    
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info("Загружен снимок графика '%s': %s записей за %.1f мс", roster_id or DEFAULT_ROSTER, len(schedule_data), elapsed_ms)
+    return True
+
+# =============================================================================
+# ОБЩИЙ КЭШ ДЛЯ НЕСКОЛЬКИХ ПРОЦЕССОВ
+# =============================================================================
+
+# Статусы чтения общего кэша (не обращения к Google Sheets)
+SHARED_STATUSES = ("shared", "shared_unchanged", "loading")
+
+SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedules (
+    roster_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    saved_at REAL,
+    checked_at REAL NOT NULL,
+    status TEXT,
+    error TEXT,
+    records TEXT
+);
+CREATE TABLE IF NOT EXISTS refresher (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    owner TEXT,
+    expires_at REAL NOT NULL DEFAULT 0,
+    requested_at REAL NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO refresher (id) VALUES (1);
+"""
+
+class SharedScheduleStore:
+    """Кэш расписания в SQLite, общий для процессов gunicorn, и аренда права на обновление"""
+    
+    def __init__(self, path, worker_id=None):
+        self.path = path
+        self._worker_id = worker_id
+        self.local = threading.local()
+        # До какого времени этот процесс владеет арендой (по его последней записи)
+        self.lease_expires_at = 0
+        self._connection().executescript(SHARED_SCHEMA)
+    
+    @property
+    def worker_id(self):
+        """Идентификатор процесса (после fork меняется вместе с pid)"""
+        return self._worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    
+    def _connection(self):
+        """Отдельное соединение для каждого потока и процесса"""
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # WAL: читатели не блокируют процесс, который записывает новые данные
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+    
+    @contextmanager
+    def _transaction(self):
+        """Транзакция с блокировкой на запись: проверка и изменение выполняются атомарно"""
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+    
+    def acquire_lease(self):
+        """Захват или продление аренды. False - данные обновляет другой процесс"""
+        now = time.time()
+        worker_id = self.worker_id
+        with self._transaction() as db:
+            owner, expires_at = db.execute("SELECT owner, expires_at FROM refresher WHERE id = 1").fetchone()
+            if owner != worker_id and expires_at > now:
+                self.lease_expires_at = 0
+                return False
+            db.execute("UPDATE refresher SET owner = ?, expires_at = ? WHERE id = 1",
+                       (worker_id, now + SHARED_LEASE_TTL))
         
-        schedule_data = parse_schedule_data(worksheet)
+        if owner != worker_id:
+            logger.info("Процесс %s обновляет общий кэш расписания", worker_id)
+        self.lease_expires_at = now + SHARED_LEASE_TTL
+        return True
+    
+    def release_lease(self):
+        """Освобождение аренды при остановке процесса"""
+        with self._transaction() as db:
+            db.execute("UPDATE refresher SET expires_at = 0 WHERE id = 1 AND owner = ?", (self.worker_id,))
+        self.lease_expires_at = 0
+    
+    def is_refresher(self):
+        return self.lease_expires_at > time.time()
+    
+    def request_refresh(self):
+        """Просьба к процессу-владельцу аренды обновить данные досрочно"""
+        self._connection().execute("UPDATE refresher SET requested_at = ? WHERE id = 1", (time.time(),))
+    
+    def refresh_due(self, roster_id):
+        """Пора ли обращаться к Google Sheets за графиком"""
+        db = self._connection()
+        requested_at = db.execute("SELECT requested_at FROM refresher WHERE id = 1").fetchone()[0]
+        row = db.execute("SELECT version, checked_at FROM schedules WHERE roster_id = ?", (roster_id,)).fetchone()
+        if row is None:
+            return True
         
+        version, checked_at = row
+        elapsed = time.time() - checked_at
+        if elapsed >= REFRESH_INTERVAL:
+            return True
+        # Досрочно - по запросу клиента или пока данных нет, но не чаще MIN_REQUEST_INTERVAL
+        return (requested_at > checked_at or not version) and elapsed >= MIN_REQUEST_INTERVAL
+    
+    def current_version(self, roster_id):
+        row = self._connection().execute("SELECT version FROM schedules WHERE roster_id = ?", (roster_id,)).fetchone()
+        return row[0] if row else 0
+    
+    def publish(self, roster_id, schedule_data, status):
+        """Запись новых данных графика; возвращает их версию и время"""
+        records = json.dumps(schedule_to_rows(schedule_data), ensure_ascii=False, separators=(',', ':'))
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("SELECT version FROM schedules WHERE roster_id = ?", (roster_id,)).fetchone()
+            version = (row[0] if row else 0) + 1
+            db.execute(
+                "INSERT OR REPLACE INTO schedules (roster_id, version, saved_at, checked_at, status, error, records) "
+                "VALUES (?, ?, ?, ?, ?, NULL, ?)",
+                (roster_id, version, now, now, status, records)
+            )
+        return version, now
+    
+    def record_attempt(self, roster_id, status, error_msg):
+        """Обновление без новых данных: время проверки и ошибка для остальных процессов"""
+        self._connection().execute(
+            "INSERT INTO schedules (roster_id, checked_at, status, error) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (roster_id) DO UPDATE SET "
+            "checked_at = excluded.checked_at, status = excluded.status, error = excluded.error",
+            (roster_id, time.time(), status, error_msg)
+        )
+    
+    def load(self, roster_id, known_version):
+        """(версия, время, ошибка, записи); записи читаются, только если версия новее known_version"""
+        return self._connection().execute(
+            "SELECT version, saved_at, error, CASE WHEN version > ? THEN records END "
+            "FROM schedules WHERE roster_id = ?",
+            (known_version, roster_id)
+        ).fetchone()
+    
+    def describe(self):
+        """Состояние общего кэша для страницы отладки"""
+        owner, expires_at = self._connection().execute(
+            "SELECT owner, expires_at FROM refresher WHERE id = 1"
+        ).fetchone()
+        return {
+            'path': self.path,
+            'worker': self.worker_id,
+            'refresher': owner if expires_at > time.time() else None,
+            'is_refresher': self.is_refresher()
+        }
+
+def fetch_through_shared_store(source, has_cached_data=False):
+    """Загрузка через общий кэш: к источнику обращается только процесс с арендой"""
+    roster_id = source.id
+    known_version = get_schedule_cache(roster_id).version
+    
+    if shared_store.refresh_due(roster_id) and shared_store.acquire_lease():
+        # Проверка ревизии допустима, только если в памяти последняя общая версия
+        if shared_store.current_version(roster_id) != known_version:
+            has_cached_data = False
+        schedule_data, error_msg, status = source.fetch(has_cached_data)
+        cached = get_schedule_cache(roster_id).data
+        if (schedule_data is not None and has_cached_data and cached is not None
+                and cached.digest == ScheduleIndex(schedule_data).digest):
+            # Записи не изменились - новую версию не публикуем
+            shared_store.record_attempt(roster_id, "not_modified", None)
+            return None, None, "not_modified"
         if schedule_data is not None:
-            # Сохраняем в кэш
-            schedule_cache = schedule_data
-            cache_time = current_time
-            last_error = None
-            logger.info("Данные успешно получены и закэшированы")
-            return schedule_data, None, "success"
-        else:
-            error_msg = "Не удалось распарсить данные таблицы"
-            last_error = error_msg
-            logger.error(error_msg)
-            return None, error_msg, "error"
-            
-    except gspread.exceptions.APIError as e:
-        error_msg = f"Ошибка API Google Sheets: {e}"
-        last_error = error_msg
-        logger.error(error_msg)
-        return None, error_msg, "api_error"
-    except gspread.exceptions.SpreadsheetNotFound:
-        error_msg = "Таблица не найдена. Проверьте URL и доступы."
-        last_error = error_msg
-        logger.error(error_msg)
-        return None, error_msg, "not_found"
+            version, saved_at = shared_store.publish(roster_id, schedule_data, status)
+            return ScheduleIndex(schedule_data, version, saved_at), None, status
+        shared_store.record_attempt(roster_id, status, error_msg)
+        return None, error_msg, status
+    
+    entry = shared_store.load(roster_id, known_version)
+    if entry is None:
+        return None, "Данные загружаются, повторите попытку позже", "loading"
+    
+    version, saved_at, error_msg, records = entry
+    if records is not None:
+        return ScheduleIndex(schedule_from_rows(json.loads(records)), version, saved_at), None, "shared"
+    return None, error_msg, "shared_unchanged"
+
+shared_store = SharedScheduleStore(SHARED_CACHE_DB) if SHARED_CACHE_DB else None
+
+# =============================================================================
+# ФОНОВОЕ ОБНОВЛЕНИЕ
+# =============================================================================
+
+def refresh_schedule_cache(roster_id=None):
+    """Обновление кэша одного графика"""
+    return get_schedule_cache(roster_id).refresh()[2]
+
+# Ограниченный пул потоков для параллельной загрузки графиков
+fetch_executor = ThreadPoolExecutor(max_workers=max(1, FETCH_WORKERS), thread_name_prefix='schedule-fetch')
+
+def refresh_all_schedules():
+    """Параллельное обновление всех графиков: время равно времени самого медленного"""
+    futures = {
+        roster_id: fetch_executor.submit(cache.refresh)
+        for roster_id, cache in schedule_caches.items()
+    }
+    return {roster_id: future.result()[2] for roster_id, future in futures.items()}
+
+def get_refresh_delay():
+    """Пауза до следующего обновления: реже при нехватке квоты или разомкнутой цепи"""
+    if shared_store is not None:
+        return SHARED_SYNC_INTERVAL
+    sheets_sources = sum(1 for source in SCHEDULE_SOURCES if source.get('type', 'sheets') == 'sheets')
+    delay = max(REFRESH_INTERVAL, sheets_quota.wait_time(READS_PER_FETCH * sheets_sources))
+    allowed, retry_after = upstream_breaker.allow()
+    if allowed:
+        # Проверка не должна занимать пробную попытку - ее сделает следующее обновление
+        upstream_breaker.release()
+    else:
+        delay = max(delay, retry_after)
+    return delay
+
+def background_refresher():
+    """Фоновый поток: обновляет кэш раз в REFRESH_INTERVAL секунд или по запросу"""
+    # Шаблон компилируется заранее, чтобы первый запрос страницы его не ждал
+    try:
+        app.jinja_env.get_template('index.html')
     except Exception as e:
-        error_msg = f"Неизвестная ошибка при получении данных: {e}"
-        last_error = error_msg
-        logger.error(error_msg)
-        return None, error_msg, "error"
+        logger.warning("Не удалось подготовить шаблон страницы: %s", e)
+    
+    while True:
+        try:
+            if shared_store is not None:
+                # Владелец продлевает аренду, остальные процессы только сверяются с общим кэшем
+                shared_store.acquire_lease()
+            refresh_all_schedules()
+        except Exception as e:
+            logger.error("Ошибка в фоновом обновлении: %s", e)
+        
+        refresh_event.wait(get_refresh_delay())
+        refresh_event.clear()
+
+def start_background_refresher():
+    """Запуск фонового потока обновления (однократно)"""
+    global refresher_thread
+    
+    with refresher_lock:
+        if refresher_thread is not None and refresher_thread.is_alive():
+            return
+        # Сначала отдаем сохранённый снимок, пока идет первое обновление.
+        # С общим кэшем снимок не нужен: данные уже лежат в SQLite
+        if refresher_thread is None and shared_store is None:
+            for roster_id in schedule_caches:
+                load_schedule_snapshot(roster_id)
+        refresher_thread = threading.Thread(
+            target=background_refresher,
+            name='schedule-refresher',
+            daemon=True
+        )
+        refresher_thread.start()
+        logger.info("Фоновое обновление запущено, интервал: %sс", REFRESH_INTERVAL)
+
+def request_refresh():
+    """Досрочное фоновое обновление в пределах бюджета обращений к Google Sheets"""
+    if not upstream_budget.try_acquire():
+        return False
+    
+    if shared_store is not None:
+        # Обновит процесс-владелец аренды при ближайшей сверке
+        shared_store.request_refresh()
+    start_background_refresher()
+    refresh_event.set()
+    return True
+
+def get_schedule_data_with_protection(roster_id=None):
+    """Получение данных о дежурствах из памяти, без обращения к Google Sheets"""
+    start_background_refresher()
+    
+    # При пустом кэше одновременные запросы ждут одну общую загрузку
+    return get_schedule_cache(roster_id).get()
 
 def get_today_duty(schedule_data):
     """Получение дежурного на сегодня"""
@@ -300,146 +1837,742 @@ def get_today_duty(schedule_data):
         return None
     
     today = date.today()
-    logger.info(f"Поиск дежурного на сегодня: {today.strftime('%d.%m.%Y')}")
+    logger.info("Поиск дежурного на сегодня: %s", today.strftime('%d.%m.%Y'))
     
-    for duty in schedule_data:
-        if duty['date'] == today:
-            logger.info(f"Найден дежурный на сегодня: {duty['name']}")
-            return duty
+    duty = as_schedule_index(schedule_data).get(today)
+    if duty:
+        logger.info("Найден дежурный на сегодня: %s", duty.name)
+        return duty
     
     logger.warning("На сегодня дежурный не назначен")
     return None
 
-def get_two_work_weeks(schedule_data):
-    """Получаем 2 недели рабочих дней (12 дней: ПН-СБ)"""
+def get_display_weeks(schedule_data, today=None):
+    """Недели для экрана: DISPLAY_WEEKS недель по дням WORK_DAYS (по умолчанию 2 недели ПН-СБ).
+    
+    Результат запоминается в индексе расписания по дню и настройкам экрана: новая версия
+    данных - новый индекс, а смена дня меняет ключ, поэтому устаревший вид не используется.
+    """
     if not schedule_data:
         logger.warning("Нет данных для отображения")
-        return []
+        return ()
     
-    today = date.today()
+    today = today or date.today()
+    schedule_index = as_schedule_index(schedule_data)
+    key = (today, DISPLAY_WEEKS, WORK_DAYS)
+    cached = schedule_index.week_view
+    if cached is not None and cached[0] == key:
+        return cached[1]
     
-    # Определяем начало текущей недели (понедельник)
+    # Начало текущей недели (понедельник); после последнего рабочего дня - следующая неделя
     current_week_start = today - timedelta(days=today.weekday())
+    if today.weekday() > WORK_DAYS[-1]:
+        current_week_start += timedelta(weeks=1)
+    
+    logger.info("Сегодня: %s (%s)", today.strftime('%d.%m.%Y'), get_weekday_name(today))
+    
+    # Записи из таблицы (без копирования) или пустые ячейки, по неделе в строке
+    display_weeks = tuple(
+        tuple(
+            schedule_index.get(day) or empty_duty(day)
+            for day in (current_week_start + timedelta(weeks=week_offset, days=weekday) for weekday in WORK_DAYS)
+        )
+        for week_offset in range(DISPLAY_WEEKS)
+    )
+    
+    logger.info("Сформировано %s недель для отображения", len(display_weeks))
+    schedule_index.week_view = (key, display_weeks)
+    return display_weeks
+
+# =============================================================================
+# КЭШ ОТРИСОВАННЫХ СТРАНИЦ
+# =============================================================================
+
+class RenderedPageCache:
+    """Готовый HTML страниц по ключу (график, версия данных, день, минута)"""
     
-    # Если сегодня воскресенье, начинаем со следующей недели
-    if today.weekday() == 6:  # Воскресенье
-        current_week_start = today + timedelta(days=1)
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        with self.lock:
+            page = self.pages.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self.pages.move_to_end(key)
+            self.hits += 1
+            return page
+    
+    def put(self, key, page):
+        with self.lock:
+            self.pages[key] = page
+            self.pages.move_to_end(key)
+            while len(self.pages) > self.max_entries:
+                self.pages.popitem(last=False)
+
+rendered_pages = RenderedPageCache()
+
+def make_etag(key):
+    """Сильный ETag по ключу содержимого"""
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:24]
+
+def is_not_modified(etag, last_modified):
+    """Проверка условного запроса: If-None-Match, затем If-Modified-Since"""
+    if request.if_none_match:
+        # Клиент мог получить сжатый вариант с ETag "<etag>-gzip"
+        return request.if_none_match.contains(etag) or request.if_none_match.contains(f"{etag}-gzip")
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+def conditional_response(body, etag, last_modified, mimetype='text/html'):
+    """Ответ с ETag и Last-Modified; 304 без тела, если у клиента актуальная копия"""
+    if is_not_modified(etag, last_modified):
+        response = make_response('', 304)
     else:
-        # Иначе начинаем с текущего понедельника
-        current_week_start = today - timedelta(days=today.weekday())
+        response = make_response(body)
+        response.mimetype = mimetype
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # Клиент хранит копию, но каждый раз сверяет её с сервером
+    response.cache_control.no_cache = True
+    return response
+
+# =============================================================================
+# СТАТИЧЕСКИЕ ФАЙЛЫ И СЖАТИЕ ОТВЕТОВ
+# =============================================================================
+
+# Год - браузер не перепроверяет файл, новое содержимое получает новый адрес
+STATIC_MAX_AGE = 365 * 24 * 3600
+# Типы, которые имеет смысл сжимать (картинки и шрифты уже сжаты)
+COMPRESSIBLE_MIMETYPES = frozenset((
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/calendar',
+    'application/javascript', 'text/javascript', 'application/json', 'image/svg+xml'
+))
+# Ответы меньше этого размера не сжимаются - заголовки съедят выигрыш
+MIN_COMPRESS_BYTES = 512
+
+class StaticAsset(namedtuple('StaticAsset', 'filename url_name digest mimetype variants')):
+    """Статический файл: адрес с хэшем содержимого и готовые варианты (identity, gzip, br)"""
+    __slots__ = ()
+
+static_assets = None
+static_assets_lock = threading.Lock()
+
+def fingerprint_name(filename, digest):
+    """style.css -> style.<хэш>.css"""
+    base, ext = os.path.splitext(filename)
+    return f"{base}.{digest}{ext}"
+
+def compress_variants(data, mimetype):
+    """Сжатые варианты содержимого: gzip всегда, brotli - если установлен пакет brotli"""
+    variants = {'identity': data}
+    if mimetype not in COMPRESSIBLE_MIMETYPES or len(data) < MIN_COMPRESS_BYTES:
+        return variants
+    # mtime=0 - одинаковое содержимое дает одинаковый архив во всех процессах
+    variants['gzip'] = gzip.compress(data, compresslevel=9, mtime=0)
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data) or encoding == 'identity'}
+
+def build_static_assets(folder):
+    """Хэши и сжатые копии всех файлов в static/ (один раз при первом обращении)"""
+    assets = {}
+    for root, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            asset = StaticAsset(filename, fingerprint_name(filename, digest), digest, mimetype,
+                                compress_variants(data, mimetype))
+            # Файл доступен и по обычному имени, и по имени с хэшем
+            assets[filename] = assets[asset.url_name] = asset
+    logger.info("Подготовлено статических файлов: %s", len({asset.filename for asset in assets.values()}))
+    return assets
+
+def get_static_assets():
+    global static_assets
+    if static_assets is None:
+        with static_assets_lock:
+            if static_assets is None:
+                static_assets = build_static_assets(app.static_folder)
+    return static_assets
+
+def choose_encoding(available):
+    """Лучшее сжатие из поддерживаемых клиентом: br, затем gzip"""
+    for encoding in ('br', 'gzip'):
+        if encoding in available and request.accept_encodings[encoding]:
+            return encoding
+    return 'identity'
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    """url_for('static', filename='style.css') -> /static/style.<хэш>.css"""
+    if endpoint != 'static' or 'filename' not in values:
+        return
+    asset = get_static_assets().get(values['filename'])
+    if asset is not None:
+        values['filename'] = asset.url_name
+
+def serve_static(filename):
+    """Статика из памяти: по адресу с хэшем - кэш на год, сжатый вариант по Accept-Encoding"""
+    asset = get_static_assets().get(filename)
+    if asset is None:
+        # Файл появился после запуска - отдаем обычным способом
+        return app.send_static_file(filename)
     
-    logger.info(f"Сегодня: {today.strftime('%d.%m.%Y')} ({get_weekday_name(today)})")
+    encoding = choose_encoding(asset.variants)
+    response = make_response(asset.variants[encoding])
+    response.mimetype = asset.mimetype
+    response.vary.add('Accept-Encoding')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(f"{asset.digest}-{encoding}")
+    if filename == asset.url_name:
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# Встроенный маршрут /static/<filename> отдает файлы из памяти
+app.view_functions['static'] = serve_static
+
+# Сжатые ответы по ETag: страница одной версии сжимается один раз на все экраны
+compressed_bodies = RenderedPageCache(max_entries=64)
+
+@app.after_request
+def compress_response(response):
+    """Сжатие HTML и JSON на лету (gzip), если клиент его поддерживает"""
+    if response.status_code == 304:
+        # Подтверждаем тот вариант ETag, который прислал клиент
+        etag = response.get_etag()[0]
+        if etag and request.if_none_match.contains(f"{etag}-gzip"):
+            response.set_etag(f"{etag}-gzip")
+        return response
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
     
-    # Создаем 2 недели рабочих дней (12 дней: ПН-СБ)
-    weeks = []
-    all_work_days = []
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_BYTES:
+        return response
     
-    # Генерируем 12 рабочих дней (2 недели × 6 дней)
-    for week_offset in range(2):  # 2 недели
-        week_start = current_week_start + timedelta(weeks=week_offset)
-        week_days = []
-        
-        # Добавляем дни с понедельника по субботу (6 дней)
-        for day_offset in range(6):  # ПН-СБ
-            current_date = week_start + timedelta(days=day_offset)
-            week_days.append(current_date)
-        
-        all_work_days.extend(week_days)
+    etag = response.get_etag()[0]
+    body = compressed_bodies.get(etag) if etag else None
+    if body is None:
+        body = gzip.compress(data, compresslevel=6, mtime=0)
+        if etag:
+            compressed_bodies.put(etag, body)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = 'gzip'
+    if etag:
+        # У сжатого варианта свой ETag: кэши не должны путать его с несжатым
+        response.set_etag(f"{etag}-gzip")
+    return response
+
+# =============================================================================
+# ОБНОВЛЕНИЯ В РЕАЛЬНОМ ВРЕМЕНИ (SSE И LONG-POLL)
+# =============================================================================
+
+# Сколько держать соединение без изменений до keep-alive / пустого ответа (секунды)
+LIVE_UPDATE_TIMEOUT = 25
+
+# Состояния экрана по (график, версия данных, день) - считаются один раз на версию
+live_states = OrderedDict()
+live_states_lock = threading.Lock()
+
+def get_live_state(roster_id, schedule_data, today):
+    """Содержимое экрана: дежурный на сегодня и имена в ячейках двух недель"""
+    version = schedule_data.version if schedule_data else 0
+    key = (roster_id, version, today)
     
-    logger.info(f"Сгенерировано {len(all_work_days)} рабочих дней для отображения")
+    with live_states_lock:
+        state = live_states.get(key)
+    if state is not None:
+        return state
     
-    # Создаем словарь для быстрого поиска дежурств по дате
-    schedule_dict = {duty['date']: duty for duty in schedule_data}
+    today_duty = get_today_duty(schedule_data) if schedule_data else None
+    state = {
+        'version': version,
+        'today': today.isoformat(),
+        'today_duty': today_duty.name if today_duty else '',
+        'cells': {
+            duty.date.isoformat(): duty.name
+            for week in get_display_weeks(schedule_data, today)
+            for duty in week
+        } if schedule_data else {}
+    }
     
-    # Формируем данные для отображения
-    display_weeks = []
-    current_week_data = []
+    with live_states_lock:
+        live_states[key] = state
+        while len(live_states) > 64:
+            live_states.popitem(last=False)
+    return state
+
+def build_schedule_update(roster_id, since_version):
+    """Изменения экрана относительно версии, которую уже показывает клиент"""
+    schedule_data = get_schedule_cache(roster_id).state()[0]
+    today = date.today()
+    state = get_live_state(roster_id, schedule_data, today)
     
-    for i, work_date in enumerate(all_work_days):
-        # Ищем дежурного на эту дату
-        duty = schedule_dict.get(work_date)
-        
-        if duty:
-            # Используем данные из таблицы
-            display_duty = duty.copy()
-        else:
-            # Создаем пустую запись
-            display_duty = {
-                'date': work_date,
-                'name': '',
-                'date_str': work_date.strftime('%d.%m.%Y'),
-                'raw_name': '',
-                'weekday': get_weekday_name(work_date)
-            }
-        
-        current_week_data.append(display_duty)
+    with live_states_lock:
+        previous = live_states.get((roster_id, since_version, today))
+    
+    if previous is None:
+        # Версия клиента неизвестна - отправляем все ячейки
+        cells = state['cells']
+    else:
+        cells = {day: name for day, name in state['cells'].items() if previous['cells'].get(day) != name}
+    
+    return {
+        'changed': state['version'] != since_version,
+        'version': state['version'],
+        'today': state['today'],
+        'today_duty': state['today_duty'],
+        'cells': cells,
+        'full': previous is None
+    }
+
+def schedule_event_stream(roster_id, since_version):
+    """Поток SSE: событие только при смене версии данных, иначе keep-alive"""
+    cache = get_schedule_cache(roster_id)
+    
+    while True:
+        version = cache.wait_for_change(since_version, LIVE_UPDATE_TIMEOUT)
+        if version == since_version:
+            yield ": keep-alive\n\n"
+            continue
         
-        # Разделяем на недели (по 6 дней)
-        if len(current_week_data) == 6:
-            display_weeks.append(current_week_data)
-            current_week_data = []
+        update = build_schedule_update(roster_id, since_version)
+        since_version = update['version']
+        payload = json.dumps(update, ensure_ascii=False, separators=(',', ':'))
+        yield f"id: {since_version}\nevent: schedule\ndata: {payload}\n\n"
+
+# =============================================================================
+# ВЫГРУЗКА ГРАФИКА (ICS И CSV)
+# =============================================================================
+
+EXPORT_MIMETYPES = {
+    'ics': 'text/calendar; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+# Сколько записей собирать в один фрагмент ответа
+EXPORT_BATCH = 500
+
+def ics_escape(text):
+    """Экранирование текста для iCalendar (переводы строк любого вида - как \\n)"""
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def ics_line(line):
+    """Строка iCalendar с переносом после 75 байт (RFC 5545)"""
+    if len(line.encode('utf-8')) <= 75:
+        return line + '\r\n'
+    parts = []
+    current = ''
+    size = 0
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > 75:
+            parts.append(current)
+            # Строка-продолжение начинается с пробела
+            current, size = ' ', 1
+        current += char
+        size += char_size
+    parts.append(current)
+    return '\r\n'.join(parts) + '\r\n'
+
+def generate_ics(roster, schedule_data):
+    """Календарь iCalendar: событие на весь день для каждого дежурства"""
+    stamp = datetime.fromtimestamp(schedule_data.created_at, timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield (
+        'BEGIN:VCALENDAR\r\n'
+        'VERSION:2.0\r\n'
+        'PRODID:-//Duty Schedule//RU\r\n'
+        'CALSCALE:GREGORIAN\r\n'
+        + ics_line(f"X-WR-CALNAME:{ics_escape(roster['title'])}")
+    )
+    
+    lines = []
+    for position, duty in enumerate(schedule_data, 1):
+        day = duty.date
+        lines.append(
+            'BEGIN:VEVENT\r\n'
+            f"UID:{roster['id']}-{day:%Y%m%d}-{duty.cell_location or position}@duty-schedule\r\n"
+            f"DTSTAMP:{stamp}\r\n"
+            f"DTSTART;VALUE=DATE:{day:%Y%m%d}\r\n"
+            f"DTEND;VALUE=DATE:{day + timedelta(days=1):%Y%m%d}\r\n"
+            + ics_line(f"SUMMARY:{ics_escape(duty.name)}")
+            + (ics_line(f"DESCRIPTION:{ics_escape(duty.raw_name)}") if duty.raw_name != duty.name else '')
+            + 'END:VEVENT\r\n'
+        )
+        if position % EXPORT_BATCH == 0:
+            yield ''.join(lines)
+            lines = []
     
-    # Исправлено: проверяем current_week_data вместо current_work_days
-    if current_week_data:
-        display_weeks.append(current_week_data)
+    lines.append('END:VCALENDAR\r\n')
+    yield ''.join(lines)
+
+def generate_csv(roster, schedule_data):
+    """CSV с BOM (чтобы Excel распознал UTF-8): строка на каждое дежурство"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(['date', 'weekday', 'name', 'raw_name', 'date_str', 'cell_location'])
     
-    logger.info(f"Сформировано {len(display_weeks)} недель для отображения")
+    for position, duty in enumerate(schedule_data, 1):
+        writer.writerow([duty.date.isoformat(), duty.weekday, duty.name, duty.raw_name, duty.date_str, duty.cell_location])
+        if position % EXPORT_BATCH == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
     
-    return display_weeks
+    yield buffer.getvalue()
+
+EXPORT_GENERATORS = {
+    'ics': generate_ics,
+    'csv': generate_csv,
+}
+
+def get_export_path(roster_id, fmt, etag):
+    """Файл готовой выгрузки для версии данных (None - кэш на диске отключен)"""
+    if not EXPORT_CACHE_DIR:
+        return None
+    try:
+        os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    except OSError as e:
+        logger.warning("Кэш выгрузок недоступен: %s", e)
+        return None
+    return os.path.join(EXPORT_CACHE_DIR, f"{roster_id}.{etag}.{fmt}")
+
+def remove_stale_exports(path):
+    """Удаление выгрузок того же графика и формата для прошлых версий"""
+    directory, name = os.path.split(path)
+    roster_id, _, fmt = name.rsplit('.', 2)
+    for other in os.listdir(directory):
+        parts = other.rsplit('.', 2)
+        if other != name and len(parts) == 3 and parts[0] == roster_id and parts[2] == fmt:
+            try:
+                os.remove(os.path.join(directory, other))
+            except OSError:
+                pass
+
+def stream_and_cache(chunks, path):
+    """Отдача выгрузки клиенту с одновременной записью в файл кэша"""
+    tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    complete = False
+    try:
+        with open(tmp_file, 'wb') as f:
+            for chunk in chunks:
+                data = chunk.encode('utf-8')
+                f.write(data)
+                yield data
+        os.replace(tmp_file, path)
+        complete = True
+        remove_stale_exports(path)
+    finally:
+        # Клиент отключился на середине - недописанный файл не сохраняем
+        if not complete and os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+# =============================================================================
+# ПРОФИЛИРОВАНИЕ ЗАПРОСОВ
+# =============================================================================
+
+# Профилировщик в каждый момент один: в Python 3.12+ cProfile нельзя запустить дважды
+profile_lock = threading.Lock()
+
+def profile_top_functions(profiler, limit):
+    """Самые затратные функции по суммарному времени с вложенными вызовами"""
+    import pstats
+    stats = pstats.Stats(profiler).stats
+    top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            'function': f"{os.path.basename(filename)}:{line}({function})",
+            'calls': calls,
+            'own_ms': round(own_time * 1000, 3),
+            'cumulative_ms': round(cumulative_time * 1000, 3)
+        }
+        for (filename, line, function), (_, calls, own_time, cumulative_time, _) in top
+    ]
+
+@app.before_request
+def start_request_profile():
+    """?profile=1 при PROFILING_ENABLED: запрос выполняется под cProfile"""
+    if not PROFILING_ENABLED or request.args.get('profile') != '1':
+        return
+    if not profile_lock.acquire(blocking=False):
+        # Уже профилируется другой запрос - этот выполняется как обычно
+        return
+    # Модули профилировщика нужны только при отладке - не замедляют запуск
+    import cProfile
+    g.profiler = cProfile.Profile()
+    g.profile_started = time.perf_counter()
+    g.profiler.enable()
+
+@app.after_request
+def finish_request_profile(response):
+    """Вместо ответа - итог профилирования: код ответа, длительность, горячие функции.
+    
+    Для потоковых ответов (выгрузки, события) замеряется только обработчик маршрута.
+    """
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    profile_lock.release()
+    elapsed_ms = (time.perf_counter() - g.profile_started) * 1000
+    limit = min(PROFILE_MAX_TOP, max(1, request.args.get('profile_top', default=PROFILE_TOP, type=int)))
+    logger.warning("Профилирование %s: %.1f мс", request.path, elapsed_ms)
+    return make_response({
+        'path': request.full_path,
+        'status_code': response.status_code,
+        'elapsed_ms': round(elapsed_ms, 3),
+        'top': profile_top_functions(profiler, limit)
+    })
+
+@app.teardown_request
+def stop_request_profile(error=None):
+    """Профилировщик останавливается, даже если обработчик упал"""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        profile_lock.release()
 
 # =============================================================================
 # МАРШРУТЫ FLASK
 # =============================================================================
 
+if TRUSTED_PROXY_HOPS:
+    # За обратным прокси адрес клиента берется из X-Forwarded-For (только от доверенных прокси)
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS, x_host=TRUSTED_PROXY_HOPS)
+
+def get_client_token():
+    """Токен экрана из заголовка, параметра ?screen= или cookie; только из CLIENT_TOKENS.
+    
+    Токен задает сам клиент, поэтому неизвестные токены не учитываются:
+    иначе новый токен в каждом запросе обходил бы лимит.
+    """
+    for token in (request.headers.get('X-Client-Token'),
+                  request.args.get(CLIENT_TOKEN_PARAM),
+                  request.cookies.get(CLIENT_TOKEN_COOKIE)):
+        if token and token in CLIENT_TOKENS:
+            return token
+    return None
+
+def get_client_key():
+    """Идентификатор клиента для лимитов: токен экрана или IP-адрес"""
+    token = get_client_token()
+    if token:
+        return f"token:{token}"
+    return request.remote_addr or 'unknown'
+
+@app.after_request
+def remember_client_token(response):
+    """Токен из ?screen= сохраняется в cookie: его передадут перезагрузка страницы,
+    EventSource и long-poll, которые не умеют отправлять свои заголовки"""
+    token = request.args.get(CLIENT_TOKEN_PARAM)
+    if token in CLIENT_TOKENS and request.cookies.get(CLIENT_TOKEN_COOKIE) != token:
+        response.set_cookie(CLIENT_TOKEN_COOKIE, token, max_age=STATIC_MAX_AGE, httponly=True, samesite='Lax')
+    return response
+
+def rate_limited(limiter, on_reject=None):
+    """Декоратор маршрута: при превышении лимита клиента - 429.
+    
+    on_reject(retry_after, **kwargs) строит ответ вместо JSON (например, HTML-страницу).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            client_key = get_client_key()
+            allowed, retry_after = limiter.allow(client_key)
+            if not allowed:
+                retry_after = max(1, math.ceil(retry_after))
+                REQUEST_STATUS.inc('rate_limit')
+                logger.warning("Превышен лимит запросов клиента %s для %s", client_key, request.path)
+                if on_reject is not None:
+                    response = make_response(on_reject(retry_after, *args, **kwargs), 429)
+                else:
+                    response = make_response({
+                        'status': 'rate_limit',
+                        'error': 'Слишком много запросов',
+                        'retry_after': retry_after
+                    }, 429)
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def connection_limited(limiter):
+    """Декоратор долгих маршрутов: не больше limiter.limit открытых соединений клиента.
+    
+    Для потокового ответа место освобождается при закрытии соединения, иначе - по возврату.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            client_key = get_client_key()
+            if not limiter.acquire(client_key):
+                # Повтор - не раньше, чем закончится обычный цикл long-poll
+                retry_after = max(1, math.ceil(LIVE_UPDATE_TIMEOUT))
+                REQUEST_STATUS.inc('rate_limit')
+                logger.warning("Превышено число соединений клиента %s для %s", client_key, request.path)
+                response = make_response({
+                    'status': 'rate_limit',
+                    'error': 'Слишком много открытых соединений',
+                    'retry_after': retry_after
+                }, 429)
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+            
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                limiter.release(client_key)
+                raise
+            if response.is_streamed:
+                response.call_on_close(partial(limiter.release, client_key))
+            else:
+                limiter.release(client_key)
+            return response
+        return wrapper
+    return decorator
+
+def get_roster_source(roster_id=None):
+    """Описание графика по идентификатору из URL; неизвестный график - 404"""
+    roster_id = roster_id or DEFAULT_ROSTER
+    for source in SCHEDULE_SOURCES:
+        if source['id'] == roster_id:
+            return source
+    abort(404)
+
+def get_page_key(roster, schedule_data, error_display, now):
+    """Страница меняется только вместе с данными, датой, минутой на часах или ошибкой"""
+    version = schedule_data.version if schedule_data else 0
+    return (roster['id'], version, now.date().isoformat(), now.strftime('%H:%M'), error_display)
+
+def get_index_page(roster, schedule_data, error_display, now):
+    """HTML страницы графика: из кэша отрисованных страниц или новый рендер"""
+    current_time = now.strftime('%H:%M')
+    version = schedule_data.version if schedule_data else 0
+    page_key = get_page_key(roster, schedule_data, error_display, now)
+    
+    page = rendered_pages.get(page_key)
+    if page is None:
+        today_duty = None
+        weeks = []
+        if schedule_data:
+            today_duty = get_today_duty(schedule_data)
+            weeks = get_display_weeks(schedule_data, now.date())
+        
+        # Базовое состояние, относительно которого экран будет получать изменения
+        get_live_state(roster['id'], schedule_data, now.date())
+        route_roster_id = None if roster['id'] == DEFAULT_ROSTER else roster['id']
+        
+        with RENDER_SECONDS.time():
+            page = render_template('index.html', 
+                                 roster=roster,
+                                 rosters=SCHEDULE_SOURCES,
+                                 version=version,
+                                 events_url=url_for('schedule_events', roster_id=route_roster_id),
+                                 updates_url=url_for('api_updates', roster=route_roster_id),
+                                 today_duty=today_duty,
+                                 weeks=weeks,
+                                 display_weeks=DISPLAY_WEEKS,
+                                 today=now.date(),
+                                 current_time=current_time,
+                                 last_updated=current_time,
+                                 error=error_display)
+        rendered_pages.put(page_key, page)
+        logger.info("Рендеринг страницы завершен")
+    
+    return page
+
+def index_rate_limited(retry_after, roster_id=None):
+    """Экран превысил лимит: та же страница из кэша, без загрузки данных"""
+    roster = get_roster_source(roster_id)
+    schedule_data = get_schedule_cache(roster['id']).state()[0]
+    error_display = None if schedule_data else f"Слишком много запросов, повторите через {retry_after} с"
+    now = datetime.now().replace(second=0, microsecond=0)
+    return get_index_page(roster, schedule_data, error_display, now)
+
 @app.route('/')
-def index():
+@app.route('/roster/<roster_id>')
+@rate_limited(http_limiter, on_reject=index_rate_limited)
+def index(roster_id=None):
     """Главная страница с дежурствами"""
-    logger.info("Запрос главной страницы")
+    roster = get_roster_source(roster_id)
+    logger.info("Запрос страницы графика '%s'", roster['id'])
     
     # Получаем данные с защитой от частых запросов
-    schedule_data, error_msg, status = get_schedule_data_with_protection()
+    schedule_data, error_msg, status = get_schedule_data_with_protection(roster['id'])
+    REQUEST_STATUS.inc(status)
     
-    today_duty = None
-    weeks = []
     error_display = None
+    if not schedule_data:
+        error_display = error_msg or "Не удалось загрузить данные"
+    
+    now = datetime.now().replace(second=0, microsecond=0)
+    etag = make_etag(get_page_key(roster, schedule_data, error_display, now))
     
+    last_modified_ts = int(time.time()) // 60 * 60
     if schedule_data:
-        today_duty = get_today_duty(schedule_data)
-        weeks = get_two_work_weeks(schedule_data)
-    else:
-        error_display = error_msg or "Не удалось загрузить данные"
-        if status == "rate_limit":
-            error_display += f" (повторите через {MIN_REQUEST_INTERVAL} секунд)"
+        last_modified_ts = max(last_modified_ts, int(schedule_data.created_at))
+    last_modified = datetime.fromtimestamp(last_modified_ts, timezone.utc)
     
-    current_time = datetime.now().strftime('%H:%M')
+    if is_not_modified(etag, last_modified):
+        logger.info("Страница не изменилась, ответ 304")
+        return conditional_response('', etag, last_modified)
     
-    logger.info("Рендеринг страницы завершен")
-    return render_template('index.html', 
-                         today_duty=today_duty,
-                         weeks=weeks,
-                         today=date.today(),
-                         current_time=current_time,
-                         last_updated=datetime.now().strftime('%H:%M'),
-                         error=error_display)
+    return conditional_response(get_index_page(roster, schedule_data, error_display, now), etag, last_modified)
 
 @app.route('/refresh')
-def refresh_data():
+@app.route('/roster/<roster_id>/refresh')
+@rate_limited(refresh_limiter)
+def refresh_data(roster_id=None):
     """Принудительное обновление данных"""
+    roster = get_roster_source(roster_id)
     logger.info("Запрос обновления данных")
     
-    # Получаем данные с защитой от частых запросов
-    schedule_data, error_msg, status = get_schedule_data_with_protection()
+    # Запускаем фоновое обновление, ответ отдаем из памяти
+    refresh_started = request_refresh()
+    schedule_data, error_msg, status = get_schedule_data_with_protection(roster['id'])
+    if not refresh_started:
+        status = "rate_limit"
+    REQUEST_STATUS.inc(status)
     
     today_duty_name = "Не назначен"
     if schedule_data:
         today_duty = get_today_duty(schedule_data)
         if today_duty:
-            today_duty_name = today_duty['name']
+            today_duty_name = today_duty.name
     
     current_time = datetime.now().strftime('%H:%M')
     
     response_data = {
         'status': 'success' if schedule_data else 'error',
+        'roster': roster['id'],
         'today_duty': today_duty_name,
         'current_time': current_time,
         'last_updated': datetime.now().strftime('%H:%M')
@@ -447,34 +2580,256 @@ def refresh_data():
     
     if error_msg:
         response_data['error'] = error_msg
-        if status == "rate_limit":
-            response_data['retry_after'] = MIN_REQUEST_INTERVAL
+    if status == "rate_limit":
+        response_data['retry_after'] = upstream_budget.retry_after()
     
     logger.info("Обновление данных завершено")
     return response_data
 
 @app.route('/debug')
-def debug_info():
-    """Страница для отладки - показывает все найденные данные"""
+@app.route('/roster/<roster_id>/debug')
+@rate_limited(http_limiter)
+def debug_info(roster_id=None):
+    """Страница для отладки: состояние кэша и найденные записи постранично.
+    
+    Данные берутся только из кэша, без загрузки из Google Sheets. Параметры:
+    page, per_page, name (часть имени), from и to (ГГГГ-ММ-ДД или ДД.ММ.ГГГГ).
+    """
+    roster = get_roster_source(roster_id)
     logger.info("Запрос страницы отладки")
     
-    schedule_data, error_msg, status = get_schedule_data_with_protection()
+    try:
+        page = max(1, request.args.get('page', default=1, type=int))
+        per_page = min(DEBUG_MAX_PER_PAGE, max(1, request.args.get('per_page', default=DEBUG_PER_PAGE, type=int)))
+        start = parse_query_date(request.args['from']) if 'from' in request.args else None
+        end = parse_query_date(request.args['to']) if 'to' in request.args else None
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    name_filter = request.args.get('name', '').strip().casefold()
+    
+    schedule_data, cache_time, last_error, last_status = get_schedule_cache(roster['id']).state()
+    
+    records = []
+    if schedule_data is not None:
+        if start or end:
+            records = schedule_data.between(start or date.min, end or date.max)
+        else:
+            records = schedule_data.records
+        if name_filter:
+            records = [duty for duty in records if name_filter in duty.name.casefold()]
     today_duty = get_today_duty(schedule_data) if schedule_data else None
-    weeks = get_two_work_weeks(schedule_data) if schedule_data else []
+    offset = (page - 1) * per_page
     
     debug_info = {
+        'roster': roster,
+        'rosters': [source['id'] for source in SCHEDULE_SOURCES],
         'total_records': len(schedule_data) if schedule_data else 0,
-        'today_duty': today_duty,
-        'display_weeks': weeks,
+        'today_duty': duty_to_json(today_duty) if today_duty else None,
+        'records': {
+            'page': page,
+            'per_page': per_page,
+            'pages': math.ceil(len(records) / per_page),
+            'total': len(records),
+            'items': [duty_to_json(duty) for duty in records[offset:offset + per_page]]
+        },
         'today': date.today().strftime('%d.%m.%Y'),
         'last_error': last_error,
-        'cache_status': 'active' if schedule_cache else 'empty',
-        'request_status': status
+        'cache_status': 'active' if schedule_data is not None else 'empty',
+        'cache_version': schedule_data.version if schedule_data is not None else None,
+        'cache_age': round(time.time() - cache_time, 1) if cache_time else None,
+        'last_refresh_status': last_status,
+        'api_calls_saved': {
+            'last_refresh': sheets_session.last_calls_saved,
+            'total': sheets_session.total_calls_saved,
+            'authorizations': sheets_session.authorizations
+        },
+        'shared_cache': shared_store.describe() if shared_store is not None else None,
+        'name_cache': get_name_cache_stats(),
+        'upstream': {
+            'circuit': upstream_breaker.describe(),
+            'quota_limit': sheets_quota.limit,
+            'quota_used': sheets_quota.used(),
+            'quota_remaining': sheets_quota.remaining()
+        },
+        'profiling_enabled': PROFILING_ENABLED
     }
     
     logger.info("Страница отладки сгенерирована")
     return debug_info
 
+@app.route('/events')
+@app.route('/roster/<roster_id>/events')
+@connection_limited(live_limiter)
+def schedule_events(roster_id=None):
+    """Server-Sent Events: изменения расписания для экранов"""
+    roster = get_roster_source(roster_id)
+    start_background_refresher()
+    
+    # При переподключении браузер сам передает последнюю полученную версию
+    since_version = request.headers.get('Last-Event-ID', type=int)
+    if since_version is None:
+        since_version = request.args.get('version', default=0, type=int)
+    
+    response = Response(
+        stream_with_context(schedule_event_stream(roster['id'], since_version)),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/updates')
+@connection_limited(live_limiter)
+def api_updates():
+    """Long-poll для браузеров без SSE: ответ при новой версии или по таймауту"""
+    roster = get_roster_source(request.args.get('roster'))
+    since_version = request.args.get('version', default=0, type=int)
+    start_background_refresher()
+    
+    get_schedule_cache(roster['id']).wait_for_change(since_version, LIVE_UPDATE_TIMEOUT)
+    return build_schedule_update(roster['id'], since_version)
+
+def parse_query_date(value):
+    """Дата из параметра запроса: ГГГГ-ММ-ДД или ДД.ММ.ГГГГ"""
+    for date_format in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Неверный формат даты: '{value}' (ожидается ГГГГ-ММ-ДД или ДД.ММ.ГГГГ)")
+
+def duty_to_json(duty):
+    """Запись о дежурстве в виде, пригодном для JSON"""
+    return {
+        'date': duty.date.isoformat(),
+        'date_str': duty.date_str,
+        'weekday': duty.weekday,
+        'name': duty.name,
+        'cell_location': duty.cell_location
+    }
+
+@app.route('/api/duties')
+@rate_limited(http_limiter)
+def api_duties():
+    """Дежурства за диапазон дат: /api/duties?from=ГГГГ-ММ-ДД&to=ГГГГ-ММ-ДД[&roster=id]"""
+    roster = get_roster_source(request.args.get('roster'))
+    try:
+        start = parse_query_date(request.args['from']) if 'from' in request.args else date.today()
+        end = parse_query_date(request.args['to']) if 'to' in request.args else start
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    
+    if end < start:
+        return {'error': "Дата 'to' раньше даты 'from'"}, 400
+    
+    schedule_data, error_msg, status = get_schedule_data_with_protection(roster['id'])
+    REQUEST_STATUS.inc(status)
+    duties = as_schedule_index(schedule_data).between(start, end) if schedule_data else []
+    
+    response_data = {
+        'roster': roster['id'],
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'count': len(duties),
+        'duties': [duty_to_json(duty) for duty in duties],
+        'request_status': status
+    }
+    if error_msg:
+        response_data['error'] = error_msg
+    
+    return response_data
+
+@app.route('/export.<fmt>')
+@app.route('/roster/<roster_id>/export.<fmt>')
+@rate_limited(http_limiter)
+def export_schedule(fmt, roster_id=None):
+    """Выгрузка всего графика в iCalendar или CSV: потоком, один рендер на версию данных"""
+    if fmt not in EXPORT_GENERATORS:
+        abort(404)
+    roster = get_roster_source(roster_id)
+    
+    schedule_data, error_msg, status = get_schedule_data_with_protection(roster['id'])
+    REQUEST_STATUS.inc(status)
+    if not schedule_data:
+        return {'status': 'error', 'error': error_msg or "Не удалось загрузить данные"}, 503
+    
+    # Версия и время данных одинаковы во всех процессах с общим кэшем
+    etag = make_etag(('export', roster['id'], fmt, schedule_data.version, schedule_data.created_at))
+    last_modified = datetime.fromtimestamp(int(schedule_data.created_at), timezone.utc)
+    if is_not_modified(etag, last_modified):
+        EXPORT_REQUESTS.inc(fmt, 'not_modified')
+        return conditional_response('', etag, last_modified)
+    
+    path = get_export_path(roster['id'], fmt, etag)
+    cached_file = None
+    if path:
+        try:
+            cached_file = open(path, 'rb')
+        except FileNotFoundError:
+            # Файла нет или его только что удалил запрос новой версии - рендерим заново
+            cached_file = None
+    
+    if cached_file is not None:
+        EXPORT_REQUESTS.inc(fmt, 'cached')
+        response = send_file(cached_file, mimetype=EXPORT_MIMETYPES[fmt], conditional=False, etag=False)
+    else:
+        EXPORT_REQUESTS.inc(fmt, 'rendered')
+        chunks = EXPORT_GENERATORS[fmt](roster, schedule_data)
+        body = stream_and_cache(chunks, path) if path else (chunk.encode('utf-8') for chunk in chunks)
+        response = Response(body, mimetype=EXPORT_MIMETYPES[fmt])
+    
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.headers['Content-Disposition'] = f'inline; filename="{roster["id"]}.{fmt}"'
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in (SHEETS_FETCH_SECONDS, PARSE_SECONDS, RENDER_SECONDS,
+                   CACHE_REQUESTS, REQUEST_STATUS, UPSTREAM_FETCHES, UPSTREAM_RETRIES_TOTAL,
+                   EXPORT_REQUESTS, RATE_LIMIT_REJECTIONS):
+        lines.extend(metric.render())
+    
+    # Значения gauge считаются только в момент сбора метрик
+    current_time = time.time()
+    lines.append("# HELP duty_cache_age_seconds Возраст данных в кэше графика")
+    lines.append("# TYPE duty_cache_age_seconds gauge")
+    records = []
+    for roster_id, cache in schedule_caches.items():
+        cached_data, cache_time, _, _ = cache.state()
+        labels = format_labels(('roster',), (roster_id,))
+        if cache_time:
+            lines.append(f"duty_cache_age_seconds{labels} {current_time - cache_time:.3f}")
+        records.append(f"duty_cache_records{labels} {len(cached_data) if cached_data else 0}")
+    lines.append("# HELP duty_cache_records Количество записей о дежурствах в кэше графика")
+    lines.append("# TYPE duty_cache_records gauge")
+    lines.extend(records)
+    
+    name_cache = clean_name.cache_info()
+    lines.append("# HELP duty_name_cache_requests_total Обращения к кэшу очистки имен: hit, miss")
+    lines.append("# TYPE duty_name_cache_requests_total counter")
+    lines.append(f'duty_name_cache_requests_total{{result="hit"}} {name_cache.hits}')
+    lines.append(f'duty_name_cache_requests_total{{result="miss"}} {name_cache.misses}')
+    lines.append("# HELP duty_name_cache_entries Количество ячеек в кэше очистки имен")
+    lines.append("# TYPE duty_name_cache_entries gauge")
+    lines.append(f"duty_name_cache_entries {name_cache.currsize}")
+    
+    lines.append("# HELP duty_sheets_quota_remaining Оставшиеся чтения Google Sheets API в текущей минуте")
+    lines.append("# TYPE duty_sheets_quota_remaining gauge")
+    lines.append(f"duty_sheets_quota_remaining {sheets_quota.remaining()}")
+    lines.append("# HELP duty_upstream_circuit_open Автомат защиты: 0 - замкнут, 1 - разомкнут, 0.5 - пробная попытка")
+    lines.append("# TYPE duty_upstream_circuit_open gauge")
+    circuit_state = upstream_breaker.describe()['state']
+    lines.append(f"duty_upstream_circuit_open {({'closed': 0, 'open': 1}).get(circuit_state, 0.5)}")
+    
+    response = make_response('\n'.join(lines) + '\n')
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
 # =============================================================================
 # ЗАПУСК ПРИЛОЖЕНИЯ
 # =============================================================================
@@ -484,17 +2839,33 @@ def main():
     print("=" * 60)
     print("🚀 Запуск приложения График дежурств")
     print("=" * 60)
-    print(f"📊 Защита от частых запросов: {MIN_REQUEST_INTERVAL} секунд")
-    print(f"📅 Отображение: 2 недели рабочих дней (12 дней)")
-    print(f"🔗 Google Sheet URL: {GOOGLE_SHEET_URL}")
+    print(f"📊 Защита от частых запросов: {MIN_REQUEST_INTERVAL} секунд между обращениями к Google Sheets")
+    print(f"🚦 Лимит клиента: {HTTP_RATE_LIMIT} запросов/с (всплеск до {HTTP_RATE_BURST}), /refresh - {REFRESH_RATE_BURST} подряд")
+    print(f"🖥️  Клиенты различаются по IP (прокси: {TRUSTED_PROXY_HOPS}), токенов экранов: {len(CLIENT_TOKENS)} (/?{CLIENT_TOKEN_PARAM}=<токен>)")
+    print(f"📡 Одновременных SSE/long-poll соединений клиента: до {LIVE_CONNECTIONS_PER_CLIENT}")
+    print(f"🔄 Фоновое обновление данных: каждые {REFRESH_INTERVAL} секунд")
+    print(f"📅 Отображение: {DISPLAY_WEEKS} нед. по дням {', '.join(WEEKDAY_NAMES[day] for day in WORK_DAYS)} ({DISPLAY_WEEKS * len(WORK_DAYS)} дней)")
+    for source in SCHEDULE_SOURCES:
+        route = '/' if source['id'] == DEFAULT_ROSTER else f"/roster/{source['id']}"
+        if source['type'] == 'file':
+            print(f"📄 {source['title']}: файл {source['path']} -> {route}")
+        else:
+            print(f"🔗 {source['title']}: {source['url']} [{source['worksheet']}] -> {route}")
+    print(f"🛡️  Повторы при сбоях Google: {UPSTREAM_RETRIES} (при пустом кэше - до {UPSTREAM_COLD_DEADLINE:g} с), пауза после {BREAKER_THRESHOLD} сбоев подряд, квота: {SHEETS_READ_QUOTA} чтений/мин")
+    print(f"🧵 Параллельная загрузка графиков: до {FETCH_WORKERS} потоков")
     print(f"🔑 Credentials file: {CREDENTIALS_FILE}")
-    print(f"📝 Логи (только ошибки): duty_app.log")
+    print(f"💾 Снимок расписания: {SNAPSHOT_FILE or 'отключен'}")
+    print(f"🗄️  Общий кэш процессов: {SHARED_CACHE_DB or 'отключен'}")
+    print(f"🏭 Production-режим: gunicorn -c gunicorn.conf.py duty_app:app")
+    print(f"🩺 Профилирование запросов (?profile=1): {'включено' if PROFILING_ENABLED else 'выключено'}")
+    print(f"📝 Логи (только ошибки): duty_app.log, уровень консоли: {LOG_LEVEL}, сводный режим: {'да' if LOG_SUMMARY else 'нет'}")
     print("=" * 60)
     
     try:
-        app.run(debug=False, host='0.0.0.0', port=5000)
+        start_background_refresher()
+        app.run(debug=False, host='0.0.0.0', port=PORT)
     except Exception as e:
-        logger.error(f"Критическая ошибка при запуске: {e}")
+        logger.error("Критическая ошибка при запуске: %s", e)
         print(f"❌ Приложение завершилось с ошибкой: {e}")
         input("Нажмите Enter для выхода...")
 
@@ -0,0 +1,157 @@
+"""Локальная замена gspread для офлайн-тестов без доступа к Google Sheets"""
+import threading
+import time
+from datetime import date, timedelta
+
+import gspread
+
+
+class FakeResponse:
+    """Ответ Google API с ошибкой - то, что gspread.exceptions.APIError читает из requests"""
+
+    def __init__(self, status_code, message='', headers=None):
+        self.status_code = status_code
+        self.message = message or f'HTTP {status_code}'
+        self.headers = headers or {}
+        self.text = self.message
+
+    def json(self):
+        return {'error': {'code': self.status_code, 'message': self.message, 'status': 'FAKE'}}
+
+
+def make_api_error(status_code, message='', retry_after=None):
+    """Ошибка API с заданным HTTP-статусом (и заголовком Retry-After)"""
+    headers = {'Retry-After': str(retry_after)} if retry_after is not None else None
+    return gspread.exceptions.APIError(FakeResponse(status_code, message, headers))
+
+
+class FakeWorksheet:
+    """Лист с заранее заданной таблицей, считает обращения к get_all_values"""
+
+    def __init__(self, values, delay=0.0):
+        self.values = values
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.spreadsheet = None
+        self.revision = 1
+        self.get_all_values_calls = 0
+        # Ошибки, которые выбросят следующие вызовы get_all_values
+        self.failures = []
+
+    def fail_next(self, *errors):
+        """Следующие вызовы get_all_values завершатся этими ошибками по очереди"""
+        with self.lock:
+            self.failures.extend(errors)
+
+    def get_all_values(self):
+        with self.lock:
+            self.get_all_values_calls += 1
+            error = self.failures.pop(0) if self.failures else None
+        if error is not None:
+            raise error
+        if self.delay:
+            time.sleep(self.delay)
+        return [list(row) for row in self.values]
+
+    def update_values(self, values):
+        """Имитация правки таблицы: новые значения и новая ревизия"""
+        self.values = values
+        self.revision += 1
+
+
+class FakeSpreadsheet:
+    """Таблица с одним или несколькими листами"""
+
+    def __init__(self, worksheets, spreadsheet_id='fake-spreadsheet'):
+        self.id = spreadsheet_id
+        self.client = None
+        self.worksheets = worksheets
+        self.worksheet_calls = 0
+        for worksheet in worksheets.values():
+            worksheet.spreadsheet = self
+
+    def worksheet(self, title):
+        self.worksheet_calls += 1
+        return self.worksheets[title]
+
+    @property
+    def modified_time(self):
+        revision = sum(worksheet.revision for worksheet in self.worksheets.values())
+        return f"2024-01-01T00:00:{revision:02d}.000Z"
+
+
+class FakeClient:
+    """Клиент, открывающий таблицы по URL"""
+
+    def __init__(self, spreadsheets):
+        self.spreadsheets = spreadsheets
+        self.auth = None
+        self.open_calls = 0
+        self.metadata_calls = 0
+        # Ошибки, которые выбросят следующие запросы метаданных Drive
+        self.metadata_failures = []
+        # Задержка открытия отдельных таблиц: URL -> секунды
+        self.open_delays = {}
+        for spreadsheet in spreadsheets.values():
+            spreadsheet.client = self
+
+    def open_by_url(self, url):
+        self.open_calls += 1
+        if self.open_delays.get(url):
+            time.sleep(self.open_delays[url])
+        return self.spreadsheets[url]
+
+    def _get_file_drive_metadata(self, spreadsheet_id):
+        self.metadata_calls += 1
+        if self.metadata_failures:
+            raise self.metadata_failures.pop(0)
+        for spreadsheet in self.spreadsheets.values():
+            if spreadsheet.id == spreadsheet_id:
+                return {'id': spreadsheet_id, 'modifiedTime': spreadsheet.modified_time}
+        raise KeyError(spreadsheet_id)
+
+
+def install_fake_client(duty_app, worksheet, sheet_url=None, worksheet_name="Вечернее дежурство"):
+    """Подменяет клиент Google Sheets в duty_app на локальный с одним листом"""
+    sheet_url = sheet_url or duty_app.GOOGLE_SHEET_URL
+    client = FakeClient({sheet_url: FakeSpreadsheet({worksheet_name: worksheet})})
+    duty_app.get_google_sheets_client = lambda: client
+    duty_app.sheets_session.reset()
+    return client
+
+
+# Имена для сгенерированных таблиц, часть - с комментариями как в реальном графике
+FIXTURE_NAMES = (
+    'Иванов', 'Петров', 'Сидорова (с 10:00)', 'Кузнецов', 'Смирнова',
+    'Попов (замена)', 'Васильев', 'Новикова с 12:30', 'Морозов', 'Волкова<br>Зайцев',
+)
+
+
+def generate_grid(rows, cols, start=date(2000, 1, 3), filled_ratio=0.8):
+    """Таблица графика: строка дат, строка дежурных, пустая строка-разделитель.
+
+    Правая часть колонок (1 - filled_ratio) остаётся пустой, как в реальном листе.
+    """
+    filled_cols = max(2, int(cols * filled_ratio))
+    grid = []
+    current = start
+    name_idx = 0
+
+    while len(grid) < rows:
+        dates_row = [''] * cols
+        names_row = [''] * cols
+        dates_row[0] = f'Неделя {len(grid) // 3 + 1}'
+        for col in range(1, filled_cols):
+            # Каждая седьмая дата - в коротком формате ДД.ММ
+            if col % 7 == 0:
+                dates_row[col] = current.strftime('%d.%m')
+            else:
+                dates_row[col] = current.strftime('%d.%m.%Y')
+            names_row[col] = FIXTURE_NAMES[name_idx % len(FIXTURE_NAMES)]
+            name_idx += 1
+            current += timedelta(days=1)
+        grid.append(dates_row)
+        grid.append(names_row)
+        grid.append([''] * cols)
+
+    return grid[:rows]
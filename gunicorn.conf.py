@@ -0,0 +1,29 @@
+"""Настройки gunicorn для production-режима: несколько процессов с общим кэшем расписания
+
+Запуск: gunicorn -c gunicorn.conf.py duty_app:app
+"""
+import os
+
+bind = os.getenv('BIND', f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv('WEB_WORKERS', '4'))
+# Потоки нужны для SSE и long-poll: каждое открытое подключение занимает поток
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '16'))
+timeout = 60
+graceful_timeout = 10
+
+# Общий кэш расписания: в Google Sheets ходит один процесс, остальные читают SQLite
+os.environ.setdefault('SHARED_CACHE_DB', 'schedule_cache.sqlite3')
+
+
+def post_worker_init(worker):
+    """Фоновое обновление в каждом процессе; данные загружает только владелец аренды"""
+    import duty_app
+    duty_app.start_background_refresher()
+
+
+def worker_exit(server, worker):
+    """Освобождаем аренду, чтобы обновление сразу подхватил другой процесс"""
+    import duty_app
+    if duty_app.shared_store is not None:
+        duty_app.shared_store.release_lease()
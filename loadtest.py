@@ -0,0 +1,285 @@
+"""Нагрузочный тест маршрутов графика дежурств: N одновременных клиентов, смесь маршрутов
+
+По умолчанию приложение работает в этом же процессе на сгенерированной таблице
+(без доступа к Google Sheets), фоновое обновление и лимиты - настоящие.
+
+Запуск: python loadtest.py --clients 50 --duration 30 --mix "/=80,/refresh=10,/debug=10"
+Задержка ответа Google: python loadtest.py --sheet-delay 0.5 --cold
+Запущенный сервер: python loadtest.py --url http://127.0.0.1:5000 --clients 20
+(лимиты сервер считает по IP: чтобы клиенты считались разными экранами, добавьте
+токены loadtest-screen-0, loadtest-screen-1, ... в CLIENT_TOKENS сервера)
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import date, datetime
+
+os.environ.setdefault('GOOGLE_SHEET_URL', 'https://docs.google.com/spreadsheets/d/offline-loadtest')
+os.environ.setdefault('SNAPSHOT_FILE', '')
+# Предупреждение на каждый отклоненный запрос заглушило бы отчет
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+import duty_app
+from bench import current_commit, percentile, screen_address
+from fake_sheets import FakeWorksheet, generate_grid, install_fake_client
+
+
+# Смесь маршрутов по умолчанию: экраны в основном открывают страницу
+DEFAULT_MIX = '/=80,/refresh=10,/debug=10'
+
+
+# =============================================================================
+# ПОДГОТОВКА
+# =============================================================================
+
+def parse_mix(text):
+    """Смесь маршрутов "путь=вес,путь=вес" -> [(путь, вес)]"""
+    mix = []
+    for item in text.split(','):
+        path, _, weight = item.strip().rpartition('=')
+        if not path.startswith('/'):
+            raise ValueError(f"Некорректный элемент смеси маршрутов: '{item}' (ожидается /путь=вес)")
+        try:
+            weight = float(weight)
+        except ValueError:
+            raise ValueError(f"Некорректный вес маршрута: '{item}'")
+        if weight > 0:
+            mix.append((path, weight))
+    if not mix:
+        raise ValueError("Смесь маршрутов пуста")
+    return mix
+
+
+def prepare_app(rows, cols, sheet_delay=0.0, warm=True):
+    """Приложение на сгенерированной таблице: каждое чтение листа ждет sheet_delay секунд"""
+    today = date.today()
+    grid = generate_grid(rows, cols, start=date(today.year - 1, today.month, 1))
+    worksheet = FakeWorksheet(grid, delay=sheet_delay)
+    install_fake_client(duty_app, worksheet)
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    if warm:
+        duty_app.refresh_all_schedules()
+    return worksheet
+
+
+def in_process_sender():
+    """Отправка запросов через тестовый клиент Flask (свой клиент на каждый поток)"""
+    local = threading.local()
+
+    def send(path, screen):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = duty_app.app.test_client()
+        # Экраны различаются по адресу, как без прокси
+        response = client.get(path, environ_base={'REMOTE_ADDR': screen_address(screen + 1)})
+        body = response.get_json(silent=True) if response.is_json else None
+        return response.status_code, body
+
+    return send
+
+
+def http_sender(base_url, timeout=30):
+    """Отправка запросов на запущенный сервер"""
+    base_url = base_url.rstrip('/')
+
+    def send(path, screen):
+        request = urllib.request.Request(base_url + path, headers={'X-Client-Token': f'loadtest-screen-{screen}'})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                status, content_type, data = response.status, response.headers.get('Content-Type', ''), response.read()
+        except urllib.error.HTTPError as e:
+            status, content_type, data = e.code, e.headers.get('Content-Type', ''), e.read()
+        body = None
+        if content_type.startswith('application/json'):
+            try:
+                body = json.loads(data)
+            except ValueError:
+                pass
+        return status, body
+
+    return send
+
+
+# =============================================================================
+# НАГРУЗКА
+# =============================================================================
+
+def classify(status_code, body):
+    """Итог запроса: ok, rate_limit (429 или исчерпан бюджет обновлений) или error"""
+    if status_code == 429:
+        return 'rate_limit'
+    if status_code >= 500:
+        return 'error'
+    if isinstance(body, dict):
+        if 'retry_after' in body:
+            return 'rate_limit'
+        if body.get('status') == 'error':
+            return 'error'
+    return 'ok'
+
+
+def run_clients(send, mix, clients, duration, screens=None, think=0.0, seed=0):
+    """N клиентов в отдельных потоках в течение duration секунд.
+
+    screens - сколько разных экранов (адресов или токенов) среди клиентов; по умолчанию
+    у каждого клиента свой адрес (или токен), как у отдельного экрана в офисе.
+    Возвращает [(путь, задержка в секундах, итог, HTTP-код)] и фактическую длительность.
+    """
+    paths = [path for path, _ in mix]
+    weights = [weight for _, weight in mix]
+    screens = screens or clients
+    samples = []
+    samples_lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def client_loop(client_idx):
+        rng = random.Random(seed + client_idx)
+        screen = client_idx % screens
+        local_samples = []
+        barrier.wait()
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            path = rng.choices(paths, weights)[0]
+            started = time.perf_counter()
+            try:
+                status_code, body = send(path, screen)
+                outcome = classify(status_code, body)
+            except Exception:
+                status_code, outcome = 0, 'error'
+            local_samples.append((path, time.perf_counter() - started, outcome, status_code))
+            if think:
+                time.sleep(think)
+        with samples_lock:
+            samples.extend(local_samples)
+
+    threads = [threading.Thread(target=client_loop, args=(i,), daemon=True) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples, elapsed):
+    """Пропускная способность, перцентили задержки и доли ответов по маршрутам и в целом"""
+    groups = {}
+    for sample in samples:
+        groups.setdefault(sample[0], []).append(sample)
+    groups['всего'] = samples
+
+    summary = {}
+    for name, group in groups.items():
+        latencies = sorted(latency for _, latency, _, _ in group)
+        outcomes = {}
+        status_codes = {}
+        for _, _, outcome, status_code in group:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            status_codes[str(status_code)] = status_codes.get(str(status_code), 0) + 1
+        count = len(group)
+        summary[name] = {
+            'requests': count,
+            'throughput_rps': count / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'rate_limit_fraction': outcomes.get('rate_limit', 0) / count if count else 0.0,
+            'error_fraction': outcomes.get('error', 0) / count if count else 0.0,
+            'status_codes': dict(sorted(status_codes.items()))
+        }
+    return summary
+
+
+def request_status_counts():
+    """Статусы получения данных маршрутами (cached, loading, rate_limit...) из метрик приложения"""
+    with duty_app.REQUEST_STATUS.lock:
+        return {labels[0]: value for labels, value in duty_app.REQUEST_STATUS.values.items()}
+
+
+def run_load_test(mix, clients, duration, send=None, screens=None, think=0.0, seed=0):
+    """Нагрузочный прогон; без send - приложение в этом процессе"""
+    in_process = send is None
+    if in_process:
+        send = in_process_sender()
+        statuses_before = request_status_counts()
+        fetches_before = sum(cache.fetch_count for cache in duty_app.schedule_caches.values())
+
+    samples, elapsed = run_clients(send, mix, clients, duration, screens, think, seed)
+    report = {'duration_s': elapsed, 'clients': clients, 'routes': summarize(samples, elapsed)}
+
+    if in_process:
+        statuses_after = request_status_counts()
+        report['data_status'] = {
+            status: count - statuses_before.get(status, 0)
+            for status, count in sorted(statuses_after.items())
+            if count != statuses_before.get(status, 0)
+        }
+        report['upstream_fetches'] = sum(cache.fetch_count for cache in duty_app.schedule_caches.values()) - fetches_before
+    return report
+
+
+def print_report(report):
+    print(f"📊 Клиентов: {report['clients']}, длительность: {report['duration_s']:.1f} с")
+    for name, route in report['routes'].items():
+        print(f"   {name:<12} {route['requests']:7d} запр. {route['throughput_rps']:9.0f} запр/с   "
+              f"p50 {route['p50_ms']:7.2f} мс   p95 {route['p95_ms']:7.2f} мс   p99 {route['p99_ms']:7.2f} мс   "
+              f"лимит {route['rate_limit_fraction']:6.1%}   ошибки {route['error_fraction']:6.1%}")
+    if 'data_status' in report:
+        print(f"   статусы данных: {report['data_status']}")
+        print(f"   обновлений из источника: {report['upstream_fetches']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест маршрутов графика дежурств")
+    parser.add_argument('--clients', type=int, default=20, help='одновременных клиентов')
+    parser.add_argument('--duration', type=float, default=10, help='длительность, секунды')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='смесь маршрутов: "/=80,/refresh=10,/debug=10"')
+    parser.add_argument('--screens', type=int, help='разных экранов (адресов или токенов), по умолчанию = клиентов')
+    parser.add_argument('--think', type=float, default=0.0, help='пауза клиента между запросами, секунды')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help='адрес запущенного сервера вместо приложения в этом процессе')
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--cols', type=int, default=50)
+    parser.add_argument('--sheet-delay', type=float, default=0.0, help='задержка чтения фиктивного листа, секунды')
+    parser.add_argument('--cold', action='store_true', help='начать с пустого кэша')
+    parser.add_argument('--output', help='файл для результатов в JSON')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    send = None
+    if args.url:
+        send = http_sender(args.url)
+        print(f"🎯 Сервер: {args.url}")
+    else:
+        prepare_app(args.rows, args.cols, args.sheet_delay, warm=not args.cold)
+        print(f"🎯 Приложение в процессе: таблица {args.rows} × {args.cols}, задержка листа {args.sheet_delay} с")
+    print(f"🔀 Смесь маршрутов: {', '.join(f'{path} - {weight:g}' for path, weight in mix)}")
+
+    report = run_load_test(mix, args.clients, args.duration, send, args.screens, args.think, args.seed)
+    print_report(report)
+
+    if args.output:
+        report.update({
+            'commit': current_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'params': vars(args)
+        })
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты сохранены: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
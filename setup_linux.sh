@@ -153,6 +153,8 @@ compile_app() {
     # Компилируем
     echo "🔨 Компиляция..."
     pyinstaller --onefile \
+        --hidden-import gspread \
+        --hidden-import google.oauth2.service_account \
         --add-data "templates:templates" \
         --add-data "static:static" \
         --add-data ".env:." \
@@ -184,6 +186,19 @@ run_compiled_app() {
     ./dist/duty_schedule
 }
 
+run_production() {
+    echo "🏭 Запуск в production-режиме (gunicorn, несколько процессов)..."
+    
+    if [ ! -x "venv/bin/gunicorn" ]; then
+        echo "❌ gunicorn не установлен в venv"
+        echo "Установите зависимости: pip install -r requirements.txt"
+        return 1
+    fi
+    
+    cd "$APP_DIR"
+    venv/bin/gunicorn -c gunicorn.conf.py duty_app:app
+}
+
 create_systemd_service() {
     echo "🔧 Создание службы systemd..."
     
@@ -193,12 +208,27 @@ create_systemd_service() {
         return 1
     fi
     
-    # Определяем путь к приложению
-    local app_path="$APP_DIR/dist/duty_schedule"
-    if [ ! -f "$app_path" ]; then
-        echo "❌ Скомпилированное приложение не найдено: $app_path"
-        echo "Запустите компиляцию сначала (пункт 3)"
-        return 1
+    echo "Режим службы:"
+    echo "  1. Production: gunicorn, несколько процессов с общим кэшем (рекомендуется)"
+    echo "  2. Скомпилированное приложение (один процесс)"
+    read -p "Выберите режим [1-2]: " service_mode
+    
+    # Определяем команду запуска
+    local app_path
+    if [ "$service_mode" = "2" ]; then
+        app_path="$APP_DIR/dist/duty_schedule"
+        if [ ! -f "$app_path" ]; then
+            echo "❌ Скомпилированное приложение не найдено: $app_path"
+            echo "Запустите компиляцию сначала (пункт 3)"
+            return 1
+        fi
+    else
+        if [ ! -x "$APP_DIR/venv/bin/gunicorn" ]; then
+            echo "❌ gunicorn не найден: $APP_DIR/venv/bin/gunicorn"
+            echo "Установите зависимости сначала (пункт 1)"
+            return 1
+        fi
+        app_path="$APP_DIR/venv/bin/gunicorn -c $APP_DIR/gunicorn.conf.py duty_app:app"
     fi
     
     # Определяем пользователя
@@ -270,11 +300,12 @@ show_menu() {
     echo "3. Компиляция приложения"
     echo "4. Запуск напрямую (без компиляции)"
     echo "5. Запуск скомпилированного приложения"
-    echo "6. Создать службу systemd (требует sudo)"
-    echo "7. Показать статус службы"
-    echo "8. Выход"
+    echo "6. Запуск в production-режиме (gunicorn)"
+    echo "7. Создать службу systemd (требует sudo)"
+    echo "8. Показать статус службы"
+    echo "9. Выход"
     echo
-    read -p "Выберите действие [1-8]: " choice
+    read -p "Выберите действие [1-9]: " choice
 }
 
 full_installation() {
@@ -289,7 +320,8 @@ full_installation() {
     echo "✅ Полная установка завершена!"
     echo "🚀 Теперь вы можете:"
     echo "   - Запустить приложение: ./setup_linux.sh (пункт 5)"
-    echo "   - Или создать службу: sudo ./setup_linux.sh (пункт 6)"
+    echo "   - Запустить в production-режиме: ./setup_linux.sh (пункт 6)"
+    echo "   - Или создать службу: sudo ./setup_linux.sh (пункт 7)"
 }
 
 # =============================================================================
@@ -312,9 +344,10 @@ main() {
             3) compile_app ;;
             4) run_app_directly ;;
             5) run_compiled_app ;;
-            6) create_systemd_service ;;
-            7) show_status ;;
-            8) 
+            6) run_production ;;
+            7) create_systemd_service ;;
+            8) show_status ;;
+            9) 
                 echo
                 echo "👋 До свидания!"
                 exit 0
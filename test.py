@@ -1,8 +1,18 @@
 import gspread
 from google.oauth2.service_account import Credentials
+import csv
+import io
+import json
+import logging
+import logging.handlers
 import os
 import re
-from datetime import datetime
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -116,5 +126,1258 @@ def test_parsing():
         import traceback
         traceback.print_exc()
 
+# =============================================================================
+# ОФЛАЙН-ТЕСТЫ (запуск: python -m pytest test.py)
+# =============================================================================
+
+def load_duty_app():
+    """Импорт приложения с фиктивной конфигурацией"""
+    os.environ.setdefault('GOOGLE_SHEET_URL', 'https://docs.google.com/spreadsheets/d/offline-test')
+    os.environ.setdefault('SNAPSHOT_FILE', os.path.join(tempfile.mkdtemp(), 'schedule_snapshot.json'))
+    os.environ.setdefault('EXPORT_CACHE_DIR', tempfile.mkdtemp())
+    import duty_app
+    # Фоновое обновление в тестах не запускаем - загрузки вызываются явно
+    duty_app.start_background_refresher = lambda: None
+    # Страницы и состояния экранов из предыдущих тестов не должны влиять на текущий
+    duty_app.rendered_pages = duty_app.RenderedPageCache()
+    duty_app.compressed_bodies = duty_app.RenderedPageCache(max_entries=64)
+    with duty_app.live_states_lock:
+        duty_app.live_states.clear()
+    # Все запросы тестового клиента идут с одного адреса - лимиты начинаются заново
+    for limiter in (duty_app.http_limiter, duty_app.refresh_limiter):
+        limiter.buckets.clear()
+    duty_app.live_limiter.active.clear()
+    duty_app.live_limiter.limit = duty_app.LIVE_CONNECTIONS_PER_CLIENT
+    duty_app.upstream_budget.last_fetch_time = 0
+    # Квота чтений за минуту общая для процесса - тесты не должны ее исчерпывать друг для друга
+    duty_app.sheets_quota = duty_app.ReadQuota(duty_app.SHEETS_READ_QUOTA)
+    duty_app.upstream_breaker = duty_app.CircuitBreaker(
+        duty_app.BREAKER_THRESHOLD, duty_app.BREAKER_BASE_COOLDOWN, duty_app.BREAKER_MAX_COOLDOWN
+    )
+    return duty_app
+
+def frozen_datetime(fixed_now):
+    """datetime, у которого now() всегда возвращает fixed_now"""
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return fixed_now if tz is None else fixed_now.astimezone(tz)
+    
+    return FrozenDatetime
+
+def test_concurrent_requests_share_one_fetch():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client
+    
+    today = datetime.now().strftime('%d.%m.%Y')
+    worksheet = FakeWorksheet([[today], ['Иванов']], delay=0.3)
+    install_fake_client(duty_app, worksheet)
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    
+    clients = 40
+    barrier = threading.Barrier(clients)
+    responses = []
+    
+    def load_page(path, screen):
+        client = duty_app.app.test_client()
+        barrier.wait()
+        responses.append((path, client.get(path, environ_base={'REMOTE_ADDR': screen})))
+    
+    paths = ['/', '/refresh', '/api/duties', '/']
+    threads = [
+        threading.Thread(target=load_page, args=(paths[i % len(paths)], f'10.0.0.{i}'))
+        for i in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert worksheet.get_all_values_calls == 1
+    assert duty_app.get_schedule_cache().fetch_count == 1
+    assert len(responses) == clients
+    for path, response in responses:
+        assert response.status_code == 200
+        if path == '/':
+            assert 'Иванов' in response.get_data(as_text=True)
+        else:
+            assert 'Иванов' in str(response.json)
+
+def test_unchanged_sheet_skips_download():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client
+    
+    worksheet = FakeWorksheet([['01.02.2024', '02.02.2024'], ['Иванов', 'Петров']])
+    client = install_fake_client(duty_app, worksheet)
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    
+    assert duty_app.refresh_schedule_cache() == "success"
+    first_data, first_time, _, _ = duty_app.get_schedule_cache().state()
+    
+    # Таблица не менялась: только запрос ревизии, без загрузки и парсинга
+    assert duty_app.refresh_schedule_cache() == "not_modified"
+    data, cache_time, _, _ = duty_app.get_schedule_cache().state()
+    assert worksheet.get_all_values_calls == 1
+    assert client.metadata_calls == 2
+    assert data is first_data
+    assert cache_time >= first_time
+    
+    # После правки лист загружается заново
+    worksheet.update_values([['01.02.2024'], ['Сидоров']])
+    assert duty_app.refresh_schedule_cache() == "success"
+    data, _, _, _ = duty_app.get_schedule_cache().state()
+    assert worksheet.get_all_values_calls == 2
+    assert [duty.name for duty in data] == ['Сидоров']
+
+def test_failed_refresh_keeps_copy_and_refresh_only_wakes_refresher():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client, make_api_error
+    
+    worksheet = FakeWorksheet([['01.02.2024'], ['Иванов']])
+    install_fake_client(duty_app, worksheet)
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    assert duty_app.refresh_all_schedules() == {duty_app.DEFAULT_ROSTER: 'success'}
+    data, cache_time, _, _ = duty_app.get_schedule_cache().state()
+    
+    # Неудачное фоновое обновление: страница продолжает показывать прошлую копию
+    worksheet.update_values([['01.02.2024'], ['Петров']])
+    worksheet.fail_next(make_api_error(400, 'Bad request'))
+    assert duty_app.refresh_all_schedules() == {duty_app.DEFAULT_ROSTER: 'api_error'}
+    cached, _, error, _ = duty_app.get_schedule_cache().state()
+    assert cached is data and error
+    client = duty_app.app.test_client()
+    duties = client.get('/api/duties?from=2024-02-01').get_json()
+    assert [duty['name'] for duty in duties['duties']] == ['Иванов']
+    assert 'Ошибка API' in duties['error']
+    
+    # /refresh не загружает таблицу сам - только будит фоновый поток
+    reads = worksheet.get_all_values_calls
+    duty_app.refresh_event.clear()
+    response = client.get('/refresh')
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'success'
+    assert duty_app.refresh_event.is_set()
+    assert worksheet.get_all_values_calls == reads
+    assert duty_app.get_schedule_cache().state()[0] is data
+    duty_app.refresh_event.clear()
+    
+    # Следующий проход фонового потока подхватывает исправленный лист
+    assert duty_app.refresh_all_schedules() == {duty_app.DEFAULT_ROSTER: 'success'}
+    assert [duty.name for duty in duty_app.get_schedule_cache().state()[0]] == ['Петров']
+
+def test_drive_errors_do_not_disable_revision_check():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client, make_api_error
+    
+    worksheet = FakeWorksheet([['01.02.2024', '02.02.2024'], ['Иванов', 'Петров']])
+    client = install_fake_client(duty_app, worksheet)
+    duty_app.sheets_session.revision_check_disabled = False
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    try:
+        assert duty_app.refresh_schedule_cache() == "success"
+        first = duty_app.get_schedule_cache().state()[0]
+        
+        # Временный сбой Drive: лист загружается целиком, но версия данных та же
+        client.metadata_failures.append(make_api_error(503))
+        assert duty_app.refresh_schedule_cache() == "not_modified"
+        assert worksheet.get_all_values_calls == 2
+        assert duty_app.get_schedule_cache().state()[0] is first
+        assert duty_app.get_schedule_cache().version == first.version
+        
+        # Следующие обновления снова проверяют ревизию
+        assert not duty_app.sheets_session.revision_check_disabled
+        assert duty_app.refresh_schedule_cache() == "not_modified"
+        assert worksheet.get_all_values_calls == 2
+        
+        # Drive API запрещен (403) - проверка отключается насовсем
+        client.metadata_failures.append(make_api_error(403))
+        assert duty_app.refresh_schedule_cache() == "not_modified"
+        assert duty_app.sheets_session.revision_check_disabled
+        assert duty_app.get_schedule_cache().version == first.version
+    finally:
+        duty_app.sheets_session.revision_check_disabled = False
+
+def test_rosters_refresh_concurrently():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeClient, FakeSpreadsheet, FakeWorksheet
+    
+    today = datetime.now().strftime('%d.%m.%Y')
+    evening = FakeWorksheet([[today], ['Иванов']], delay=0.3)
+    weekend = FakeWorksheet([[today], ['Петров']], delay=0.3)
+    client = FakeClient({
+        'https://example.com/evening': FakeSpreadsheet({'Вечер': evening}, 'evening-sheet'),
+        'https://example.com/weekend': FakeSpreadsheet({'Выходные': weekend}, 'weekend-sheet'),
+    })
+    duty_app.get_google_sheets_client = lambda: client
+    duty_app.sheets_session.reset()
+    
+    sources = duty_app.SCHEDULE_SOURCES
+    try:
+        duty_app.SCHEDULE_SOURCES = [
+            {'id': 'evening', 'title': 'Вечер', 'url': 'https://example.com/evening', 'worksheet': 'Вечер'},
+            {'id': 'weekend', 'title': 'Выходные', 'url': 'https://example.com/weekend', 'worksheet': 'Выходные'},
+        ]
+        duty_app.schedule_caches = duty_app.create_schedule_caches()
+        
+        started = datetime.now()
+        statuses = duty_app.refresh_all_schedules()
+        elapsed = (datetime.now() - started).total_seconds()
+        
+        assert statuses == {'evening': 'success', 'weekend': 'success'}
+        # Загрузки идут параллельно: время ближе к одной задержке, чем к сумме
+        assert elapsed < 0.55
+        
+        app_client = duty_app.app.test_client()
+        assert 'Иванов' in app_client.get('/').get_data(as_text=True)
+        assert 'Петров' in app_client.get('/roster/weekend').get_data(as_text=True)
+        assert app_client.get('/roster/unknown').status_code == 404
+    finally:
+        duty_app.SCHEDULE_SOURCES = sources
+        duty_app.schedule_caches = duty_app.create_schedule_caches()
+
+def test_sheets_session_reauthorizes_and_drops_stale_handles():
+    duty_app = load_duty_app()
+    from types import SimpleNamespace
+    from fake_sheets import FakeClient, FakeSpreadsheet, FakeWorksheet, make_api_error
+    
+    worksheet = FakeWorksheet([['01.02.2024'], ['Иванов']])
+    spreadsheet = FakeSpreadsheet({'Вечер': worksheet})
+    clients = []
+    
+    def authorize():
+        clients.append(FakeClient({'https://example.com/evening': spreadsheet}))
+        return clients[-1]
+    
+    duty_app.get_google_sheets_client = authorize
+    session = duty_app.sheets_session
+    session.reset()
+    session.authorizations = 0
+    source = {'id': 'evening', 'url': 'https://example.com/evening', 'worksheet': 'Вечер'}
+    key = (source['url'], source['worksheet'])
+    
+    assert duty_app.fetch_schedule_attempt(source)[2] == 'success'
+    assert session.authorizations == 1
+    
+    # Повторная загрузка переиспользует клиент и открытые объекты
+    worksheet.update_values([['01.02.2024'], ['Петров']])
+    assert duty_app.fetch_schedule_attempt(source, has_cached_data=True)[2] == 'success'
+    assert session.authorizations == 1 and clients[0].open_calls == 1
+    assert session.calls_saved[key] == 3
+    
+    # 401: сессия сбрасывается, загрузка повторяется с новой авторизацией
+    worksheet.update_values([['01.02.2024'], ['Сидоров']])
+    worksheet.fail_next(make_api_error(401, 'Invalid Credentials'))
+    data, _, status = duty_app.fetch_schedule_attempt(source, has_cached_data=True)
+    assert status == 'success' and [duty.name for duty in data] == ['Сидоров']
+    assert session.authorizations == 2 and session.client is clients[1]
+    assert clients[1].open_calls == 1
+    
+    # Истекший токен: новая авторизация до обращения к таблице
+    clients[1].auth = SimpleNamespace(expired=True)
+    assert session.get_worksheet(*key) is worksheet
+    assert session.authorizations == 3 and session.client is clients[2]
+    
+    # Прочие ошибки API: авторизация сохраняется, открытые объекты графика сбрасываются
+    worksheet.update_values([['01.02.2024'], ['Кузнецов']])
+    worksheet.fail_next(make_api_error(400, 'Bad request'))
+    assert duty_app.fetch_schedule_attempt(source, has_cached_data=True)[2] == 'api_error'
+    assert session.client is clients[2] and session.authorizations == 3
+    assert key not in session.worksheets and source['url'] not in session.spreadsheets
+    assert duty_app.fetch_schedule_attempt(source, has_cached_data=True)[2] == 'success'
+    assert clients[2].open_calls == 2
+
+def test_slow_spreadsheet_does_not_block_other_rosters():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeClient, FakeSpreadsheet, FakeWorksheet, make_api_error
+    
+    evening = FakeWorksheet([['01.02.2024'], ['Иванов']])
+    weekend = FakeWorksheet([['01.02.2024'], ['Петров']])
+    client = FakeClient({
+        'https://example.com/evening': FakeSpreadsheet({'Вечер': evening}, 'evening-sheet'),
+        'https://example.com/weekend': FakeSpreadsheet({'Выходные': weekend}, 'weekend-sheet'),
+    })
+    duty_app.get_google_sheets_client = lambda: client
+    session = duty_app.sheets_session
+    session.reset()
+    
+    weekend_source = {'id': 'weekend', 'url': 'https://example.com/weekend', 'worksheet': 'Выходные'}
+    evening_source = {'id': 'evening', 'url': 'https://example.com/evening', 'worksheet': 'Вечер'}
+    assert session.get_worksheet(weekend_source['url'], weekend_source['worksheet']) is weekend
+    
+    # Медленное открытие одной таблицы не держит общий замок сессии
+    client.open_delays['https://example.com/evening'] = 0.5
+    slow_open = threading.Thread(target=session.get_worksheet, args=(evening_source['url'], evening_source['worksheet']))
+    slow_open.start()
+    time.sleep(0.05)
+    started = time.perf_counter()
+    assert session.get_worksheet(weekend_source['url'], weekend_source['worksheet']) is weekend
+    assert time.perf_counter() - started < 0.2
+    slow_open.join()
+    client.open_delays.clear()
+    assert client.open_calls == 2
+    
+    # Сбой листа одного графика сбрасывает только его объекты
+    evening.fail_next(make_api_error(400, 'Bad request'))
+    status = duty_app.fetch_schedule_attempt(evening_source)[2]
+    assert status == 'api_error'
+    assert ('https://example.com/weekend', 'Выходные') in session.worksheets
+    assert ('https://example.com/evening', 'Вечер') not in session.worksheets
+    
+    assert duty_app.fetch_schedule_attempt(weekend_source)[2] == 'success'
+    assert duty_app.fetch_schedule_attempt(evening_source)[2] == 'success'
+    # Заново открыта только таблица упавшего графика
+    assert client.open_calls == 3
+
+def test_refresh_spam_is_limited_per_client():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client
+    
+    install_fake_client(duty_app, FakeWorksheet([['01.02.2024'], ['Иванов']]))
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    client = duty_app.app.test_client()
+    
+    spammer = {'REMOTE_ADDR': '10.0.0.66'}
+    spam = [client.get('/refresh', environ_base=spammer).status_code for _ in range(10)]
+    assert spam.count(200) == 3
+    assert spam.count(429) == 7
+    
+    # Новый токен в каждом запросе не обходит лимит - неизвестные токены не учитываются
+    assert all(
+        client.get('/refresh', environ_base=spammer, headers={'X-Client-Token': f'fake-{i}'}).status_code == 429
+        for i in range(5)
+    )
+    
+    # Лимит одного клиента не влияет на остальные экраны
+    assert client.get('/refresh', environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code == 200
+    assert all(
+        client.get('/', environ_base={'REMOTE_ADDR': f'10.0.1.{i}'}).status_code == 200
+        for i in range(50)
+    )
+    
+    # Экран за прокси с токеном из CLIENT_TOKENS получает собственный лимит
+    tokens = duty_app.CLIENT_TOKENS
+    try:
+        duty_app.CLIENT_TOKENS = frozenset({'hall-screen'})
+        assert client.get('/refresh', environ_base=spammer, headers={'X-Client-Token': 'hall-screen'}).status_code == 200
+    finally:
+        duty_app.CLIENT_TOKENS = tokens
+    
+    # Экран, превысивший лимит страниц, получает обычную страницу, а не JSON
+    duty_app.refresh_schedule_cache()
+    pages = [client.get('/', environ_base=spammer) for _ in range(duty_app.HTTP_RATE_BURST + 1)]
+    limited = pages[-1]
+    assert limited.status_code == 429
+    assert limited.mimetype == 'text/html'
+    assert int(limited.headers['Retry-After']) >= 1
+    assert limited.get_data(as_text=True) == pages[0].get_data(as_text=True)
+
+def test_screen_token_cookie_and_live_connection_cap():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client
+    
+    install_fake_client(duty_app, FakeWorksheet([['01.02.2024'], ['Иванов']]))
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    duty_app.refresh_schedule_cache()
+    office = {'REMOTE_ADDR': '10.0.0.77'}
+    
+    tokens = duty_app.CLIENT_TOKENS
+    try:
+        duty_app.CLIENT_TOKENS = frozenset({'hall-screen'})
+        
+        # Неизвестный токен в адресе не запоминается
+        stranger = duty_app.app.test_client()
+        assert 'Set-Cookie' not in stranger.get('/?screen=fake', environ_base=office).headers
+        
+        # Экран открывают один раз с ?screen=, дальше токен приходит в cookie
+        screen = duty_app.app.test_client()
+        first = screen.get('/?screen=hall-screen', environ_base=office)
+        assert first.status_code == 200
+        assert 'screen_token=hall-screen' in first.headers['Set-Cookie']
+        assert 'HttpOnly' in first.headers['Set-Cookie']
+        
+        # Остальные экраны за тем же NAT исчерпали лимит адреса - экран с токеном не затронут
+        while stranger.get('/', environ_base=office).status_code != 429:
+            pass
+        assert screen.get('/', environ_base=office).status_code == 200
+        assert screen.get('/api/duties?from=2024-02-01', environ_base=office).status_code == 200
+    finally:
+        duty_app.CLIENT_TOKENS = tokens
+    
+    # Долгие соединения: не больше LIVE_CONNECTIONS_PER_CLIENT на клиента
+    # Декоратор маршрутов держит сам объект лимита - меняем его настройку
+    timeout = duty_app.LIVE_UPDATE_TIMEOUT
+    duty_app.live_limiter.limit = 2
+    duty_app.LIVE_UPDATE_TIMEOUT = 0.1
+    try:
+        client = duty_app.app.test_client()
+        streams = [client.get('/events', environ_base=office, buffered=False) for _ in range(2)]
+        assert [stream.status_code for stream in streams] == [200, 200]
+        
+        rejected = client.get('/events', environ_base=office, buffered=False)
+        assert rejected.status_code == 429
+        assert rejected.headers['Retry-After'] == '1'
+        assert client.get('/api/updates', environ_base=office).status_code == 429
+        # Другой адрес не затронут
+        other = client.get('/events', environ_base={'REMOTE_ADDR': '10.0.0.78'}, buffered=False)
+        assert other.status_code == 200
+        other.close()
+        
+        # Закрытое соединение освобождает место
+        streams.pop().close()
+        assert client.get('/api/updates?version=0', environ_base=office).get_json()['full'] is True
+        for stream in streams:
+            stream.close()
+        assert duty_app.live_limiter.active == {}
+    finally:
+        duty_app.LIVE_UPDATE_TIMEOUT = timeout
+        duty_app.live_limiter.limit = duty_app.LIVE_CONNECTIONS_PER_CLIENT
+
+def test_shared_cache_refreshed_by_one_worker():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client
+    
+    worksheet = FakeWorksheet([['01.02.2024', '02.02.2024'], ['Иванов', 'Петров']])
+    install_fake_client(duty_app, worksheet)
+    path = os.path.join(tempfile.mkdtemp(), 'schedule_cache.sqlite3')
+    
+    try:
+        # Первый процесс получает аренду и загружает таблицу
+        duty_app.shared_store = duty_app.SharedScheduleStore(path, worker_id='worker-1')
+        duty_app.schedule_caches = duty_app.create_schedule_caches()
+        assert duty_app.refresh_schedule_cache() == "success"
+        first = duty_app.get_schedule_cache().state()[0]
+        
+        # Второй процесс берет данные из общего кэша, не обращаясь к Google Sheets
+        duty_app.shared_store = duty_app.SharedScheduleStore(path, worker_id='worker-2')
+        duty_app.schedule_caches = duty_app.create_schedule_caches()
+        assert duty_app.refresh_schedule_cache() == "shared"
+        second = duty_app.get_schedule_cache().state()[0]
+        assert worksheet.get_all_values_calls == 1
+        assert not duty_app.shared_store.acquire_lease()
+        assert second.version == first.version
+        assert second.created_at == first.created_at
+        assert [duty.name for duty in second] == ['Иванов', 'Петров']
+        
+        # Повторная сверка без изменений не перечитывает записи
+        assert duty_app.refresh_schedule_cache() == "shared_unchanged"
+        assert duty_app.get_schedule_cache().state()[0] is second
+    finally:
+        duty_app.shared_store = None
+        duty_app.schedule_caches = duty_app.create_schedule_caches()
+
+def test_parse_logs_one_summary_line():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, generate_grid
+    
+    # Запросы не пишут в консоль и файл сами - только кладут записи в очередь
+    root = logging.getLogger()
+    assert any(isinstance(handler, logging.handlers.QueueHandler) for handler in root.handlers)
+    
+    records = []
+    capture = logging.Handler()
+    capture.emit = records.append
+    level = root.level
+    root.addHandler(capture)
+    root.setLevel(logging.INFO)
+    try:
+        schedule = duty_app.parse_schedule_data(FakeWorksheet(generate_grid(30, 10)))
+    finally:
+        root.removeHandler(capture)
+        root.setLevel(level)
+    
+    found = [record.getMessage() for record in records if 'Найдено записей' in record.getMessage()]
+    assert len(schedule) > 50
+    assert len(found) == 1
+    assert f"Найдено записей о дежурствах: {len(schedule)}, даты с" in found[0]
+    assert len(records) < 5
+
+def test_schedule_records_are_compact_and_shared():
+    duty_app = load_duty_app()
+    
+    # Фиксированная дата в середине года: ДД.ММ получает текущий год, и в конце
+    # декабря понедельник следующей недели оказался бы в январе того же года
+    today = date(2024, 6, 5)
+    day = date(2024, 6, 10)
+    grid = [
+        [day.strftime('%d.%m.%Y'), day.strftime('%d.%m'), '1.1.2024'],
+        ['Иванов', 'Иванов (замена)', 'Петров'],
+    ]
+    duty_app.datetime = frozen_datetime(datetime(2024, 6, 5, 12, 0))
+    try:
+        schedule = duty_app.as_schedule_index(duty_app.parse_schedule_grid(grid))
+    finally:
+        duty_app.datetime = datetime
+    records = {duty.cell_location: duty for duty in schedule.records}
+    first, second = records['A1'], records['B1']
+    
+    # Производные поля вычисляются, исходный текст хранится только для нестандартной даты
+    assert first.source_date is None
+    assert first.date_str == day.strftime('%d.%m.%Y')
+    assert second.date_str == day.strftime('%d.%m')
+    assert schedule.get(date(2024, 1, 1)).date_str == '1.1.2024'
+    assert second.date == day
+    assert first.weekday == 'ПН'
+    # Одинаковые имена - один объект строки
+    assert first.name is second.name
+    assert first.raw_name is first.name
+    
+    # Экран недель ссылается на те же записи, без копий
+    cells = [duty for week in duty_app.get_display_weeks(schedule, today) for duty in week]
+    assert any(duty is schedule.get(day) for duty in cells)
+    assert all(duty.name == '' for duty in cells if duty.date != day)
+    
+    # Снимок и общий кэш восстанавливают записи без потерь
+    assert duty_app.schedule_from_rows(duty_app.schedule_to_rows(schedule)) == schedule.records
+
+def run_app_process(script, **env):
+    """Скрипт в новом процессе Python (чистый импорт duty_app); результат - JSON последней строки вывода"""
+    env = dict(os.environ, LOG_LEVEL='ERROR', SHARED_CACHE_DB='', **env)
+    result = subprocess.run(
+        [sys.executable, '-c', script],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+# Перезапуск приложения: новый процесс с тем же файлом снимка и листом, который
+# запоминает обращения. Результат - последней строкой вывода
+SNAPSHOT_RESTART_SCRIPT = """
+import json
+from datetime import datetime
+
+import duty_app
+from fake_sheets import FakeWorksheet, install_fake_client
+
+worksheet = FakeWorksheet([[datetime.now().strftime('%d.%m.%Y')], ['Петров']])
+client = install_fake_client(duty_app, worksheet)
+duty_app.background_refresher = lambda: None
+response = duty_app.app.test_client().get('/')
+print(json.dumps({
+    'status': response.status_code,
+    'page': response.get_data(as_text=True),
+    'cache_status': duty_app.get_schedule_cache().last_status,
+    'open_calls': client.open_calls,
+    'reads': worksheet.get_all_values_calls
+}))
+"""
+
+# Импорт приложения и обращения к клиенту Google по шагам. Ленивый модуль лежит
+# в sys.modules с первого шага, загруженный - снова обычный ModuleType
+LAZY_IMPORT_SCRIPT = """
+import json
+import sys
+import tempfile
+import types
+
+def loaded():
+    return {name: type(sys.modules[name]) is types.ModuleType for name in ('gspread', 'google.oauth2.service_account')}
+
+import duty_app
+authorize = duty_app.get_google_sheets_client
+steps = {'import': loaded()}
+
+duty_app.app.test_client().get('/metrics')
+steps['metrics'] = loaded()
+
+# fake_sheets сам импортирует gspread, поэтому здесь минимальная замена клиента
+class Worksheet:
+    reads = 0
+    def get_all_values(self):
+        self.reads += 1
+        if self.reads == 1:
+            raise ValueError('broken cell')
+        return [['01.02.2024'], ['Иванов']]
+
+class Spreadsheet:
+    id = 'offline'
+    def worksheet(self, title):
+        return worksheet
+
+class Client:
+    auth = None
+    def open_by_url(self, url):
+        return spreadsheet
+    def _get_file_drive_metadata(self, spreadsheet_id):
+        return {'modifiedTime': '2024-01-01T00:00:00.000Z'}
+
+worksheet, spreadsheet, client = Worksheet(), Spreadsheet(), Client()
+worksheet.spreadsheet, spreadsheet.client = spreadsheet, client
+duty_app.get_google_sheets_client = lambda: client
+duty_app.sheets_session.reset()
+
+# Первое обновление с ошибкой: она проверяется по исключениям gspread
+steps['statuses'] = [duty_app.refresh_schedule_cache()]
+steps['failed_fetch'] = loaded()
+steps['statuses'].append(duty_app.refresh_schedule_cache())
+
+# Авторизация (с негодным файлом ключа) загружает google.oauth2.service_account
+with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+    f.write('{}')
+duty_app.CREDENTIALS_FILE = f.name
+steps['client'] = authorize()
+steps['authorize'] = loaded()
+print(json.dumps(steps))
+"""
+
+def test_google_modules_load_on_first_use():
+    # Настройки окружения те же, что у остальных тестов
+    load_duty_app()
+    steps = run_app_process(LAZY_IMPORT_SCRIPT, SNAPSHOT_FILE='')
+    
+    # Запуск приложения и метрики не выполняют импорт gspread и google-auth
+    for step in ('import', 'metrics'):
+        assert steps[step] == {'gspread': False, 'google.oauth2.service_account': False}, step
+    
+    # Первое обращение к модулю загружает его
+    assert steps['statuses'] == ['error', 'success']
+    assert steps['failed_fetch']['gspread'] is True
+    assert steps['client'] is None
+    assert steps['authorize']['google.oauth2.service_account'] is True
+
+def test_snapshot_warm_start_and_invalid_snapshots(caplog):
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client
+    
+    today = datetime.now().strftime('%d.%m.%Y')
+    install_fake_client(duty_app, FakeWorksheet([[today], ['Иванов']]))
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    assert duty_app.refresh_schedule_cache() == 'success'
+    snapshot_file = duty_app.get_snapshot_path()
+    assert os.path.exists(snapshot_file)
+    
+    # После перезапуска страница отдается из снимка до первого обращения к таблице
+    restarted = run_app_process(SNAPSHOT_RESTART_SCRIPT, SNAPSHOT_FILE=snapshot_file)
+    assert restarted['status'] == 200
+    assert 'Иванов' in restarted['page'] and 'Петров' not in restarted['page']
+    assert restarted['cache_status'] == 'snapshot'
+    assert restarted['open_calls'] == 0 and restarted['reads'] == 0
+    
+    # Поврежденный снимок или снимок старого формата пропускается с предупреждением
+    invalid_snapshots = [
+        '{"format": 2, "records": [[7389',
+        json.dumps({'format': 1, 'saved_at': time.time(), 'records': [[738917, 'Иванов', today, 'Иванов', 'B2']]}),
+        json.dumps({'format': 2, 'records': []}),
+        json.dumps([[738917, 'Иванов']]),
+    ]
+    for content in invalid_snapshots:
+        with open(snapshot_file, 'w', encoding='utf-8') as f:
+            f.write(content)
+        duty_app.schedule_caches = duty_app.create_schedule_caches()
+        caplog.clear()
+        with caplog.at_level(logging.WARNING):
+            assert duty_app.load_schedule_snapshot() is False
+        assert any('сним' in record.getMessage() for record in caplog.records if record.levelno == logging.WARNING)
+        assert duty_app.get_schedule_cache().data is None
+
+def test_api_duties_range_queries():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client
+    
+    # 02.02.2024 встречается в таблице дважды: ниже - исправленная копия
+    install_fake_client(duty_app, FakeWorksheet([
+        ['01.02.2024', '02.02.2024', '03.02.2024'],
+        ['Иванов', 'Петров', 'Сидоров'],
+        [''],
+        ['02.02.2024'],
+        ['Кузнецов'],
+    ]))
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    duty_app.refresh_schedule_cache()
+    client = duty_app.app.test_client()
+    
+    def names(query):
+        response = client.get(f'/api/duties?{query}')
+        assert response.status_code == 200
+        return [duty['name'] for duty in response.get_json()['duties']]
+    
+    # Границы включительно, оба формата дат
+    assert names('from=2024-02-01&to=2024-02-02') == ['Иванов', 'Петров', 'Кузнецов']
+    assert names('from=01.02.2024&to=03.02.2024') == ['Иванов', 'Петров', 'Кузнецов', 'Сидоров']
+    assert names('from=2024-02-03') == ['Сидоров']
+    assert names('from=2024-02-04&to=2024-03-01') == []
+    
+    duties = client.get('/api/duties?from=2024-02-02&to=02.02.2024').get_json()
+    assert duties['from'] == duties['to'] == '2024-02-02'
+    assert duties['count'] == 2
+    assert [duty['cell_location'] for duty in duties['duties']] == ['B1', 'A4']
+    
+    # При повторе даты дежурным дня считается запись выше в таблице - и для дежурного
+    # на сегодня, и для сетки недель (раньше в сетке побеждала запись ниже)
+    schedule = duty_app.get_schedule_cache().state()[0]
+    assert schedule.get(date(2024, 2, 2)).name == 'Петров'
+    cells = {duty.date: duty.name for week in duty_app.get_display_weeks(schedule, date(2024, 2, 2)) for duty in week}
+    assert cells[date(2024, 2, 2)] == 'Петров'
+    
+    for query in ('from=2024-13-01', 'from=2024-02-01&to=завтра', 'from=2024-02-03&to=2024-02-01'):
+        response = client.get(f'/api/duties?{query}')
+        assert response.status_code == 400
+        assert response.get_json()['error']
+
+def test_week_view_is_memoized_per_day_and_horizon():
+    duty_app = load_duty_app()
+    from fake_sheets import generate_grid
+    
+    monday = date(2024, 1, 1)
+    schedule = duty_app.as_schedule_index(duty_app.parse_schedule_grid(generate_grid(30, 10, start=monday)))
+    weeks = duty_app.get_display_weeks(schedule, monday)
+    assert [len(week) for week in weeks] == [6, 6]
+    assert weeks[0][0].date == monday and weeks[1][-1].date == date(2024, 1, 13)
+    # Тот же день и версия - тот же объект без пересчета
+    assert duty_app.get_display_weeks(schedule, monday) is weeks
+    # В воскресенье экран начинается со следующей недели
+    assert duty_app.get_display_weeks(schedule, date(2024, 1, 7))[0][0].date == date(2024, 1, 8)
+    
+    display_weeks, work_days = duty_app.DISPLAY_WEEKS, duty_app.WORK_DAYS
+    try:
+        # Настенный экран: месяц, только будни
+        duty_app.DISPLAY_WEEKS, duty_app.WORK_DAYS = 4, (0, 1, 2, 3, 4)
+        month = duty_app.get_display_weeks(schedule, monday)
+        assert [len(week) for week in month] == [5, 5, 5, 5]
+        assert {duty.weekday for week in month for duty in week} == {'ПН', 'ВТ', 'СР', 'ЧТ', 'ПТ'}
+        assert duty_app.get_display_weeks(schedule, monday) is month
+    finally:
+        duty_app.DISPLAY_WEEKS, duty_app.WORK_DAYS = display_weeks, work_days
+
+def test_index_etag_revalidates_until_data_changes():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client
+    
+    # ETag страницы зависит от минуты на часах - фиксируем время на весь тест
+    fixed_now = datetime.now().replace(second=30, microsecond=0)
+    today = fixed_now.strftime('%d.%m.%Y')
+    worksheet = FakeWorksheet([[today], ['Иванов']])
+    install_fake_client(duty_app, worksheet)
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    duty_app.refresh_schedule_cache()
+    client = duty_app.app.test_client()
+    pages = duty_app.rendered_pages
+    
+    duty_app.datetime = frozen_datetime(fixed_now)
+    try:
+        first = client.get('/')
+        etag = first.headers['ETag'].strip('"')
+        assert first.status_code == 200 and 'Иванов' in first.get_data(as_text=True)
+        assert pages.misses == 1
+        
+        # Актуальная копия у клиента - 304 без тела и без рендера
+        for _ in range(2):
+            revalidated = client.get('/', headers={'If-None-Match': f'"{etag}"'})
+            assert revalidated.status_code == 304
+            assert revalidated.get_data() == b''
+            assert revalidated.headers['ETag'].strip('"') == etag
+        assert (pages.hits, pages.misses) == (0, 1)
+        
+        # Без условного заголовка - та же страница из кэша отрисованных
+        assert client.get('/').get_data(as_text=True) == first.get_data(as_text=True)
+        assert pages.hits == 1
+        
+        # Новая версия данных - новая страница и новый ETag
+        worksheet.update_values([[today], ['Петров']])
+        assert duty_app.refresh_schedule_cache() == 'success'
+        changed = client.get('/', headers={'If-None-Match': f'"{etag}"'})
+        new_etag = changed.headers['ETag'].strip('"')
+        assert changed.status_code == 200
+        assert new_etag != etag
+        assert 'Петров' in changed.get_data(as_text=True)
+        assert pages.misses == 2
+        assert client.get('/', headers={'If-None-Match': f'"{new_etag}"'}).status_code == 304
+    finally:
+        duty_app.datetime = datetime
+
+def test_live_updates_send_changed_cells_only():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client
+    
+    days = [date.today() + timedelta(days=offset) for offset in range(3)]
+    dates_row = [day.strftime('%d.%m.%Y') for day in days]
+    worksheet = FakeWorksheet([dates_row, ['Иванов', 'Петров', 'Сидоров']])
+    install_fake_client(duty_app, worksheet)
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    duty_app.refresh_schedule_cache()
+    first_version = duty_app.get_schedule_cache().version
+    client = duty_app.app.test_client()
+    
+    def read_event(events):
+        chunk = next(events)
+        chunk = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+        if chunk.startswith(':'):
+            return None
+        data = [line for line in chunk.splitlines() if line.startswith('data: ')][0]
+        return json.loads(data[len('data: '):])
+    
+    def filled(cells):
+        return {day: name for day, name in cells.items() if name}
+    
+    expected = {day.isoformat(): name for day, name in zip(days, ['Иванов', 'Петров', 'Сидоров'])}
+    timeout, work_days = duty_app.LIVE_UPDATE_TIMEOUT, duty_app.WORK_DAYS
+    # Все дни недели на экране - тест не зависит от дня запуска
+    duty_app.LIVE_UPDATE_TIMEOUT, duty_app.WORK_DAYS = 0.2, tuple(range(7))
+    try:
+        response = client.get('/events', buffered=False)
+        assert response.mimetype == 'text/event-stream'
+        events = iter(response.response)
+        
+        # При подключении - все ячейки экрана
+        update = read_event(events)
+        assert update['full'] is True and update['changed'] is True
+        assert update['version'] == first_version
+        assert update['today_duty'] == 'Иванов'
+        assert filled(update['cells']) == expected
+        assert len(update['cells']) == 7 * duty_app.DISPLAY_WEEKS
+        
+        # Новая версия данных - только изменившиеся ячейки
+        worksheet.update_values([dates_row, ['Иванов', 'Кузнецов', 'Сидоров']])
+        duty_app.refresh_schedule_cache()
+        update = read_event(events)
+        assert update['full'] is False
+        assert update['version'] == first_version + 1
+        assert update['cells'] == {days[1].isoformat(): 'Кузнецов'}
+        
+        # Без изменений - только keep-alive
+        assert read_event(events) is None
+        response.close()
+        
+        # Long-poll по таймауту: изменений нет
+        current = duty_app.get_schedule_cache().version
+        update = client.get(f'/api/updates?version={current}').get_json()
+        assert update['changed'] is False and update['full'] is False
+        assert update['cells'] == {}
+        
+        # Устаревшая или неизвестная версия клиента - снова полный набор ячеек
+        with duty_app.live_states_lock:
+            duty_app.live_states.clear()
+        for version in (first_version, 999):
+            update = client.get(f'/api/updates?version={version}').get_json()
+            assert update['changed'] is True and update['full'] is True
+            assert update['version'] == current
+            assert filled(update['cells']) == dict(expected, **{days[1].isoformat(): 'Кузнецов'})
+    finally:
+        duty_app.LIVE_UPDATE_TIMEOUT, duty_app.WORK_DAYS = timeout, work_days
+
+def test_export_rendered_once_per_version():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, generate_grid, install_fake_client
+    
+    worksheet = FakeWorksheet(generate_grid(300, 20))
+    install_fake_client(duty_app, worksheet)
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    duty_app.refresh_schedule_cache()
+    schedule = duty_app.get_schedule_cache().state()[0]
+    client = duty_app.app.test_client()
+    
+    def export_count(fmt, result):
+        return duty_app.EXPORT_REQUESTS.values.get((fmt, result), 0)
+    
+    rendered = export_count('ics', 'rendered')
+    first = client.get('/export.ics')
+    body = first.get_data(as_text=True)
+    assert first.status_code == 200
+    assert first.mimetype == 'text/calendar'
+    assert body.startswith('BEGIN:VCALENDAR\r\n') and body.endswith('END:VCALENDAR\r\n')
+    assert body.count('BEGIN:VEVENT') == len(schedule)
+    assert all(len(line.encode('utf-8')) <= 75 for line in body.split('\r\n'))
+    
+    # Остальные клиенты получают готовый файл или 304 - без повторного рендера
+    second = client.get('/export.ics')
+    assert second.get_data(as_text=True) == body
+    assert client.get('/export.ics', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    assert export_count('ics', 'rendered') == rendered + 1
+    
+    # Файл удален между запросами (например, выгрузкой новой версии) - рендер вместо 500
+    cached = export_count('ics', 'cached')
+    for name in os.listdir(duty_app.EXPORT_CACHE_DIR):
+        if name.endswith('.ics'):
+            os.remove(os.path.join(duty_app.EXPORT_CACHE_DIR, name))
+    again = client.get('/export.ics')
+    assert again.status_code == 200 and again.get_data(as_text=True) == body
+    assert export_count('ics', 'rendered') == rendered + 2
+    assert export_count('ics', 'cached') == cached
+    
+    csv_response = client.get('/export.csv')
+    rows = list(csv.reader(io.StringIO(csv_response.get_data(as_text=True).lstrip('\ufeff'))))
+    assert rows[0] == ['date', 'weekday', 'name', 'raw_name', 'date_str', 'cell_location']
+    assert len(rows) == len(schedule) + 1
+    
+    # Новая версия данных - новый ETag
+    worksheet.update_values([['01.02.2024'], ['Сидоров']])
+    duty_app.refresh_schedule_cache()
+    third = client.get('/export.ics', headers={'If-None-Match': first.headers['ETag']})
+    assert third.status_code == 200
+    assert third.get_data(as_text=True).count('BEGIN:VEVENT') == 1
+    assert len([name for name in os.listdir(duty_app.EXPORT_CACHE_DIR) if name.endswith('.ics')]) == 1
+    assert client.get('/export.pdf').status_code == 404
+
+def test_ics_export_escapes_multiline_cells():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client
+    
+    assert duty_app.ics_escape('a\r\nb\rc\nd') == 'a\\nb\\nc\\nd'
+    
+    # Ячейка с переносами строк из Google Sheets (Windows- и старый Mac-формат)
+    install_fake_client(duty_app, FakeWorksheet([
+        ['01.02.2024', '02.02.2024'],
+        ['Иванов\r\n(с 10:00)', 'Петров\rСидоров']
+    ]))
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    duty_app.refresh_schedule_cache()
+    
+    body = duty_app.app.test_client().get('/export.ics').get_data(as_text=True)
+    assert body.count('BEGIN:VEVENT') == 2
+    assert body.endswith('\r\n')
+    lines = body[:-2].split('\r\n')
+    # Каждая строка календаря завершается CRLF, одиночных CR и LF внутри строк нет
+    assert not any('\r' in line or '\n' in line for line in lines)
+    assert any(line.startswith('DESCRIPTION:') and '\\n' in line for line in lines)
+
+def test_upstream_failures_retried_then_circuit_opens():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client, make_api_error
+    
+    worksheet = FakeWorksheet([['01.02.2024'], ['Иванов']])
+    install_fake_client(duty_app, worksheet)
+    backoff_base, refresh_interval = duty_app.UPSTREAM_BACKOFF_BASE, duty_app.REFRESH_INTERVAL
+    try:
+        duty_app.UPSTREAM_BACKOFF_BASE = 0
+        duty_app.REFRESH_INTERVAL = 5
+        duty_app.upstream_breaker = duty_app.CircuitBreaker(threshold=2, base_cooldown=60, max_cooldown=600)
+        duty_app.sheets_quota = duty_app.ReadQuota(limit=60)
+        duty_app.schedule_caches = duty_app.create_schedule_caches()
+        
+        # Разовый 503 скрыт повтором
+        retries = duty_app.UPSTREAM_RETRIES_TOTAL.values.get((), 0)
+        worksheet.fail_next(make_api_error(503))
+        assert duty_app.refresh_schedule_cache() == "success"
+        assert worksheet.get_all_values_calls == 2
+        assert duty_app.UPSTREAM_RETRIES_TOTAL.values[()] == retries + 1
+        
+        # Сбои подряд размыкают цепь, экраны получают устаревшую копию
+        worksheet.update_values([['01.02.2024'], ['Петров']])
+        attempts = duty_app.UPSTREAM_RETRIES + 1
+        for _ in range(2):
+            worksheet.fail_next(*[make_api_error(503) for _ in range(attempts)])
+            assert duty_app.refresh_schedule_cache() == "api_error"
+        assert duty_app.upstream_breaker.describe()['state'] == 'open'
+        calls = worksheet.get_all_values_calls
+        assert duty_app.refresh_schedule_cache() == "circuit_open"
+        assert worksheet.get_all_values_calls == calls
+        assert duty_app.get_refresh_delay() >= 30
+        duties = duty_app.app.test_client().get('/api/duties?from=2024-02-01&to=2024-02-01').json
+        assert [duty['name'] for duty in duties['duties']] == ['Иванов']
+        assert 'недоступен' in duties['error']
+        
+        # После паузы одна пробная загрузка замыкает цепь
+        duty_app.upstream_breaker.open_until = 0
+        assert duty_app.refresh_schedule_cache() == "success"
+        assert duty_app.upstream_breaker.describe()['state'] == 'closed'
+        assert [duty.name for duty in duty_app.get_schedule_cache().state()[0]] == ['Петров']
+        
+        # 429 - квота исчерпана: без повторов, цепь не размыкается, следующие обновления ждут
+        worksheet.update_values([['01.02.2024'], ['Сидоров']])
+        worksheet.fail_next(make_api_error(429, retry_after=45))
+        assert duty_app.refresh_schedule_cache() == "quota_exceeded"
+        calls = worksheet.get_all_values_calls
+        assert duty_app.refresh_schedule_cache() == "quota_wait"
+        assert worksheet.get_all_values_calls == calls
+        assert duty_app.sheets_quota.remaining() == 0
+        assert duty_app.upstream_breaker.describe()['state'] == 'closed'
+        assert duty_app.get_refresh_delay() >= 40
+        assert 'duty_sheets_quota_remaining 0' in duty_app.app.test_client().get('/metrics').get_data(as_text=True)
+    finally:
+        duty_app.UPSTREAM_BACKOFF_BASE, duty_app.REFRESH_INTERVAL = backoff_base, refresh_interval
+        duty_app.upstream_breaker = duty_app.CircuitBreaker(
+            duty_app.BREAKER_THRESHOLD, duty_app.BREAKER_BASE_COOLDOWN, duty_app.BREAKER_MAX_COOLDOWN
+        )
+        duty_app.sheets_quota = duty_app.ReadQuota(duty_app.SHEETS_READ_QUOTA)
+        duty_app.schedule_caches = duty_app.create_schedule_caches()
+
+def test_cold_fetch_does_not_wait_out_long_retries():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, install_fake_client, make_api_error
+    
+    worksheet = FakeWorksheet([['01.02.2024'], ['Иванов']])
+    install_fake_client(duty_app, worksheet)
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    source = duty_app.SCHEDULE_SOURCES[0]
+    
+    # Пустой кэш: пауза 5 с больше UPSTREAM_COLD_DEADLINE - ожидающие запросы получают ошибку сразу
+    worksheet.fail_next(make_api_error(503, retry_after=5))
+    started = time.perf_counter()
+    status = duty_app.get_schedule_cache().get()[2]
+    assert status == 'api_error'
+    assert time.perf_counter() - started < 1
+    assert worksheet.get_all_values_calls == 1
+    
+    # Короткая пауза укладывается в срок - повтор в той же загрузке
+    worksheet.fail_next(make_api_error(503, retry_after=0))
+    assert duty_app.fetch_schedule_from_sheets(source)[2] == 'success'
+    assert worksheet.get_all_values_calls == 3
+
+def test_local_file_source_reloads_only_on_change():
+    duty_app = load_duty_app()
+    import openpyxl
+    
+    folder = tempfile.mkdtemp()
+    csv_path = os.path.join(folder, 'schedule.csv')
+    xlsx_path = os.path.join(folder, 'schedule.xlsx')
+    with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+        f.write('Неделя 1;01.02.2024;02.02.2024\n;Иванов;Петров (с 10:00)\n')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = 'График'
+    sheet.append(['Неделя 1', datetime(2024, 2, 1), '02.02'])
+    sheet.append([None, 'Сидоров', 'Кузнецов'])
+    workbook.save(xlsx_path)
+    
+    sources = duty_app.SCHEDULE_SOURCES
+    try:
+        duty_app.SCHEDULE_SOURCES = [
+            {'id': 'csv', 'title': 'CSV', 'type': 'file', 'path': csv_path, 'worksheet': None},
+            {'id': 'xlsx', 'title': 'XLSX', 'type': 'file', 'path': xlsx_path, 'worksheet': 'График'},
+        ]
+        duty_app.schedule_caches = duty_app.create_schedule_caches()
+        assert duty_app.refresh_all_schedules() == {'csv': 'success', 'xlsx': 'success'}
+        data = duty_app.get_schedule_cache('csv').state()[0]
+        assert [(duty.name, duty.cell_location) for duty in data] == [('Иванов', 'B1'), ('Петров', 'C1')]
+        xlsx_data = duty_app.get_schedule_cache('xlsx').state()[0]
+        assert [(duty.date_str, duty.name) for duty in xlsx_data] == [('01.02.2024', 'Сидоров'), ('02.02', 'Кузнецов')]
+        
+        # Файл не менялся - только stat, данные те же
+        assert duty_app.refresh_schedule_cache('csv') == "not_modified"
+        assert duty_app.get_schedule_cache('csv').state()[0] is data
+        
+        with open(csv_path, 'a', encoding='utf-8') as f:
+            f.write('\n03.02.2024;;\nМорозов;;\n')
+        assert duty_app.refresh_schedule_cache('csv') == "success"
+        assert [duty.name for duty in duty_app.get_schedule_cache('csv').state()[0]] == ['Иванов', 'Петров', 'Морозов']
+        
+        # Пропавший файл - ошибка, экраны получают последнюю прочитанную версию
+        os.remove(csv_path)
+        assert duty_app.refresh_schedule_cache('csv') == "not_found"
+        page = duty_app.app.test_client().get('/roster/csv')
+        assert page.status_code == 200
+    finally:
+        duty_app.SCHEDULE_SOURCES = sources
+        duty_app.schedule_caches = duty_app.create_schedule_caches()
+
+def test_name_cleaning_is_cached_and_shared():
+    duty_app = load_duty_app()
+    from fake_sheets import generate_grid
+    
+    grid = generate_grid(300, 20)
+    duty_app.clean_name.cache_clear()
+    first = duty_app.parse_schedule_grid(grid)
+    second = duty_app.parse_schedule_grid(grid)
+    
+    stats = duty_app.get_name_cache_stats()
+    # Разных ячеек с именами в таблице - десять, остальные обращения попадают в кэш
+    assert stats['misses'] == 10
+    assert stats['hits'] == 2 * len(first) - 10
+    assert stats['hit_rate'] > 0.95
+    
+    by_name = {}
+    for duty in first + second:
+        assert by_name.setdefault(duty.name, duty.name) is duty.name
+    assert duty_app.clean_name('Сидорова (с 10:00)') == 'Сидорова'
+    assert duty_app.clean_name('Новикова с 12:30') == 'Новикова'
+    assert duty_app.clean_name('Волкова<br>Зайцев') == 'Волкова, Зайцев'
+    
+    metrics = duty_app.app.test_client().get('/metrics').get_data(as_text=True)
+    assert f'duty_name_cache_requests_total{{result="miss"}} {stats["misses"]}' in metrics
+
+# Строка значения в текстовом формате Prometheus: имя{метки} значение
+METRIC_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+METRIC_LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\\n]|\\.)*)"(?:,|$)')
+
+def parse_metrics(text):
+    """Разбор ответа /metrics: {семейство: тип} и [(имя, метки, значение)] с проверкой формата"""
+    types = {}
+    samples = []
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            family, metric_type = line[len('# TYPE '):].split(' ')
+            assert family not in types, f"повторный TYPE: {line}"
+            types[family] = metric_type
+            continue
+        if line.startswith('#') or not line:
+            continue
+        match = METRIC_SAMPLE.match(line)
+        assert match, f"некорректная строка: {line!r}"
+        name, raw_labels, value = match.groups()
+        labels = {}
+        if raw_labels:
+            pairs = METRIC_LABEL.findall(raw_labels)
+            assert ','.join(f'{key}="{escaped}"' for key, escaped in pairs) == raw_labels, line
+            labels = {
+                key: re.sub(r'\\(.)', lambda m: {'n': '\n'}.get(m.group(1), m.group(1)), escaped)
+                for key, escaped in pairs
+            }
+        family = re.sub(r'_(bucket|sum|count)$', '', name)
+        if family not in types:
+            family = name
+        # Значение идет после TYPE своего семейства
+        assert family in types, f"нет TYPE для {name}"
+        samples.append((name, labels, float(value)))
+    return types, samples
+
+def test_metrics_are_valid_prometheus_text():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeClient, FakeSpreadsheet, FakeWorksheet
+    
+    # Идентификатор графика с кавычкой, обратной косой чертой и переводом строки
+    tricky_id = 'зал "Б"\\2\nэтаж'
+    client = FakeClient({
+        'https://example.com/evening': FakeSpreadsheet({'Вечер': FakeWorksheet([['01.02.2024'], ['Иванов']])}, 'evening'),
+        'https://example.com/hall': FakeSpreadsheet({'Зал': FakeWorksheet([['01.02.2024', '02.02.2024'], ['Петров', 'Сидоров']])}, 'hall'),
+    })
+    duty_app.get_google_sheets_client = lambda: client
+    duty_app.sheets_session.reset()
+    
+    sources = duty_app.SCHEDULE_SOURCES
+    try:
+        duty_app.SCHEDULE_SOURCES = [
+            {'id': 'evening', 'title': 'Вечер', 'url': 'https://example.com/evening', 'worksheet': 'Вечер'},
+            {'id': tricky_id, 'title': 'Зал', 'url': 'https://example.com/hall', 'worksheet': 'Зал'},
+        ]
+        duty_app.schedule_caches = duty_app.create_schedule_caches()
+        assert set(duty_app.refresh_all_schedules().values()) == {'success'}
+        duty_app.app.test_client().get('/')
+        
+        response = duty_app.app.test_client().get('/metrics')
+        assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+        types, samples = parse_metrics(response.get_data(as_text=True))
+    finally:
+        duty_app.SCHEDULE_SOURCES = sources
+        duty_app.schedule_caches = duty_app.create_schedule_caches()
+    
+    for metric in ('duty_sheets_fetch_seconds', 'duty_parse_schedule_seconds', 'duty_render_template_seconds'):
+        assert types[metric] == 'histogram'
+    for metric in ('duty_cache_requests_total', 'duty_requests_total', 'duty_upstream_fetches_total',
+                   'duty_export_requests_total', 'duty_rate_limit_rejections_total', 'duty_name_cache_requests_total'):
+        assert types[metric] == 'counter'
+    for metric in ('duty_cache_age_seconds', 'duty_cache_records', 'duty_name_cache_entries',
+                   'duty_sheets_quota_remaining', 'duty_upstream_circuit_open'):
+        assert types[metric] == 'gauge'
+    
+    # Гистограмма: накопительные корзины по возрастанию границ, последняя +Inf = _count
+    fetch_series = {}
+    for name, labels, value in samples:
+        if name.startswith('duty_sheets_fetch_seconds'):
+            fetch_series.setdefault(labels['roster'], []).append((name, labels, value))
+    # Счетчики процесса общие для всех тестов - проверяем серии этого теста
+    assert {'evening', tricky_id} <= set(fetch_series)
+    for series in fetch_series.values():
+        buckets = [(labels['le'], value) for name, labels, value in series if name.endswith('_bucket')]
+        bounds = [float(le) for le, _ in buckets]
+        counts = [value for _, value in buckets]
+        assert buckets[-1][0] == '+Inf'
+        assert bounds == sorted(bounds) and counts == sorted(counts)
+        totals = {name: value for name, _, value in series if not name.endswith('_bucket')}
+        assert totals['duty_sheets_fetch_seconds_count'] == counts[-1] >= 1
+        assert totals['duty_sheets_fetch_seconds_sum'] > 0
+    
+    # Gauge кэша - для каждого графика, метка восстанавливается без искажений
+    records = {labels['roster']: value for name, labels, value in samples if name == 'duty_cache_records'}
+    ages = {labels['roster']: value for name, labels, value in samples if name == 'duty_cache_age_seconds'}
+    assert records == {'evening': 1, tricky_id: 2}
+    assert set(ages) == {'evening', tricky_id} and all(age >= 0 for age in ages.values())
+
+def test_load_test_reports_latency_and_rate_limits():
+    duty_app = load_duty_app()
+    import loadtest
+    
+    loadtest.prepare_app(rows=60, cols=10)
+    mix = loadtest.parse_mix('/=3,/refresh=1')
+    # Два экрана на восемь клиентов: часть запросов упирается в лимит клиента
+    report = loadtest.run_load_test(mix, clients=8, duration=0.5, screens=2)
+    
+    routes = report['routes']
+    assert set(routes) == {'/', '/refresh', 'всего'}
+    total = routes['всего']
+    assert total['requests'] == routes['/']['requests'] + routes['/refresh']['requests'] > 0
+    assert 0 < total['p50_ms'] <= total['p95_ms'] <= total['p99_ms']
+    assert total['rate_limit_fraction'] > 0
+    assert total['error_fraction'] == 0
+    assert report['data_status'].get('cached', 0) > 0
+    assert loadtest.classify(503, None) == 'error'
+    assert loadtest.classify(200, {'status': 'success', 'retry_after': 15}) == 'rate_limit'
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+
+def test_debug_reads_cache_only_and_profiles_on_request():
+    duty_app = load_duty_app()
+    from fake_sheets import FakeWorksheet, generate_grid, install_fake_client
+    
+    worksheet = FakeWorksheet(generate_grid(60, 10))
+    install_fake_client(duty_app, worksheet)
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    client = duty_app.app.test_client()
+    
+    # Пустой кэш: /debug не запускает загрузку
+    empty = client.get('/debug').json
+    assert empty['cache_status'] == 'empty' and empty['records']['total'] == 0
+    assert worksheet.get_all_values_calls == 0
+    
+    duty_app.refresh_schedule_cache()
+    schedule = duty_app.get_schedule_cache().state()[0]
+    page = client.get('/debug?page=2&per_page=7').json
+    assert page['records']['total'] == len(schedule)
+    assert page['records']['pages'] == -(-len(schedule) // 7)
+    assert [item['date'] for item in page['records']['items']] == [duty.date.isoformat() for duty in schedule[7:14]]
+    
+    filtered = client.get('/debug?name=петров&from=2000-01-03&to=2000-01-20&per_page=500').json
+    expected = [duty for duty in schedule.between(date(2000, 1, 3), date(2000, 1, 20)) if duty.name == 'Петров']
+    assert filtered['records']['total'] == len(expected) > 0
+    assert client.get('/debug?from=вчера').status_code == 400
+    assert worksheet.get_all_values_calls == 1
+    
+    # Профилирование выключено - ?profile=1 ничего не меняет
+    assert 'records' in client.get('/debug?profile=1').json
+    try:
+        duty_app.PROFILING_ENABLED = True
+        profile = client.get('/?profile=1&profile_top=5').json
+        assert profile['status_code'] == 200
+        assert len(profile['top']) == 5
+        assert any('index' in entry['function'] for entry in profile['top'])
+        assert client.get('/').mimetype == 'text/html'
+    finally:
+        duty_app.PROFILING_ENABLED = False
+
+def test_static_assets_fingerprinted_and_compressed():
+    duty_app = load_duty_app()
+    import gzip
+    from fake_sheets import FakeWorksheet, install_fake_client
+    
+    install_fake_client(duty_app, FakeWorksheet([[date.today().strftime('%d.%m.%Y')], ['Иванов']]))
+    duty_app.schedule_caches = duty_app.create_schedule_caches()
+    duty_app.refresh_schedule_cache()
+    client = duty_app.app.test_client()
+    headers = {'Accept-Encoding': 'gzip, deflate'}
+    
+    # Страница ссылается на стили по адресу с хэшем содержимого
+    page = client.get('/', headers=headers)
+    assert page.headers['Content-Encoding'] == 'gzip'
+    html = gzip.decompress(page.get_data()).decode('utf-8')
+    assert 'Иванов' in html
+    css_url = re.search(r'href="(/static/style\.[0-9a-f]{12}\.css)"', html).group(1)
+    
+    # Повторная загрузка страницы - 304 без тела
+    revalidated = client.get('/', headers=dict(headers, **{'If-None-Match': page.headers['ETag']}))
+    assert revalidated.status_code == 304 and revalidated.get_data() == b''
+    
+    css = client.get(css_url, headers=headers)
+    with open(os.path.join(duty_app.app.static_folder, 'style.css'), 'rb') as f:
+        original = f.read()
+    assert css.status_code == 200
+    assert css.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(css.get_data()) == original
+    assert len(css.get_data()) < len(original) / 2
+    assert 'immutable' in css.headers['Cache-Control'] and 'max-age=31536000' in css.headers['Cache-Control']
+    assert 'Accept-Encoding' in css.headers['Vary']
+    
+    # Без поддержки сжатия - исходный файл; по обычному имени - с проверкой ETag
+    plain = client.get('/static/style.css')
+    assert plain.get_data() == original and 'Content-Encoding' not in plain.headers
+    assert 'no-cache' in plain.headers['Cache-Control']
+
 if __name__ == '__main__':
     test_parsing()
\ No newline at end of file